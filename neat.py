@@ -30,8 +30,7 @@ client_port = 3532
 kv_file = 'neat-main.kv'
 
 import rig
-import rig.kenwood_hf as kenwood_hf
-from neatc import NeatC
+import rig.enums as enums
 #import rigctld
 import math
 import re
@@ -61,10 +60,11 @@ rigobj = None
 #rigctldThread_sub = None
 rigctl_main = None
 rigctl_sub = None
-vfoa = int(kenwood_hf.tuningMode.VFOA)
-vfob = int(kenwood_hf.tuningMode.VFOB)
-mem = int(kenwood_hf.tuningMode.MEMORY)
-call = int(kenwood_hf.tuningMode.CALL)
+vfoa = int(enums.tuningMode.VFOA)
+vfob = int(enums.tuningMode.VFOB)
+mem = int(enums.tuningMode.MEMORY)
+call = int(enums.tuningMode.CALL)
+frequency_ranges = rig.RangeIndex(segment = bandplan)
 
 # See https://new.reddit.com/r/kivy/comments/v5joow/labeltext_can_no_longer_be_updated_after_f1/
 # Monkey patch hack
@@ -90,7 +90,7 @@ class Meter(Gauge):
 	accel_up_mult = NumericProperty(1.1)
 	accel_down_initial = NumericProperty(-0.02)
 	accel_down_mult = NumericProperty(1.1)
-	click_selects = NumericProperty(int(kenwood_hf.meter.UNSELECTED))
+	click_selects = NumericProperty(int(enums.meter.UNSELECTED))
 	calculation = StringProperty()
 	active_state = StringProperty()
 	active_value = NumericProperty()
@@ -121,7 +121,7 @@ class Meter(Gauge):
 		self.bind(active_value=self.activeStateUpdate)
 
 	def on_touch_down(self, touch):
-		if self.click_selects == kenwood_hf.meter.UNSELECTED:
+		if self.click_selects == enums.meter.UNSELECTED:
 			return False
 		if not 'button' in touch.profile:
 			return False
@@ -131,7 +131,7 @@ class Meter(Gauge):
 			return False
 		if touch.pos[1] < (self._gauge.pos[1] + self._gauge.size[1] * 0.4):
 			return False
-		rigobj.meter_type = kenwood_hf.meter(self.click_selects)
+		rigobj.meter_type = enums.meter(self.click_selects)
 
 	def _newActiveState(self, *args):
 		if self._old_active_state != '':
@@ -317,9 +317,9 @@ class FreqDisplay(Label):
 		if self.vfo_box is not None and self.vfo_box.vfo != vfoa and self.vfo_box.vfo != vfob:
 			colour = '[color=' + kivy.utils.get_hex_from_color(self.inactiveColour) + ']'
 		if self.bandplanColour:
-			for bc in bandplan.values():
-				if bc['low'] <= self.freqValue and bc['high'] >= self.freqValue:
-					colour = '[color=' + kivy.utils.get_hex_from_color(bc['colour']) + ']'
+			segment = frequency_ranges.band(self.freqValue, 'segment')
+			if segment is not None:
+				colour = '[color=' + kivy.utils.get_hex_from_color(bandplan[segment]['colour']) + ']'
 		if m is not None:
 			e = m.end()
 			new = '[b][color=' + kivy.utils.get_hex_from_color(self.zeroColour) + ']' + new[0:e] + '[/color]' + colour + new[e:] + '[/color][/b]'
@@ -327,6 +327,12 @@ class FreqDisplay(Label):
 			new = '[b]' + colour + new + '[/color][/b]'
 		self.text = new
 
+	# Tunes by the step from the displayed frequency and shows the
+	# target until the rig reports it
+	def _tune(self, prop, new):
+		rigobj.tune(prop, new - self.freqValue)
+		self.freqValue = new
+
 	def on_touch_down(self, touch):
 		if not 'button' in touch.profile:
 			return False
@@ -367,20 +373,20 @@ class FreqDisplay(Label):
 					new = self.freqValue - stepsize
 		if self.vfo_box.vfo == vfoa:
 			if hasattr(rigobj, 'vfoa_frequency'):
-				rigobj.vfoa_frequency = new
+				self._tune('vfoa_frequency', new)
 			else:
-				rigobj.vfo_frequency = new
+				self._tune('vfo_frequency', new)
 		elif self.vfo_box.vfo == vfob:
 			if hasattr(rigobj, 'vfoa_frequency'):
-				rigobj.vfob_frequency = new
+				self._tune('vfob_frequency', new)
 			else:
-				rigobj.vfo_frequency = new
-		elif self.vfo_box.vfo == mem and rigobj.rx_tuning_mode == kenwood_hf.tuningMode.MEMORY:
+				self._tune('vfo_frequency', new)
+		elif self.vfo_box.vfo == mem and rigobj.rx_tuning_mode == enums.tuningMode.MEMORY:
 			if up:
 				rigobj.up = True
 			else:
 				rigobj.down = True
-		elif self.vfo_box.vfo == call and rigobj.rx_tuning_mode == kenwood_hf.tuningMode.CALL:
+		elif self.vfo_box.vfo == call and rigobj.rx_tuning_mode == enums.tuningMode.CALL:
 			if up:
 				rigobj.band_up = True
 			else:
@@ -581,7 +587,7 @@ class VFOBoxButton(ToggleButton):
 	def on_press(self):
 		if self.vfoID != self.parent.vfo and self.parent.rig_state != '':
 			self.state = 'normal'
-			setattr(rigobj, self.parent.rig_state, kenwood_hf.tuningMode(self.vfoID))
+			setattr(rigobj, self.parent.rig_state, enums.tuningMode(self.vfoID))
 
 class VFOBox(GridLayout):
 	rig_state = StringProperty()
@@ -1299,7 +1305,7 @@ class NeatApp(App):
 		self.config = ConfigParser()
 		self.build_config(self.config)
 		self.config.read('neat.ini')
-		rigobj = NeatC(port=client_port)
+		rigobj = rig.open_rig('neatc', port=client_port)
 		self.rig = rigobj
 		ui = Builder.load_file(kv_file)
 		Window.size = ui.size
@@ -1,17 +1,49 @@
 import rig
+import rig.binary as binary
 import json
 import selectors
 import socket
+import sys
 import threading
 from copy import deepcopy
+from time import monotonic
 
 class NeatCStateValue(rig.StateValue):
+	# Seconds a tuning target is added to before neatd reports it
+	TUNE_TIMEOUT = 1
+
 	def __init__(self, neatcc, name, **kwargs):
 		super().__init__(neatcc._neatc, **kwargs)
 		self._name = name
 		self._neatcc = neatcc
-		self._neatcc.append(b'watch '+bytes(self._name, 'ascii')+b'\n')
-		self._neatcc.append(b'get '+bytes(self._name, 'ascii')+b'\n')
+		self._replied = threading.Event()
+		self._target = None
+		self._tuned_at = None
+		self.add_set_callback(self._reply)
+
+	def _reply(self, state, value):
+		if value == self._target:
+			self._target = None
+		self._replied.set()
+
+	# Adds to the last target rather than the cached value, so tuning
+	# faster than neatd reports back isn't lost
+	def tune(self, delta):
+		now = monotonic()
+		base = self._target
+		if base is None or now - self._tuned_at > self.TUNE_TIMEOUT:
+			base = self._cached
+		if base is None:
+			return
+		self._target = base + delta
+		self._tuned_at = now
+		self.value = self._target
+
+	# Has neatd query the rig, and waits for the value to come back
+	def _refresh(self):
+		self._replied.clear()
+		self._neatcc.get(self._name, 0)
+		self._replied.wait(1)
 
 	@property
 	def value(self):
@@ -21,10 +53,10 @@ class NeatCStateValue(rig.StateValue):
 	def value(self, value):
 		if isinstance(value, rig.StateValue):
 			raise Exception('Forgot to add ._cached!')
-		self._neatcc.append(b'set '+bytes(self._name + '=' + json.dumps(value), 'ascii')+b'\n')
+		self._neatcc.set(self._name, value)
 
 	def __del__(self):
-		self._neatcc.append(b'unwatch '+bytes(self._name, 'ascii')+b'\n')
+		self._neatcc.unwatch(self._name)
 		try:
 			super().__del__()
 		except AttributeError:
@@ -38,6 +70,13 @@ class NeatCConnection:
 		self._sel_lock = sel_lock
 		self._inbuf = b''
 		self._outbuf = b''
+		self.bytes_received = 0
+		# In binary mode, the value IDs by name and the states by ID
+		self._ids = None
+		self._states = []
+		self._by_name = {}
+		# True once the reply to "binary" has been received
+		self._frames = False
 		self.mask = selectors.EVENT_READ | selectors.EVENT_WRITE
 		conn.setblocking(False)
 		self._sel_lock.acquire()
@@ -63,26 +102,35 @@ class NeatCConnection:
 				self._neatc._state[cmd[0:eq].decode('ascii')]._cached = json.loads(cmd[eq+1:].decode('ascii'))
 			else:
 				self._neatc._state[cmd[0:ob].decode('ascii')][int(cmd[ob+1:cb].decode('ascii'))]._cached = json.loads(cmd[eq+1:].decode('ascii'))
+		elif cmd == b'binary':
+			self._frames = True
 		elif cmd[0:5] == b'list ':
-			cmd = cmd[5:]
-			while len(cmd) > 0:
-				sp = cmd.find(b' ')
-				if sp == -1:
-					name = cmd[0:].decode('ascii')
-					cmd = b''
-				else:
-					name = cmd[0:sp].decode('ascii')
-					cmd = cmd[sp+1:]
+			names = cmd[5:].decode('ascii').split()
+			if self._neatc._binary:
+				# Switched before the states send their watches and gets
+				self.append(b'binary\n')
+				ids = binary.expand_names(names)
+				self._ids = {ids[i]: i for i in range(len(ids))}
+			for name in names:
 				if name[-1:] == ']':
 					ob = name.find('[')
 					length = int(name[ob+1:-1])
 					self._neatc._state[name[:ob]] = [None] * length
 					for i in range(length):
 						self._neatc._state[name[:ob]][i] = NeatCStateValue(self, name[:ob] + '['+str(i)+']')
+						self._states.append(self._neatc._state[name[:ob]][i])
 				else:
 					self._neatc._state[name] = NeatCStateValue(self, name)
-			if self._neatc._list_event is not None:
-				self._neatc._list_event.set()
+					self._states.append(self._neatc._state[name])
+			for state in self._states:
+				self._by_name[state._name] = state
+			# NeatC is ready once the reply to the mget arrives
+			self.command(b'mwatch *' + self._neatc._watch_options)
+			self.command(b'mget *')
+		elif cmd[0:5] == b'mget ':
+			for name, value in json.loads(cmd[5:].decode('ascii')).items():
+				self._by_name[name]._cached = value
+			self._ready()
 		else:
 			eq = cmd.find(b'=')
 			ob = cmd.find(b'[')
@@ -98,9 +146,64 @@ class NeatCConnection:
 			else:
 				self._neatc._state[cmd[0:ob].decode('ascii')][int(cmd[ob+1:cb].decode('ascii'))]._cached = json.loads(cmd[eq+1:].decode('ascii'))
 				
+	def handle_frame(self, payload):
+		msg_type, vid, rest = binary.parse(payload)
+		if msg_type == binary.TEXT:
+			self.handle(rest)
+		elif msg_type == binary.VALUE or msg_type == binary.WATCHED:
+			self._states[vid]._cached = binary.decode_value(rest)[0]
+		elif msg_type == binary.VALUES:
+			for vid, value in binary.decode_values(rest):
+				self._states[vid]._cached = value
+			self._ready()
+		else:
+			raise Exception('Unexpected message type '+str(msg_type))
+
+	def _ready(self):
+		if self._neatc._ready_event is not None:
+			self._neatc._ready_event.set()
+
+	# Sends a text command, as a TEXT message in binary mode
+	def command(self, line):
+		if self._ids is None:
+			self.append(line+b'\n')
+		else:
+			self.append(binary.text(line))
+
+	def watch(self, name):
+		if self._ids is None:
+			self.append(b'watch '+bytes(name, 'ascii')+b'\n')
+		else:
+			self.append(binary.command(binary.WATCH, self._ids[name]))
+
+	def unwatch(self, name):
+		if self._ids is None:
+			self.append(b'unwatch '+bytes(name, 'ascii')+b'\n')
+		else:
+			self.append(binary.command(binary.UNWATCH, self._ids[name]))
+
+	# max_age is the oldest cached value neatd can reply with, in seconds
+	def get(self, name, max_age = None):
+		if self._ids is None:
+			if max_age is None:
+				self.append(b'get '+bytes(name, 'ascii')+b'\n')
+			else:
+				self.append(b'get '+bytes(name+' '+str(max_age), 'ascii')+b'\n')
+		else:
+			self.append(binary.get(self._ids[name], max_age))
+
+	def set(self, name, value):
+		if self._ids is None:
+			self.append(b'set '+bytes(name + '=' + json.dumps(value), 'ascii')+b'\n')
+		else:
+			self.append(binary.message(binary.SET, self._ids[name], value))
+
 	def append(self, buf):
 		if buf is None:
 			return
+		# Nothing more can be sent once the connection is closed
+		if self._conn is None:
+			return
 		self._outbuf += buf
 		if (not self.mask & selectors.EVENT_WRITE) and self._conn.fileno() != -1:
 			self.mask |= selectors.EVENT_WRITE
@@ -117,13 +220,18 @@ class NeatCConnection:
 		self._conn = None
 
 	def read(self):
-		data = self._conn.recv(1500)
+		data = self._conn.recv(65536)
 		if data:
+			self.bytes_received += len(data)
 			self._inbuf += data
-			while b'\n' in self._inbuf:
+			while not self._frames and b'\n' in self._inbuf:
 				i = self._inbuf.find(b'\n')
 				self.handle(self._inbuf[0:i])
 				self._inbuf = self._inbuf[i+1:]
+			if self._frames:
+				payloads, self._inbuf = binary.frames(self._inbuf)
+				for payload in payloads:
+					self.handle_frame(payload)
 		else:
 			self.close()
 
@@ -147,31 +255,59 @@ class NeatC(rig.Rig):
 		self._verbose = kwargs.get('verbose', False)
 		self._address = kwargs.get('address', 'localhost')
 		self._port = kwargs.get('port', 3532)
+		# Use the binary protocol from rig.binary rather than text lines
+		self._binary = kwargs.get('binary', False)
+		# For slow links, watch_rate limits the updates neatd sends for
+		# each value to that many per second, and latest_only has it skip
+		# any that are replaced before they're sent
+		self._watch_options = b''
+		if kwargs.get('watch_rate') is not None:
+			self._watch_options += bytes(' rate=' + str(kwargs['watch_rate']), 'ascii')
+		if kwargs.get('latest_only', False):
+			self._watch_options += b' latest-only'
 		self._conn = None
-		self._list_event = threading.Event()
+		self._ready_event = threading.Event()
 		self._sel = selectors.DefaultSelector()
 		self._sel_lock = threading.Lock()
 		self._neatc_thread = threading.Thread(target = self.neatc_thread, name = 'neatc')
 		self._neatc_thread.start()
-		self._list_event.wait()
-		self._list_event = None
+		self._ready_event.wait()
+		self._ready_event = None
+
+	# Gets all of the states with one mget
+	def _refresh_many(self, states):
+		for state in states:
+			state._replied.clear()
+		self._conn.command(bytes(' '.join(['mget'] + [state._name for state in states] + ['0']), 'ascii'))
+		deadline = monotonic() + 1
+		for state in states:
+			state._replied.wait(max(deadline - monotonic(), 0))
 
 	def terminate(self):
 		self._terminate = True
 		self._neatc_thread.join()
+		self._dispatcher.terminate()
+		self._terminated()
 
 	def neatc_thread(self):
 		sock = socket.create_connection((self._address, self._port))
 		self._conn = NeatCConnection(self, self._sel, self._sel_lock, sock)
-		while not self._terminate:
-			#self._sel_lock.acquire()
-			events = self._sel.select(0.1)
-			#self._sel_lock.release()
-			for key, mask in events:
-				if isinstance(key.data, NeatCConnection):
-					if mask & selectors.EVENT_WRITE:
-						key.data.write()
-					if mask & selectors.EVENT_READ:
-						key.data.read()
-				else:
-					print(str(key.data)+" isn't a NeatCConnection", file = sys.stderr)
+		# The loop also ends when the connection is closed, which
+		# terminates the rig
+		try:
+			while not self._terminate:
+				#self._sel_lock.acquire()
+				events = self._sel.select(0.1)
+				#self._sel_lock.release()
+				for key, mask in events:
+					if isinstance(key.data, NeatCConnection):
+						if mask & selectors.EVENT_WRITE:
+							key.data.write()
+						if mask & selectors.EVENT_READ:
+							key.data.read()
+					else:
+						print(str(key.data)+" isn't a NeatCConnection", file = sys.stderr)
+		except ConnectionError:
+			print('Connection unexpectedly closed', file=sys.stderr)
+		finally:
+			self._terminated()
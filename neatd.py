@@ -1,55 +1,168 @@
 import rig
-import rig.kenwood_hf as kenwood_hf
+import rig.binary as binary
 import rigctld
 import threading
+import asyncio
 import configparser
 import json
-import socket
-import selectors
 import sys
 import bitarray
 import time
 import queue
+from fnmatch import fnmatchcase
+from functools import partial
 
-class NeatDCallback:
-	def __init__(self, neatd_connection, prop, name, **kwargs):
+# How often, in seconds, a connection with unsent output checks whether
+# it can send held latest-only values
+BACKLOG_RETRY = 0.05
+
+# Values json can't encode are sent as null, apart from bitarrays
+def _json_default(value):
+	if isinstance(value, bitarray.bitarray):
+		return list(value)
+	return None
+
+# One change to a watched value.  Each encoding of it is made the first
+# time a connection needs it, then shared by all of them.
+class NeatDChange:
+	def __init__(self, name, value):
+		if isinstance(value, bitarray.bitarray):
+			value = list(value)
+		self.name = name
+		self._value = value
+		self._text = None
+		self._binary = {}
+
+	# The text mode line
+	def text(self):
+		if self._text is None:
+			try:
+				self._text = b'watched ' + self.name + bytes('=' + json.dumps(self._value), 'ascii') + b'\n'
+			except:
+				print('3Exception ignored: ', sys.exc_info()[0])
+				self._text = b'watched ' + self.name + b'=null\n'
+		return self._text
+
+	# The binary mode WATCHED message using value ID vid
+	def binary(self, vid):
+		ret = self._binary.get(vid)
+		if ret is None:
+			try:
+				ret = binary.message(binary.WATCHED, vid, self._value)
+			except:
+				print('3Exception ignored: ', sys.exc_info()[0])
+				ret = binary.message(binary.WATCHED, vid, None)
+			self._binary[vid] = ret
+		return ret
+
+# Every connection watching one value.  This has the only modify
+# callback for it, which passes each change to the event loop thread to
+# send to all of them, so each change is encoded once however many
+# connections are watching.  add(), remove() and send() are only called
+# on the event loop thread.
+class NeatDWatchers:
+	def __init__(self, neatd, prop, name):
+		self._neatd = neatd
 		self._prop = prop
 		self._name = name
-		self._neatd_connection = neatd_connection
-		try:
-			self._prop.add_modify_callback(self.callback)
-		except:
-			print('1Exception ignored: ', sys.exc_info()[0])
+		self._callbacks = ()
+		self._handle = self._prop.add_modify_callback(self.callback)
 
-	def __del__(self):
-		try:
-			self._prop.remove_modify_callback(self.callback)
-		except:
-			print('2Exception ignored: ', sys.exc_info()[0])
+	def add(self, cb):
+		self._callbacks += (cb,)
+
+	def remove(self, cb):
+		self._callbacks = tuple(c for c in self._callbacks if c is not cb)
+		if len(self._callbacks) == 0:
+			try:
+				self._prop.remove_modify_callback(self._handle)
+			except:
+				print('2Exception ignored: ', sys.exc_info()[0])
+			del self._neatd._watchers[(self._prop, self._name)]
 
 	def callback(self, value):
-		try:
-			if isinstance(value, bitarray.bitarray):
-				value = list(value)
-			self._neatd_connection.append(bytes('watched ' + self._name + '=' + json.dumps(value), 'ascii')+b'\n')
-		except:
-			print('3Exception ignored: ', sys.exc_info()[0])
-			self._neatd_connection.append(b'watched ' + bytes(self._name, 'ascii') + b'=null\n')
+		self._neatd.fan_out(self, NeatDChange(self._name, value))
+
+	def send(self, change):
+		for cb in self._callbacks:
+			cb.callback(change)
+
+class NeatDCallback:
+	def __init__(self, neatd_connection, prop, name, **kwargs):
+		self._neatd_connection = neatd_connection
+		# With either of these set, only the newest change is kept until
+		# it's sent, and with rate, no more than rate are sent per second
+		self.rate = kwargs.get('rate')
+		self.latest_only = kwargs.get('latest_only', False)
+		# When the next change can be sent
+		self.due = 0
+		self._watchers = neatd_connection._neatd.watchers(prop, name)
+		self._watchers.add(self)
+
+	def remove(self):
+		self._watchers.remove(self)
+
+	def callback(self, change):
+		if self.rate is None and not self.latest_only:
+			self._neatd_connection.watched(change)
+		else:
+			self._neatd_connection.watched_latest(self, change)
+
+# Answers gets for values which need to be read from the rig, so the
+# event loop never waits for it.  Gets which arrive while a batch
+# is being read are read together in the next one.
+class NeatDFetcher:
+	def __init__(self):
+		self._queue = queue.Queue()
+		self._thread = threading.Thread(target = self._fetch_thread, name = 'neatd fetch', daemon = True)
+		self._thread.start()
+
+	# Reads svs from neatd_connection's rig, then calls done()
+	def fetch(self, neatd_connection, svs, done):
+		self._queue.put((neatd_connection, svs, done))
+
+	def _fetch_thread(self):
+		while True:
+			requests = [self._queue.get()]
+			while not self._queue.empty():
+				requests.append(self._queue.get())
+			states = {}
+			for neatd_connection, svs, done in requests:
+				states.setdefault(neatd_connection._rig, []).extend(svs)
+			for rigobj, svs in states.items():
+				try:
+					rigobj._refresh_many(svs)
+				except:
+					print('10Exception ignored: ', sys.exc_info()[0])
+			for neatd_connection, svs, done in requests:
+				try:
+					done()
+				except:
+					print('15Exception ignored: ', sys.exc_info()[0])
 
 class NeatDConnection:
-	def __init__(self, rig, neatd, conn):
+	def __init__(self, rig, neatd, reader, writer):
 		self._neatd = neatd
-		self._conn = conn
+		self._reader = reader
+		self._writer = writer
 		self._rig = rig
-		self.inbuf = b''
 		self.outbuf = b''
-		# This lock protects outbuf, mask, closed, and the actual close() call
+		# This lock protects outbuf and flush_scheduled, since append()
+		# is called from callback threads
 		self.outbuf_lock = threading.Lock()
-		self.mask = selectors.EVENT_READ | selectors.EVENT_WRITE
+		self.flush_scheduled = False
 		self._callbacks = {}
 		self.closed = False
-
-	# TODO: Clean up all watchers in close() and del...
+		# Once the client sends "binary", the names in list order and
+		# a dict mapping them back to their IDs
+		self._binary_names = None
+		self._binary_ids = None
+		# The newest unsent NeatDChange for each NeatDCallback with rate or
+		# latest_only set, and the timer which sends the ones not yet
+		# due.  These are protected by outbuf_lock.
+		self._pending = {}
+		self._timer = None
+		self._timer_due = None
 
 	def _getsv(self, bname):
 		try:
@@ -77,6 +190,122 @@ class NeatDConnection:
 				return getattr(a, name)[index]
 		return None
 
+	def _set(self, bname, value):
+		sv = self._getsv(bname)
+		if sv is not None and not isinstance(sv, list):
+			try:
+				sv.value = value
+			except:
+				print('5Exception ignored: ', sys.exc_info()[0])
+		else:
+			print('Not done, sv = '+str(sv)+', isinstance(sv, list) = '+str(isinstance(sv, list)))
+
+	def _get(self, bname, max_age):
+		sv = self._getsv(bname)
+		if isinstance(sv, rig.StateValue) and sv._stale(max_age):
+			# Answered once the rig replies
+			self._neatd.fetcher.fetch(self, [sv], lambda: self.reply(bname, sv, sv._peek()))
+		elif sv is not None:
+			self.reply(bname, sv, sv.get(max_age))
+		else:
+			self.reply(bname, sv, None)
+
+	# Watching an already watched value changes its options
+	def _watch(self, bname, rate = None, latest_only = False):
+		sv = self._getsv(bname)
+		if isinstance(sv, list):
+			return
+		if sv in self._callbacks:
+			self._callbacks[sv].rate = rate
+			self._callbacks[sv].latest_only = latest_only
+			return
+		try:
+			self._callbacks[sv] = NeatDCallback(self, sv, bname, rate = rate, latest_only = latest_only)
+		except:
+			print('7Exception ignored: ', sys.exc_info()[0])
+
+	def _unwatch(self, bname):
+		sv = self._getsv(bname)
+		if isinstance(sv, list):
+			return
+		if sv in self._callbacks:
+			with self.outbuf_lock:
+				self._pending.pop(self._callbacks[sv], None)
+			self._callbacks.pop(sv).remove()
+
+	# Splits the arguments to watch and mwatch into the names and a dict
+	# of the options for _watch()
+	def _watch_args(self, args):
+		names = []
+		options = {}
+		for arg in args:
+			if arg == b'latest-only':
+				options['latest_only'] = True
+			elif arg[0:5] == b'rate=':
+				try:
+					rate = float(arg[5:].decode('ascii'))
+					if rate <= 0:
+						raise Exception('Invalid rate '+str(rate))
+					options['rate'] = rate
+				except:
+					print('11Exception ignored: ', sys.exc_info()[0])
+			else:
+				names.append(arg)
+		return names, options
+
+	# Replies to all of bnames with one mget line, or a VALUES message in
+	# binary mode
+	def _mget(self, bnames, max_age):
+		svs = [self._getsv(bname) for bname in bnames]
+		stale = [sv for sv in svs if isinstance(sv, rig.StateValue) and sv._stale(max_age)]
+		if len(stale) > 0:
+			# Answered once the rig replies
+			self._neatd.fetcher.fetch(self, stale, lambda: self.reply_many(bnames, svs))
+		else:
+			self.reply_many(bnames, svs)
+
+	def _mset(self, values):
+		with self._rig.batch():
+			for name, value in values.items():
+				try:
+					bname = bytes(name, 'ascii')
+				except:
+					print('13Exception ignored: ', sys.exc_info()[0])
+					continue
+				self._set(bname, value)
+
+	# Returns the names a list of names and patterns refer to.  Names
+	# containing a * are matched against all of the names, with list
+	# values expanded to name[n].
+	def _names(self, args):
+		ret = []
+		all_names = None
+		for arg in args:
+			if b'*' in arg:
+				if all_names is None:
+					all_names = binary.expand_names(self._list_names())
+				try:
+					pattern = arg.decode('ascii')
+				except:
+					print('14Exception ignored: ', sys.exc_info()[0])
+					continue
+				ret.extend(bytes(name, 'ascii') for name in all_names if fnmatchcase(name, pattern))
+			else:
+				ret.append(arg)
+		return ret
+
+	# The names sent in reply to list, list values as name[length]
+	def _list_names(self):
+		ret = []
+		for a, p in self._rig._state.items():
+			if isinstance(p, rig.StateValue):
+				ret.append(a)
+		for a, p in self._rig.__dict__.items():
+			if a[0:1] != '_':
+				if isinstance(p, list):
+					ret.append(a+'['+str(len(getattr(self._rig, a)))+']')
+		return ret
+
 	def handle(self, cmd):
 		if self._neatd.verbose:
 			print('NeatD command: '+str(cmd), file=sys.stderr)
@@ -86,108 +315,298 @@ class NeatDConnection:
 			if eq == -1:
 				self.close()
 			else:
-				sv = self._getsv(cmd[0:eq])
-				if sv is not None and not isinstance(sv, list):
-					try:
-						sv.value = json.loads(cmd[eq+1:].decode('ascii'))
-					except:
-						print('5Exception ignored: ', sys.exc_info()[0])
-				else:
-					print('Not done, sv = '+str(sv)+', isinstance(sv, list) = '+isinstance(sv, list))
+				try:
+					value = json.loads(cmd[eq+1:].decode('ascii'))
+				except:
+					print('5Exception ignored: ', sys.exc_info()[0])
+					return
+				self._set(cmd[0:eq], value)
 		elif cmd[0:4] == b'get ':
 			cmd = cmd[4:]
+			# Optional maximum age in seconds of the cached value
+			max_age = None
+			sp = cmd.find(b' ')
+			if sp != -1:
+				try:
+					max_age = float(cmd[sp+1:].decode('ascii'))
+				except:
+					print('8Exception ignored: ', sys.exc_info()[0])
+				cmd = cmd[0:sp]
+			self._get(cmd, max_age)
+		elif cmd[0:8] == b'history ':
+			# history <name> <ms> replies with [age, value] pairs for
+			# the values received in the last ms milliseconds
+			cmd = cmd[8:]
+			ms = None
+			sp = cmd.find(b' ')
+			if sp != -1:
+				try:
+					ms = float(cmd[sp+1:].decode('ascii'))
+				except:
+					print('9Exception ignored: ', sys.exc_info()[0])
+				cmd = cmd[0:sp]
+			val = None
 			sv = self._getsv(cmd)
-			if sv is not None:
-				val = sv.value
-				if isinstance(val, bitarray.bitarray):
-					val = list(val)
-			else:
-				val = None
+			if sv is not None and not isinstance(sv, list) and sv._history is not None:
+				times, values = sv._history.view()
+				now = time.monotonic()
+				cutoff = None if ms is None else now - ms / 1000
+				val = [[now - times[i], values[i]] for i in range(len(times)) if cutoff is None or times[i] >= cutoff]
+			self.append_line(b'history ' + cmd + bytes('=' + json.dumps(val), 'ascii'))
+		elif cmd[0:6] == b'watch ':
+			# watch <name> [rate=<per second>] [latest-only]
+			names, options = self._watch_args(cmd[6:].split())
+			for bname in names:
+				self._watch(bname, **options)
+		elif cmd[0:8] == b'unwatch ':
+			self._unwatch(cmd[8:])
+		elif cmd[0:5] == b'mget ':
+			# mget <name or pattern> ... [max_age]
+			args = cmd[5:].split()
+			max_age = None
+			try:
+				max_age = float(args[-1].decode('ascii'))
+				args.pop()
+			except (ValueError, IndexError):
+				pass
+			self._mget(self._names(args), max_age)
+		elif cmd[0:7] == b'mwatch ':
+			# Takes the same options as watch
+			names, options = self._watch_args(cmd[7:].split())
+			for bname in self._names(names):
+				self._watch(bname, **options)
+		elif cmd[0:9] == b'munwatch ':
+			for bname in self._names(cmd[9:].split()):
+				self._unwatch(bname)
+		elif cmd[0:5] == b'mset ':
+			# mset {"name": value, ...}
 			try:
-				if isinstance(sv, list):
-					cmd += bytes('[0:'+str(len(val))+']', 'ascii')
-				self.append(cmd + bytes('=' + json.dumps(val), 'ascii') + b'\n')
+				values = json.loads(cmd[5:].decode('ascii'))
+				if not isinstance(values, dict):
+					raise Exception('mset takes a JSON object')
 			except:
-				print('6Exception ignored: ', sys.exc_info()[0])
-				self.append(cmd + b'=null\n')
-		elif cmd[0:6] == b'watch ':
-			cmd = cmd[6:]
-			sv = self._getsv(cmd)
-			if isinstance(sv, list):
+				print('5Exception ignored: ', sys.exc_info()[0])
 				return
-			if sv in self._callbacks:
+			self._mset(values)
+		elif cmd == b'list':
+			self.append_line(bytes(' '.join(['list'] + self._list_names()), 'ascii'))
+		elif cmd == b'binary':
+			# Everything after the reply is framed, in both directions
+			names = [bytes(name, 'ascii') for name in binary.expand_names(self._list_names())]
+			with self.outbuf_lock:
+				self._append(self._line(b'binary'))
+				self._binary_names = names
+				self._binary_ids = {names[i]: i for i in range(len(names))}
+
+	def handle_frame(self, payload):
+		if self._neatd.verbose:
+			print('NeatD frame: '+str(payload), file=sys.stderr)
+		try:
+			msg_type, vid, rest = binary.parse(payload)
+		except:
+			print('12Exception ignored: ', sys.exc_info()[0])
+			return
+		if msg_type == binary.TEXT:
+			self.handle(rest)
+			return
+		if msg_type not in (binary.GET, binary.SET, binary.WATCH, binary.UNWATCH):
+			print('Unexpected message type '+str(msg_type), file=sys.stderr)
+			return
+		if vid >= len(self._binary_names):
+			print('Invalid value ID '+str(vid), file=sys.stderr)
+			return
+		bname = self._binary_names[vid]
+		if msg_type == binary.GET:
+			self._get(bname, binary.parse_max_age(rest))
+		elif msg_type == binary.SET:
+			try:
+				value = binary.decode_value(rest)[0]
+			except:
+				print('5Exception ignored: ', sys.exc_info()[0])
 				return
+			self._set(bname, value)
+		elif msg_type == binary.WATCH:
+			self._watch(bname)
+		elif msg_type == binary.UNWATCH:
+			self._unwatch(bname)
+
+	# Returns line as a text reply in the current mode.  outbuf_lock must
+	# be held.
+	def _line(self, line):
+		if self._binary_ids is None:
+			return line + b'\n'
+		return binary.text(line)
+
+	# Returns the reply sending value for bname, a VALUE or WATCHED message
+	# in binary mode and a line starting with prefix otherwise.
+	# outbuf_lock must be held.
+	def _encode(self, msg_type, prefix, bname, value):
+		if isinstance(value, bitarray.bitarray):
+			value = list(value)
+		vid = None if self._binary_ids is None else self._binary_ids.get(bname)
+		if vid is not None:
 			try:
-				self._callbacks[sv] = NeatDCallback(self, sv, cmd.decode('ascii'))
+				return binary.message(msg_type, vid, value)
 			except:
-				print('7Exception ignored: ', sys.exc_info()[0])
-		elif cmd[0:8] == b'unwatch ':
-			cmd = cmd[8:]
-			sv = self._getsv(cmd)
-			if isinstance(sv, list):
+				print('6Exception ignored: ', sys.exc_info()[0])
+				return binary.message(msg_type, vid, None)
+		try:
+			return self._line(prefix + bname + bytes('=' + json.dumps(value), 'ascii'))
+		except:
+			print('6Exception ignored: ', sys.exc_info()[0])
+			return self._line(prefix + bname + b'=null')
+
+	def reply(self, cmd, sv, val):
+		if isinstance(sv, list):
+			cmd += bytes('[0:'+str(len(val))+']', 'ascii')
+		with self.outbuf_lock:
+			self._append(self._encode(binary.VALUE, b'', cmd, val))
+
+	# May be called from any thread
+	def reply_many(self, bnames, svs):
+		values = [sv._peek() if isinstance(sv, rig.StateValue) else None for sv in svs]
+		with self.outbuf_lock:
+			if self._binary_ids is not None:
+				pairs = []
+				for i in range(len(bnames)):
+					vid = self._binary_ids.get(bnames[i])
+					if vid is not None:
+						if isinstance(values[i], bitarray.bitarray):
+							values[i] = list(values[i])
+						pairs.append((vid, values[i]))
+				try:
+					buf = binary.values(pairs)
+				except:
+					print('6Exception ignored: ', sys.exc_info()[0])
+					buf = binary.values([(vid, None) for vid, value in pairs])
+			else:
+				buf = self._line(b'mget ' + bytes(json.dumps({bnames[i].decode('ascii', 'replace'): values[i] for i in range(len(bnames))}, default = _json_default), 'ascii'))
+			self._append(buf)
+
+	# Returns the encoding of a NeatDChange for the current mode.
+	# outbuf_lock must be held.
+	def _encode_change(self, change):
+		if self._binary_ids is None:
+			return change.text()
+		vid = self._binary_ids.get(change.name)
+		if vid is None:
+			return binary.text(change.text()[:-1])
+		return change.binary(vid)
+
+	# Sends a change to a watched value, called by NeatDWatchers
+	def watched(self, change):
+		with self.outbuf_lock:
+			self._append(self._encode_change(change))
+
+	# Sends a change to a watched value with rate or latest_only set,
+	# replacing any unsent one
+	def watched_latest(self, cb, change):
+		with self.outbuf_lock:
+			self._pending[cb] = change
+			if self._timer_due is not None and self._timer_due <= cb.due:
+				# The timer will send it
 				return
-			if sv in self._callbacks:
-				del self._callbacks[sv]
-		elif cmd == b'list':
-			self.append(b'list')
-			for a, p in self._rig._state.items():
-				if isinstance(p, rig.StateValue):
-					self.append(b' ' + bytes(a, 'ascii'))
-			for a, p in self._rig.__dict__.items():
-				if a[0:1] != '_':
-					if isinstance(p, list):
-						self.append(b' ' + bytes(a+'['+str(len(getattr(self._rig, a)))+']', 'ascii'))
-			self.append(b'\n')
+			if not self.flush_scheduled:
+				self.flush_scheduled = True
+				self._neatd.schedule_flush(self)
 
+	def append_line(self, line):
+		with self.outbuf_lock:
+			self._append(self._line(line))
+
+	# May be called from any thread.  Everything appended before the
+	# event loop gets to it is written together.
 	def append(self, buf):
 		if buf is None:
 			return
 		with self.outbuf_lock:
-			self.outbuf += buf
-			if not (self.mask & selectors.EVENT_WRITE):
-				self.mask |= selectors.EVENT_WRITE
-				self._neatd.writeable_queue.put(self)
+			self._append(buf)
+
+	# outbuf_lock must be held
+	def _append(self, buf):
+		self.outbuf += buf
+		if not self.flush_scheduled:
+			self.flush_scheduled = True
+			self._neatd.schedule_flush(self)
+
+	# Called on the event loop thread
+	def flush(self):
+		now = time.monotonic()
+		# While earlier writes are still waiting to be sent, latest_only
+		# values are held back so newer ones can replace them
+		backlog = not self.closed and self._writer.transport.get_write_buffer_size() > 0
+		with self.outbuf_lock:
+			buf = self.outbuf
+			self.outbuf = b''
+			self.flush_scheduled = False
+			due = None
+			for cb in list(self._pending):
+				if backlog and cb.latest_only:
+					cb.due = max(cb.due, now + BACKLOG_RETRY)
+				if cb.due > now:
+					if due is None or cb.due < due:
+						due = cb.due
+				else:
+					buf += self._encode_change(self._pending.pop(cb))
+					if cb.rate is not None:
+						cb.due = now + 1 / cb.rate
+			if due is not None and not self.closed and (self._timer_due is None or due < self._timer_due):
+				if self._timer is not None:
+					self._timer.cancel()
+				self._timer_due = due
+				self._timer = asyncio.get_running_loop().call_later(due - now, self._timer_flush)
+		if self.closed or buf == b'':
+			return
+		if self._neatd.verbose:
+			print('NeatD response: '+str(buf), file=sys.stderr)
+		self._writer.write(buf)
+
+	def _timer_flush(self):
+		with self.outbuf_lock:
+			self._timer = None
+			self._timer_due = None
+		self.flush()
 
 	def close(self):
-		with self._neatd.sel_lock:
-			self._neatd.sel.unregister(self._conn)
+		if self.closed:
+			return
+		self.closed = True
+		self._writer.close()
+		for cb in self._callbacks.values():
+			cb.remove()
+		self._callbacks.clear()
 		with self.outbuf_lock:
-			self._conn.close()
-			self.closed = True
-
-	def read(self):
-		data = self._conn.recv(1500)
-		if data:
-			self.inbuf += data
-			while b'\n' in self.inbuf:
-				i = self.inbuf.find(b'\n')
-				self.handle(self.inbuf[0:i])
-				self.inbuf = self.inbuf[i+1:]
-		else:
-			self.close()
+			self._pending.clear()
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
 
-	def write(self):
+	async def serve(self):
 		try:
-			with self.outbuf_lock:
-				sent = self._conn.send(self.outbuf)
-				if sent > 0:
-					if self._neatd.verbose:
-						print('NeatD response: '+str(self.outbuf[:sent]), file=sys.stderr)
-					self.outbuf = self.outbuf[sent:]
-				if len(self.outbuf) == 0:
-					self.mask &= ~selectors.EVENT_WRITE
-		except BrokenPipeError:
+			while not self.closed:
+				if self._binary_names is None:
+					try:
+						cmd = await self._reader.readline()
+					# Raised for a line longer than the stream limit
+					except (ValueError, asyncio.LimitOverrunError):
+						print('Command line too long, closing connection', file=sys.stderr)
+						break
+					if cmd[-1:] != b'\n':
+						break
+					self.handle(cmd[:-1])
+				else:
+					length = int.from_bytes(await self._reader.readexactly(2), 'big')
+					if length == 0xffff:
+						length = int.from_bytes(await self._reader.readexactly(4), 'big')
+					self.handle_frame(await self._reader.readexactly(length))
+		except asyncio.IncompleteReadError:
+			pass
+		except ConnectionError:
 			print('Connection unexpectedly closed', file=sys.stderr)
+		finally:
 			self.close()
 
 class NeatD:
-	def accept(self, sock):
-		conn, addr = sock.accept()
-		conn.setblocking(False)
-		laddr = conn.getsockname()
-		rconn = NeatDConnection(self.rigobj.rigs[laddr[1] - self._base_port], self, conn)
-		self.sel.register(conn, rconn.mask, data = rconn)
-
 	def __init__(self, **kwargs):
 		config = configparser.ConfigParser()
 		config.read_dict({'SerialPort': {
@@ -197,57 +616,147 @@ class NeatD:
 			},
 			'Neat': {
 				'verbose': 0,
+				'backend': 'kenwood_hf',
 				'rigctld': 1,
 				'rigctld_address': 'localhost',
 				'rigctld_port': 4532,
+				'rigctld_max_age': '',
 				'neatd_address': 'localhost',
 				'neatd_port': 3532,
 			}
 		})
 		config.read('neat.ini')
+		# Overrides for the config file, as a dict of sections
+		config.read_dict(kwargs.get('config', {}))
 		self.verbose = config.getboolean('Neat', 'verbose')
 		self._base_port = config.getint('Neat', 'neatd_port')
-		self.rigobj = kenwood_hf.KenwoodHF(port = config['SerialPort']['device'], speed = config.getint('SerialPort', 'speed'), stopbits = config.getint('SerialPort', 'stopBits'), verbose = config.getboolean('Neat', 'verbose'))
+		# An already opened rig can be passed to serve instead
+		self.rigobj = kwargs.get('rig')
+		if self.rigobj is None:
+			self.rigobj = rig.open_rig(config['Neat']['backend'], port = config['SerialPort']['device'], speed = config.getint('SerialPort', 'speed'), stopbits = config.getint('SerialPort', 'stopBits'), verbose = config.getboolean('Neat', 'verbose'))
 		if config.getboolean('Neat', 'rigctld'):
-			rigctl_main = rigctld.rigctld(self.rigobj.rigs[0], address = config['Neat']['rigctld_address'], port = config.getint('Neat', 'rigctld_port'), verbose = config.getboolean('Neat', 'verbose'))
+			max_age = None
+			if config['Neat']['rigctld_max_age'] != '':
+				max_age = config.getfloat('Neat', 'rigctld_max_age')
+			rigctl_main = rigctld.rigctld(self.rigobj.rigs[0], address = config['Neat']['rigctld_address'], port = config.getint('Neat', 'rigctld_port'), verbose = config.getboolean('Neat', 'verbose'), max_age = max_age)
 			rigctldThread_main = threading.Thread(target = rigctl_main.rigctldThread, name = 'rigctld')
 			rigctldThread_main.start()
-			rigctl_sub = rigctld.rigctld(self.rigobj.rigs[1], address = config['Neat']['rigctld_address'], port = config.getint('Neat', 'rigctld_port') + 1, verbose = config.getboolean('Neat', 'verbose'))
+			rigctl_sub = rigctld.rigctld(self.rigobj.rigs[1], address = config['Neat']['rigctld_address'], port = config.getint('Neat', 'rigctld_port') + 1, verbose = config.getboolean('Neat', 'verbose'), max_age = max_age)
 			rigctldThread_sub = threading.Thread(target = rigctl_sub.rigctldThread, name = 'rigctld')
 			rigctldThread_sub.start()
 
+		self._address = config['Neat']['neatd_address']
+		self._loop = None
+		self._loop_ident = None
+		self._stop = None
+		self._terminate = False
+		self._connections = {}
+		# NeatDWatchers by value and name
+		self._watchers = {}
+		# The (NeatDWatchers, NeatDChange) pairs and connections waiting
+		# for _flush_all()
+		self._flush_lock = threading.Lock()
+		self._changes = []
+		self._flush_pending = []
+		self._flush_scheduled = False
+		self.fetcher = NeatDFetcher()
+		# Stop serving when the rig stops
+		self.rigobj.add_terminate_callback(self.terminate)
+
+	# Returns the NeatDWatchers for prop, watched as name.  Only called on
+	# the event loop thread.
+	def watchers(self, prop, name):
+		key = (prop, name)
+		if not key in self._watchers:
+			self._watchers[key] = NeatDWatchers(self, prop, name)
+		return self._watchers[key]
+
+	# Serves clients until terminate() is called
+	def serve(self):
+		asyncio.run(self._serve())
+
+	def terminate(self):
+		self._terminate = True
+		if self._loop is not None:
+			self._loop.call_soon_threadsafe(self._stop.set)
+
+	# Runs func on the event loop thread, may be called from any thread
+	def call_soon(self, func):
+		loop = self._loop
+		if loop is None:
+			return
+		if threading.get_ident() == self._loop_ident:
+			loop.call_soon(func)
+		else:
+			try:
+				loop.call_soon_threadsafe(func)
+			except RuntimeError:
+				# The loop has already stopped
+				pass
+
+	# Flushes neatd_connection on the event loop thread, may be called
+	# from any thread.  Connections scheduled together, such as those
+	# watching the same value, are flushed by a single call.
+	def schedule_flush(self, neatd_connection):
+		with self._flush_lock:
+			self._flush_pending.append(neatd_connection)
+			if self._flush_scheduled:
+				return
+			self._flush_scheduled = True
+		self.call_soon(self._flush_all)
+
+	# Sends change to every connection in watchers on the event loop
+	# thread, may be called from any thread
+	def fan_out(self, watchers, change):
+		with self._flush_lock:
+			self._changes.append((watchers, change))
+			if self._flush_scheduled:
+				return
+			self._flush_scheduled = True
+		self.call_soon(self._flush_all)
+
+	def _flush_all(self):
+		while True:
+			with self._flush_lock:
+				changes = self._changes
+				self._changes = []
+				if len(changes) == 0:
+					pending = self._flush_pending
+					self._flush_pending = []
+					self._flush_scheduled = False
+					break
+			for watchers, change in changes:
+				watchers.send(change)
+		for neatd_connection in pending:
+			neatd_connection.flush()
+
+	async def _serve(self):
+		self._stop = asyncio.Event()
+		self._loop_ident = threading.get_ident()
+		self._loop = asyncio.get_running_loop()
+		if self._terminate:
+			self._stop.set()
+		servers = []
 		port = self._base_port
-		self.sel = selectors.DefaultSelector()
-		# This lock is to allow connections to close()
-		self.sel_lock = threading.Lock()
-		# This queue is for connection objects that need their event mask updated
-		self.writeable_queue = queue.Queue()
 		for subrig in self.rigobj.rigs:
-			sock = socket.socket()
-			sock.bind((config['Neat']['neatd_address'], port))
-			sock.listen(100)
-			sock.setblocking(False)
-			self.sel.register(sock, selectors.EVENT_READ)
+			servers.append(await asyncio.start_server(partial(self._accept, subrig), self._address, port, reuse_address = True))
 			port += 1
-		while not self.rigobj._terminate:
-			with self.sel_lock:
-				while not self.writeable_queue.empty():
-					obj = self.writeable_queue.get()
-					with obj.outbuf_lock:
-						if not obj.closed:
-							self.sel.modify(obj._conn, obj.mask, data = obj)
-				events = self.sel.select(0.1)
-			for key, mask in events:
-				if isinstance(key.data, NeatDConnection):
-					if mask & selectors.EVENT_WRITE:
-						key.data.write()
-						with key.data.outbuf_lock:
-							if not (key.data.mask & selectors.EVENT_WRITE):
-								self.writeable_queue.put(key.data)
-					if mask & selectors.EVENT_READ:
-						key.data.read()
-				else:
-					self.accept(key.fileobj)
+		await self._stop.wait()
+		for server in servers:
+			server.close()
+		for conn in list(self._connections):
+			conn.close()
+		# Let the connections see they're closed before the loop stops
+		await asyncio.gather(*self._connections.values(), return_exceptions = True)
+		self._loop = None
+
+	async def _accept(self, subrig, reader, writer):
+		conn = NeatDConnection(subrig, self, reader, writer)
+		self._connections[conn] = asyncio.current_task()
+		try:
+			await conn.serve()
+		finally:
+			del self._connections[conn]
 
 if __name__ == '__main__':
-	blah = NeatD()
+	NeatD().serve()
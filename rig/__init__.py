@@ -24,18 +24,59 @@
 # SOFTWARE.
 
 from abc import ABC, abstractmethod
-from enum import IntEnum
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from copy import deepcopy
+from itertools import count
+from sys import stderr, exc_info
+from importlib import import_module
+from rig.enums import mode
+from time import monotonic
+from types import MethodType
+from weakref import WeakMethod
 import threading
 
-class mode(IntEnum):
-	LSB = 1
-	USB = 2
-	CW  = 3
-	FM  = 4
-	AM  = 5
-	FSK = 6
-	CW_REVERSED = 7
-	FSK_REVERSED = 9
+# Every set to a StateValue cached value takes the next number from here
+_update_sequence = count(1)
+
+# Handles returned by Subscribers.add() are unique across all states
+_subscriber_handles = count(1)
+
+# NumPy is optional, and slow to import, so it's only imported the
+# first time it's needed.  Returns None if it's not available.
+_numpy = False
+def load_numpy():
+	global _numpy
+	if _numpy is False:
+		try:
+			import numpy
+			_numpy = numpy
+		except ImportError:
+			_numpy = None
+	return _numpy
+
+# Backends which can be opened by name (ie: from a config file) with
+# open_rig().  Each is the module and the callable in it which creates
+# the rig, and the module is only imported when it's first opened.
+backends = {
+	'kenwood_hf': 'rig.kenwood_hf:KenwoodHF',
+	'simulator': 'rig.kenwood_hf.simulator:simulated_rig',
+	'neatc': 'neatc:NeatC',
+}
+
+def register_backend(name, target):
+	backends[name] = target
+
+def backend(name):
+	if not name in backends:
+		raise Exception('Unknown rig backend '+name)
+	module, attr = backends[name].split(':')
+	return getattr(import_module(module), attr)
+
+def open_rig(name, **kwargs):
+	return backend(name)(**kwargs)
 
 """
 This is the generic interface for each rig.  The following
@@ -83,21 +124,458 @@ are all expected to be overridden
 	When set to True, the radio begins transmitting, when set to
 	False, it stops transmitting.
 
+- get(self, prop, max_age = None):
+	Returns the value of prop, querying the rig first if the
+	cached value is more than max_age seconds old.
+
+- batch(self):
+	A context manager.  Sets made by the current thread inside it
+	are sent together when it exits, allowing the backend to order
+	and group them.
+
+- set_many(self, values):
+	Sets each prop in the values dict as a single batch.
+
+- snapshot(self, names):
+	Returns a dict of the cached values of each prop in names,
+	read together without querying the rig.  If a change arrives
+	while they're being read, they're read again (up to three
+	times in all) so the values are from the same moment.
+
+- get_many(self, names, max_age = None):
+	As snapshot(), but first refreshes any of the values which are
+	not cached or are more than max_age seconds old.  Backends
+	should send those queries together rather than one at a time.
+
+- tune(self, prop, delta):
+	Adds delta to the value of prop.  Backends may merge tuning
+	that arrives faster than the rig can follow, and report the
+	target value until the rig catches up.
+
 - add_callback(self, prop, cb):
-	self._state[prop].add_callback(cb)
+	self._state[prop].add_modify_callback(cb)
+	Returns a handle which can be passed to remove_callback() in
+	place of cb.  Bound methods are held by weak reference, see
+	Subscribers.
+	The callback is called from a dispatcher thread, see
+	CallbackDispatcher.  The number of dispatcher threads is set by
+	the callback_threads constructor argument (default 1).
+
+- callback_stats()
+	Returns delivery counts and lag from the callback dispatcher.
+
+- changes(self, since = 0)
+	Returns a list of (seq, prop, value) tuples for every change
+	with a sequence number greater than since, oldest first.  If
+	changes since then have been discarded from the log, returns
+	None and the caller must re-read the state it needs.
+
+- change_sequence(self)
+	Returns the sequence number of the most recent change.
+
+- history(self, prop)
+	Returns the RingBuffer of recent values for prop, or None if the
+	backend doesn't keep a history for it.
 
 - remove_callback(self, prop, cb):
-	self._state[prop].remove_callback(cb)
+	self._state[prop].remove_modify_callback(cb)
+	cb may be the callback or the handle add_callback() returned.
+
+- add_callbacks(self, props, cb)
+	Adds cb to each prop in props, and returns a list of handles for
+	remove_callbacks().
+
+- remove_callbacks(self, handles)
+	Removes the callbacks add_callbacks() added.
 
 - terminate()
 
+- add_terminate_callback(self, cb)
+	Calls cb() once the rig has stopped, whether terminate() was
+	called or the backend lost the rig.  If it has already stopped,
+	cb() is called right away.
+
+"""
+
+"""
+A fixed size history of (timestamp, value) samples.  Timestamps are
+time.monotonic() values.
+
+Every sample is written twice, size entries apart, so the most recent
+samples are always a contiguous slice of the underlying arrays.  This
+allows view() to return them without copying, as NumPy arrays if NumPy
+is available and memoryviews otherwise.  Views share memory with the
+buffer, so samples in them are overwritten by later appends.
+
+The window methods look at samples from the last ms milliseconds, and
+return None if there are none.
+"""
+class RingBuffer:
+	def __init__(self, size):
+		self.size = size
+		self._times = array('d', bytes(16 * size))
+		self._values = array('d', bytes(16 * size))
+		self._next = 0
+		self._count = 0
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return self._count
+
+	def append(self, timestamp, value):
+		with self._lock:
+			i = self._next
+			self._times[i] = timestamp
+			self._times[i + self.size] = timestamp
+			self._values[i] = value
+			self._values[i + self.size] = value
+			self._next = (i + 1) % self.size
+			if self._count < self.size:
+				self._count += 1
+
+	# Returns the start and end indexes of the samples in order
+	def _span(self):
+		end = self._next + self.size
+		return (end - self._count, end)
+
+	def view(self):
+		with self._lock:
+			start, end = self._span()
+		numpy = load_numpy()
+		if numpy is not None:
+			return (numpy.frombuffer(self._times, dtype = numpy.float64)[start:end],
+			    numpy.frombuffer(self._values, dtype = numpy.float64)[start:end])
+		return (memoryview(self._times)[start:end], memoryview(self._values)[start:end])
+
+	def window(self, ms):
+		with self._lock:
+			start, end = self._span()
+			start = bisect_left(self._times, monotonic() - ms / 1000, start, end)
+			return self._values[start:end]
+
+	def peak(self, ms):
+		values = self.window(ms)
+		if len(values) == 0:
+			return None
+		return max(values)
+
+	def mean(self, ms):
+		values = self.window(ms)
+		if len(values) == 0:
+			return None
+		return sum(values) / len(values)
+
+	# Linearly interpolated, like numpy.percentile()
+	def percentile(self, ms, pct):
+		values = self.window(ms)
+		if len(values) == 0:
+			return None
+		numpy = load_numpy()
+		if numpy is not None:
+			return float(numpy.percentile(values, pct))
+		values = sorted(values)
+		pos = (len(values) - 1) * pct / 100
+		lo = int(pos)
+		if lo + 1 >= len(values):
+			return values[lo]
+		return values[lo] + (values[lo + 1] - values[lo]) * (pos - lo)
+
+"""
+Finds which named range contains a frequency, in each of several range
+tables at once.  Tables map names to either [low, high] lists or dicts
+with 'low' and 'high' keys (like the bandplan), both ends inclusive.
+The boundaries of every table are merged into one sorted list when the
+index is created, so a lookup is a single binary search.  If ranges in
+one table overlap, the one listed last wins.
+
+lookup() returns a tuple with the name (or None) for each table, in the
+order of columns, and band() returns the name for a single table.
+"""
+class RangeIndex:
+	def __init__(self, **tables):
+		self._tables = tables
+		self.columns = tuple(tables)
+		self._column = {c: i for i, c in enumerate(self.columns)}
+		ranges = []
+		bounds = {0}
+		for table in tables.values():
+			r = []
+			for name, value in table.items():
+				if isinstance(value, dict):
+					low, high = value['low'], value['high']
+				else:
+					low, high = value
+				r.append((low, high, name))
+				bounds.add(low)
+				bounds.add(high + 1)
+			ranges.append(r)
+		self._starts = sorted(bounds)
+		self._rows = []
+		for start in self._starts:
+			row = []
+			for r in ranges:
+				found = None
+				for low, high, name in r:
+					if low <= start and high >= start:
+						found = name
+				row.append(found)
+			self._rows.append(tuple(row))
+
+	# Returns a new index with the extra tables added
+	def extend(self, **tables):
+		return RangeIndex(**self._tables, **tables)
+
+	def lookup(self, freq):
+		return self._rows[bisect_right(self._starts, freq) - 1]
+
+	def band(self, freq, column):
+		return self._rows[bisect_right(self._starts, freq) - 1][self._column[column]]
+
+"""
+A bounded, ordered log of changes to state values.  Each change is
+recorded with the next update sequence number, so the log can be read
+incrementally with since().
+"""
+class ChangeFeed:
+	def __init__(self, size = 4096):
+		self._log = deque(maxlen = size)
+		self._lock = threading.Lock()
+		self._last = 0
+		# Highest sequence number which is no longer in the log
+		self._lost = 0
+
+	def append(self, state, value):
+		with self._lock:
+			seq = next(_update_sequence)
+			if len(self._log) == self._log.maxlen:
+				self._lost = self._log[0][0]
+			self._log.append((seq, state, value))
+			self._last = seq
+			return seq
+
+	@property
+	def last(self):
+		return self._last
+
+	# Returns the (seq, state, value) entries after seq, oldest first, or
+	# None if some of them have already been discarded
+	def since(self, seq):
+		with self._lock:
+			if seq < self._lost:
+				return None
+			ret = []
+			for entry in reversed(self._log):
+				if entry[0] <= seq:
+					break
+				ret.append(entry)
+		ret.reverse()
+		return ret
+
+"""
+Delivers modify callbacks from a small pool of worker threads so the
+thread updating the cache never runs frontend code.
+
+Each callback has its own queue of pending values, keyed by the state
+they came from.  If a state changes again before the previous value
+was delivered, only the newest value is delivered.  Each queue holds at
+most max_pending states, the oldest is dropped when it overflows.  A
+callback is only ever run by one worker at a time, so it sees its
+values in order.
+"""
+class CallbackDispatcher:
+	def __init__(self, threads = 1, max_pending = 256):
+		self._lock = threading.Lock()
+		self._ready = threading.Condition(self._lock)
+		self._pending = {}
+		self._runnable = deque()
+		self._max_pending = max_pending
+		self._terminate = False
+		self._delivered = 0
+		self._coalesced = 0
+		self._dropped = 0
+		self._lag_total = 0.0
+		self._lag_max = 0.0
+		self._threads = ()
+		for i in range(threads):
+			t = threading.Thread(target = self._worker, name = 'Callback Dispatcher', daemon = True)
+			self._threads += (t,)
+			t.start()
+
+	def dispatch(self, state, callbacks, value):
+		now = monotonic()
+		with self._lock:
+			for cb in callbacks:
+				key = _callback_key(cb)
+				entry = self._pending.get(key)
+				if entry is None:
+					entry = (cb, OrderedDict())
+					self._pending[key] = entry
+					self._runnable.append(key)
+					self._ready.notify()
+				pending = entry[1]
+				if state in pending:
+					# Keep the original time so lag shows how stale it got
+					pending[state] = (value, pending[state][1])
+					self._coalesced += 1
+					continue
+				if len(pending) >= self._max_pending:
+					pending.popitem(last = False)
+					self._dropped += 1
+				pending[state] = (value, now)
+
+	def stats(self):
+		with self._lock:
+			return {
+				'delivered': self._delivered,
+				'coalesced': self._coalesced,
+				'dropped': self._dropped,
+				'pending': sum(len(x[1]) for x in self._pending.values()),
+				'mean_lag': self._lag_total / self._delivered if self._delivered else None,
+				'max_lag': self._lag_max,
+			}
+
+	def terminate(self):
+		with self._lock:
+			self._terminate = True
+			self._ready.notify_all()
+
+	def _worker(self):
+		while True:
+			with self._lock:
+				while len(self._runnable) == 0 and not self._terminate:
+					self._ready.wait()
+				if self._terminate:
+					return
+				key = self._runnable.popleft()
+				cb, pending = self._pending[key]
+				state, (value, queued) = pending.popitem(last = False)
+			# Don't call callbacks removed since the value was queued
+			if state._modify_callbacks.has(cb):
+				try:
+					cb(value)
+				except:
+					print('Exception in callback for '+str(state.name)+': ', exc_info()[0], exc_info()[1], file=stderr)
+			lag = monotonic() - queued
+			with self._lock:
+				self._delivered += 1
+				self._lag_total += lag
+				if lag > self._lag_max:
+					self._lag_max = lag
+				if len(pending) == 0:
+					del self._pending[key]
+				else:
+					self._runnable.append(key)
+					self._ready.notify()
+
+"""
+The modify callbacks of a state.  add() returns a handle which can be
+passed to remove() instead of the callback, and both are O(1).
+
+Bound methods are held by weak reference, so subscribing doesn't keep
+the object alive, and the callback is removed when the object is
+collected.  Other callables are held normally since they're often
+lambdas that nothing else refers to.
+
+Callbacks are matched by identity (the same function, or the same method
+of the same object), so the objects needn't be hashable.  Adding a
+callback that's already present returns its existing handle.
+callbacks() returns the live callbacks from a tuple which is rebuilt on
+the first call after a change, so delivering a value doesn't usually
+take the lock.
 """
+class Subscribers:
+	def __init__(self):
+		# A weakref callback can run while the lock is held
+		self._lock = threading.RLock()
+		self._refs = {}
+		self._keys = {}
+		self._handles = {}
+		self._snapshot = ()
+
+	def __len__(self):
+		return len(self._refs)
+
+	def _ref(self, cb, key):
+		if isinstance(cb, MethodType):
+			return WeakMethod(cb, lambda ref: self._died(key))
+		return _StrongRef(cb)
+
+	def _died(self, key):
+		with self._lock:
+			handle = self._handles.pop(key, None)
+			if handle is not None:
+				del self._refs[handle]
+				del self._keys[handle]
+				self._snapshot = None
+
+	def add(self, cb):
+		with self._lock:
+			key = _callback_key(cb)
+			handle = self._handles.get(key)
+			if handle is None:
+				handle = next(_subscriber_handles)
+				self._handles[key] = handle
+				self._refs[handle] = self._ref(cb, key)
+				self._keys[handle] = key
+				self._snapshot = None
+			return handle
+
+	# Removes a callback by its handle, or by the callback itself
+	def remove(self, handle):
+		with self._lock:
+			if not isinstance(handle, int):
+				handle = self._handles.get(_callback_key(handle))
+			key = self._keys.pop(handle, None)
+			if key is not None:
+				del self._handles[key]
+				del self._refs[handle]
+				self._snapshot = None
+
+	def has(self, cb):
+		return _callback_key(cb) in self._handles
+
+	def callbacks(self):
+		snapshot = self._snapshot
+		if snapshot is None:
+			with self._lock:
+				snapshot = tuple(self._refs.values())
+				self._snapshot = snapshot
+		ret = []
+		for ref in snapshot:
+			cb = ref()
+			if cb is not None:
+				ret.append(cb)
+		return ret
+
+# Stands in for a weak reference to callbacks held normally
+class _StrongRef:
+	__slots__ = ('_cb',)
+
+	def __init__(self, cb):
+		self._cb = cb
+
+	def __call__(self):
+		return self._cb
+
+# Returns the key callbacks are stored under, which is the same for the
+# same function or the same method of the same object.  It's built from
+# ids so neither the callback nor the object needs to be hashable.
+def _callback_key(cb):
+	if isinstance(cb, MethodType):
+		return (id(cb.__self__), id(cb.__func__))
+	return id(cb)
 
 class Rig(ABC):
 	def __init__(self, **kwargs):
 		kwargs = {'verbose': False, **kwargs}
 		self._verbose = kwargs.get('verbose')
 		self._state = {}
+		self._dispatcher = CallbackDispatcher(kwargs.get('callback_threads', 1))
+		self._change_feed = ChangeFeed(kwargs.get('change_feed_size', 4096))
+		self._state_name_map = None
+		self._terminate_lock = threading.Lock()
+		self._terminate_callbacks = []
+		self._stopped = False
 
 	def __getattr__(self, name):
 		if name in self._state:
@@ -123,29 +601,111 @@ class Rig(ABC):
 	def terminate(self):
 		raise NotImplementedError('Rig types require terminate')
 
-	def add_callback(self, prop, callback):
-		if isinstance(self._state[prop], list):
-			raise Exception('Unable to add callback for entire list')
+	def add_terminate_callback(self, cb):
+		with self._terminate_lock:
+			if not self._stopped:
+				self._terminate_callbacks.append(cb)
+				return
+		cb()
+
+	# Backends call this when the rig stops, the callbacks are only
+	# called the first time
+	def _terminated(self):
+		with self._terminate_lock:
+			if self._stopped:
+				return
+			self._stopped = True
+			callbacks = self._terminate_callbacks
+			self._terminate_callbacks = []
+		for cb in callbacks:
+			cb()
+
+	# Returns the StateValue for prop, which may be in name[idx] form
+	def _state_value(self, prop):
 		ob = prop.find('[')
 		cb = prop.find(']')
 		if (ob == -1) != (cb == -1) or cb < ob:
 			raise Exception('Invalid list indexing')
 		if ob == -1:
-			self._state[prop].add_modify_callback(callback)
-			return
-		self._state[prop[:ob]][int(prop[ob+1:cb])].add_modify_callback(callback)
+			if isinstance(self._state[prop], list):
+				raise Exception('Unable to use entire list')
+			return self._state[prop]
+		return self._state[prop[:ob]][int(prop[ob+1:cb])]
+
+	def get(self, prop, max_age = None):
+		return self._state_value(prop).get(max_age)
+
+	# Backends that can combine sets override this
+	@contextmanager
+	def batch(self):
+		yield self
+
+	def set_many(self, values):
+		with self.batch():
+			for prop, value in values.items():
+				self._state_value(prop).value = value
+
+	def snapshot(self, names):
+		states = [(name, self._state_value(name)) for name in names]
+		for attempt in range(3):
+			seq = self.change_sequence()
+			ret = {name: sv._peek() for name, sv in states}
+			if self.change_sequence() == seq:
+				break
+		return ret
+
+	def get_many(self, names, max_age = None):
+		cold = [sv for sv in map(self._state_value, names) if sv._stale(max_age)]
+		if len(cold) > 0:
+			self._refresh_many(cold)
+		return self.snapshot(names)
+
+	# Backends that can refresh several states at once override this
+	def _refresh_many(self, states):
+		for sv in states:
+			sv._refresh()
+
+	def tune(self, prop, delta):
+		self._state_value(prop).tune(delta)
+
+	def add_callback(self, prop, callback):
+		return self._state_value(prop).add_modify_callback(callback)
+
+	def add_callbacks(self, props, callback):
+		return [(sv, sv.add_modify_callback(callback)) for sv in map(self._state_value, props)]
+
+	def remove_callbacks(self, handles):
+		for sv, handle in handles:
+			sv.remove_modify_callback(handle)
+
+	def callback_stats(self):
+		return self._dispatcher.stats()
+
+	def history(self, prop):
+		return self._state_value(prop)._history
+
+	# Returns a dict mapping each StateValue to the name it is known by
+	def _state_names(self):
+		if self._state_name_map is None or self._state_name_map[0] != len(self._state):
+			names = {}
+			for a, p in self._state.items():
+				if isinstance(p, StateValue) and not p in names:
+					names[p] = a
+			self._state_name_map = (len(self._state), names)
+		return self._state_name_map[1]
+
+	def changes(self, since = 0):
+		entries = self._change_feed.since(since)
+		if entries is None:
+			return None
+		names = self._state_names()
+		return [(seq, names[sv], value) for seq, sv, value in entries if sv in names]
+
+	def change_sequence(self):
+		return self._change_feed.last
 
 	def remove_callback(self, prop, callback):
-		if isinstance(self._state[prop], list):
-			raise Exception('Unable to add callback for entire list')
-		ob = prop.find('[')
-		cb = prop.find(']')
-		if (ob == -1) != (cb == -1) or cb < ob:
-			raise Exception('Invalid list indexing')
-		if ob == -1:
-			self._state[prop].remove_modify_callback(callback)
-			return
-		self._state[prop[:ob]][int(prop[ob+1:cb])].remove_modify_callback(callback)
+		self._state_value(prop).remove_modify_callback(callback)
 
 """
 This class implements the caching layer.
@@ -156,7 +716,21 @@ value.  A set to cached triggers all applicable registered callbacks.
 Frontends should read/write the property itself and not deal with this
 class at all.
 
-The set callbacks are intended for use by backends.
+The set callbacks are intended for use by backends.  They are called
+synchronously by whichever thread sets cached.  Modify callbacks are
+handed to the rig's CallbackDispatcher if it has one.
+
+Dependents are StateValues computed from this one.  Every set to cached
+calls _dependency_set(self) on each of them.
+
+Every set to cached also records the monotonic time it happened at (None
+while the value is None) and a sequence number which increases across
+all states.  Sets which change the value are also added to the rig's
+ChangeFeed with that sequence number.  get(max_age) uses these to only
+call _refresh() when the cached value is too old.
+
+If the history kwarg is given, the last history numeric values set are
+also kept in a RingBuffer.
 """
 class StateValue(ABC):
 	def __init__(self, rig, **kwargs):
@@ -164,16 +738,19 @@ class StateValue(ABC):
 		self._read_only = kwargs.get('read_only')
 		self._rig = rig
 		self._cached_value = None
-		self._modify_callbacks = ()
+		self._modify_callbacks = Subscribers()
 		self._set_callbacks = ()
+		self._dependents = ()
+		self._timestamp = None
+		self._sequence = 0
+		self._history = None
+		if kwargs.get('history'):
+			self._history = RingBuffer(kwargs.get('history'))
 		self._lock = threading.Lock()
 
 	@property
 	def _cached(self):
-		self._lock.acquire()
-		ret = self._cached_value
-		self._lock.release()
-		return ret
+		return self._cached_value
 
 	@_cached.setter
 	def _cached(self, value):
@@ -184,12 +761,82 @@ class StateValue(ABC):
 		if self._cached_value != value:
 			self._cached_value = value
 			mod = True
+		self._touch(value, mod)
 		self._lock.release()
 		if mod:
-			for cb in self._modify_callbacks:
-				cb(value)
+			self._call_modify_callbacks(value)
 		for cb in self._set_callbacks:
 			cb(self, value)
+		for d in self._dependents:
+			d._dependency_set(self)
+
+	def _call_modify_callbacks(self, value):
+		callbacks = self._modify_callbacks.callbacks()
+		if len(callbacks) == 0:
+			return
+		dispatcher = getattr(self._rig, '_dispatcher', None)
+		if dispatcher is None:
+			for cb in callbacks:
+				cb(value)
+		else:
+			dispatcher.dispatch(self, callbacks, value)
+
+	# Must be called with _lock held
+	def _touch(self, value, modified):
+		self._timestamp = None if value is None else monotonic()
+		feed = getattr(self._rig, '_change_feed', None)
+		if modified and feed is not None:
+			self._sequence = feed.append(self, value)
+		else:
+			self._sequence = next(_update_sequence)
+		if self._history is not None and value is not None:
+			self._history.append(self._timestamp, value)
+
+	@property
+	def timestamp(self):
+		return self._timestamp
+
+	@property
+	def sequence(self):
+		return self._sequence
+
+	@property
+	def age(self):
+		ts = self._timestamp
+		if ts is None:
+			return None
+		return monotonic() - ts
+
+	# True if the value isn't cached, or is more than max_age seconds old
+	def _stale(self, max_age):
+		if self._cached is None:
+			return True
+		if max_age is None:
+			return False
+		age = self.age
+		return age is None or age > max_age
+
+	def get(self, max_age = None):
+		if max_age is not None:
+			age = self.age
+			if age is None or age > max_age:
+				self._refresh()
+		return self.value
+
+	# Backends override this to update the cached value from the rig
+	def _refresh(self):
+		pass
+
+	# Returns the cached value for Rig.snapshot(), backends override
+	# this to hide values which are not currently valid
+	def _peek(self):
+		ret = self._cached
+		if ret is None or isinstance(ret, (int, float, str, bytes)):
+			return ret
+		return deepcopy(ret)
+
+	def tune(self, delta):
+		self.value = self.value + delta
 
 	@property
 	@abstractmethod
@@ -204,7 +851,7 @@ class StateValue(ABC):
 	def add_modify_callback(self, cb):
 		if not callable(cb):
 			raise Exception('Adding uncallable modify callback: '+str(cb))
-		self._modify_callbacks += (cb,)
+		return self._modify_callbacks.add(cb)
 
 	def add_set_callback(self, cb):
 		if not callable(cb):
@@ -212,7 +859,18 @@ class StateValue(ABC):
 		self._set_callbacks += (cb,)
 
 	def remove_modify_callback(self, cb):
-		self._modify_callbacks = tuple(filter(lambda x: x != cb, self._modify_callbacks))
+		self._modify_callbacks.remove(cb)
 
 	def remove_set_callback(self, cb):
 		self._set_callbacks = tuple(filter(lambda x: x != cb, self._set_callbacks))
+
+	def add_dependent(self, dependent):
+		if not isinstance(dependent, StateValue):
+			raise Exception('Adding non-StateValue dependent: '+str(dependent))
+		self._dependents += (dependent,)
+
+	def remove_dependent(self, dependent):
+		self._dependents = tuple(d for d in self._dependents if d is not dependent)
+
+	def _dependency_set(self, prop):
+		raise NotImplementedError('State does not depend on other states')
@@ -0,0 +1,373 @@
+'''
+Benchmarks which run the same scenarios against any Rig, so backends can
+be compared with each other and with earlier runs:
+
+    python -m rig.benchmark [-l] [-p] [-j results.json] [-c earlier.json] [backend ...]
+
+The backends are the names in BACKENDS, all of them by default.  Each is
+a function returning the rig to benchmark and a function to call once
+it's finished with.  Other Rig implementations can be benchmarked by
+adding them there.
+
+The scenarios are:
+
+- cold_get
+	get() with a max_age of zero, so the value is read from the rig.
+- warm_get
+	get() of the cached value.
+- set_echo
+	Time from a set until the rig reports the new value.
+- callback
+	Time from a set until a callback added with add_callback() is
+	called with the new value.
+- churn
+	add_callback() and remove_callback() pairs.
+
+The results are printed as a table.  -j saves them as JSON, and -c adds
+the change from a previously saved run to each result.
+
+-l also times cached gets from 49 neatd clients, first alone and then
+while a 50th keeps getting a value which must be read from the rig.
+
+-p compares the neatd text and binary protocols, with the time NeatC
+takes to connect and fetch every value, and the bytes neatd sends and
+the CPU time used (by neatd and NeatC together) for each update to a
+watched value.  It then changes a value 1000 times a second, and
+reports the bytes per second neatd sends to NeatC with each of the watch
+options.  Last, it reports the CPU time neatd's modify callbacks take
+for each change, with 1 and 30 connections watching the value.
+'''
+
+from getopt import getopt
+from statistics import median
+from sys import argv
+from threading import Event, Thread
+from time import monotonic, process_time, sleep, thread_time
+from timeit import Timer
+import json
+import rig
+import socket
+
+# The state read by the get scenarios, and the state and values the set
+# scenarios alternate between
+GET_PROP = 'rx_mode'
+SET_PROP = 'rx_frequency'
+SET_VALUES = (14074000, 14075000)
+
+# Returns the number of times per second stmt can be run
+def rate(stmt, **env):
+	count, elapsed = Timer(stmt, globals = env).autorange()
+	best = min(Timer(stmt, globals = env).repeat(5, count))
+	return count / best
+
+def cold_get(r):
+	return rate('r.get(prop, 0)', r = r, prop = GET_PROP)
+
+def warm_get(r):
+	return rate('r.get(prop)', r = r, prop = GET_PROP)
+
+# Sets SET_PROP to each of SET_VALUES in turn count times, and returns
+# the median time in ms until cb, added with add(), sees the new value
+def _set_latency(r, add, remove, count):
+	setattr(r, SET_PROP, SET_VALUES[-1])
+	deadline = monotonic() + 1
+	while r.get(SET_PROP) != SET_VALUES[-1]:
+		if monotonic() > deadline:
+			raise Exception('Unable to set '+SET_PROP)
+		sleep(0.01)
+	ev = Event()
+	expected = None
+	def cb(*args):
+		if args[-1] == expected:
+			ev.set()
+	add(cb)
+	times = []
+	try:
+		for i in range(count):
+			expected = SET_VALUES[i % len(SET_VALUES)]
+			ev.clear()
+			start = monotonic()
+			setattr(r, SET_PROP, expected)
+			if not ev.wait(1):
+				raise Exception('No update received for '+SET_PROP)
+			times.append(monotonic() - start)
+	finally:
+		remove(cb)
+	return median(times) * 1000
+
+def set_echo(r, count = 100):
+	state = r._state_value(SET_PROP)
+	return _set_latency(r, state.add_set_callback, state.remove_set_callback, count)
+
+def callback(r, count = 100):
+	return _set_latency(r, lambda cb: r.add_callback(SET_PROP, cb), lambda cb: r.remove_callback(SET_PROP, cb), count)
+
+def churn(r):
+	return rate('r.add_callback(prop, cb); r.remove_callback(prop, cb)', r = r, prop = SET_PROP, cb = lambda value: None)
+
+SCENARIOS = (
+	('cold_get', cold_get, 'gets/s'),
+	('warm_get', warm_get, 'gets/s'),
+	('set_echo', set_echo, 'ms'),
+	('callback', callback, 'ms'),
+	('churn', churn, 'pairs/s'),
+)
+
+# KenwoodHF on the simulated TS-2000
+def simulator_backend():
+	r = rig.open_rig('simulator')
+	r.memory_loader.stop()
+	return r, r.terminate
+
+# Starts neatd serving server in a new thread, and returns a function
+# which stops it once it's listening on port
+def _start_neatd(server, port):
+	import neatd
+	daemon = neatd.NeatD(rig = server, config = {'Neat': {'rigctld': 0, 'neatd_address': 'localhost', 'neatd_port': port}})
+	thread = Thread(target = daemon.serve, name = 'neatd')
+	thread.start()
+	def stop():
+		daemon.terminate()
+		thread.join()
+	deadline = monotonic() + 5
+	while True:
+		try:
+			socket.create_connection(('localhost', port)).close()
+			return stop
+		except ConnectionRefusedError:
+			if monotonic() > deadline:
+				stop()
+				raise
+			sleep(0.01)
+
+# NeatC connected over loopback to neatd serving the main receiver of a
+# simulated TS-2000
+def neatc_backend(port = 3632):
+	server, server_terminate = simulator_backend()
+	try:
+		neatd_stop = _start_neatd(server, port)
+	except:
+		server_terminate()
+		raise
+	client = rig.open_rig('neatc', port = port)
+	def terminate():
+		client.terminate()
+		neatd_stop()
+		server_terminate()
+	return client, terminate
+
+BACKENDS = {
+	'simulator': simulator_backend,
+	'neatc': neatc_backend,
+}
+
+# Has clients - 1 connections to neatd repeatedly get a cached value
+# while the last one (if cold is True) keeps getting a value that has to
+# be read from a simulated 4800 baud rig.  Returns the median and 99th
+# percentile time in ms the cached gets took.
+def neatd_load(clients = 50, seconds = 3, cold = True, speed = 4800, port = 3642):
+	server = rig.open_rig('simulator')
+	server.memory_loader.stop()
+	server._serial._serial.speed = speed
+	neatd_stop = None
+	try:
+		neatd_stop = _start_neatd(server, port)
+		stop = Event()
+		times = []
+		def client(request):
+			conn = socket.create_connection(('localhost', port))
+			f = conn.makefile('rb')
+			while not stop.is_set():
+				start = monotonic()
+				conn.sendall(request)
+				f.readline()
+				if request == b'get rx_frequency\n':
+					times.append(monotonic() - start)
+			conn.close()
+		requests = [b'get rx_frequency\n'] * (clients - 1)
+		if cold:
+			requests.append(b'get rx_mode 0\n')
+		threads = [Thread(target = client, args = (request,)) for request in requests]
+		for t in threads:
+			t.start()
+		sleep(seconds)
+		stop.set()
+		for t in threads:
+			t.join()
+		times.sort()
+		return times[len(times) // 2] * 1000, times[len(times) * 99 // 100] * 1000
+	finally:
+		if neatd_stop is not None:
+			neatd_stop()
+		server.terminate()
+
+# Changes SET_PROP on a simulated rig served by neatd count times,
+# waiting for a NeatC client using the binary or text protocol to see
+# each change.  Returns the time in ms NeatC took to connect, and the
+# bytes received and the CPU time in us used per update.
+def protocol_cost(binary, count = 2000, port = 3652):
+	server, server_terminate = simulator_backend()
+	neatd_stop = None
+	client = None
+	try:
+		neatd_stop = _start_neatd(server, port)
+		start = monotonic()
+		client = rig.open_rig('neatc', port = port, binary = binary)
+		connect = (monotonic() - start) * 1000
+		state = server._state_value(SET_PROP)
+		ev = Event()
+		client.add_callback(SET_PROP, lambda value: ev.set())
+		# Waits for the replies to the gets sent on connecting
+		received = None
+		while received != client._conn.bytes_received:
+			received = client._conn.bytes_received
+			sleep(0.5)
+		start = process_time()
+		for i in range(count):
+			ev.clear()
+			# Skips the rig, so only neatd and NeatC are measured
+			state._cached = SET_VALUES[0] + 1 + i
+			if not ev.wait(1):
+				raise Exception('No update received for '+SET_PROP)
+		cpu = process_time() - start
+		return connect, (client._conn.bytes_received - received) / count, cpu / count * 1000000
+	finally:
+		if client is not None:
+			client.terminate()
+		if neatd_stop is not None:
+			neatd_stop()
+		server_terminate()
+
+# Changes SET_PROP on a simulated rig served by neatd changes times per
+# second for seconds, while NeatC, opened with the options in kwargs,
+# watches it.  Returns the bytes and updates NeatC received per second.
+def watch_flood(seconds = 2, changes = 1000, port = 3662, **kwargs):
+	server, server_terminate = simulator_backend()
+	neatd_stop = None
+	client = None
+	try:
+		neatd_stop = _start_neatd(server, port)
+		client = rig.open_rig('neatc', port = port, **kwargs)
+		state = server._state_value(SET_PROP)
+		updates = [0]
+		client.add_callback(SET_PROP, lambda value: updates.__setitem__(0, updates[0] + 1))
+		received = client._conn.bytes_received
+		start = monotonic()
+		i = 0
+		while monotonic() - start < seconds:
+			i += 1
+			state._cached = SET_VALUES[0] + i
+			sleep(max(start + i / changes - monotonic(), 0))
+		# Let the last update arrive
+		sleep(0.2)
+		return (client._conn.bytes_received - received) / seconds, updates[0] / seconds
+	finally:
+		if client is not None:
+			client.terminate()
+		if neatd_stop is not None:
+			neatd_stop()
+		server_terminate()
+
+# Has clients connections to neatd watch SET_PROP on a simulated rig, and
+# calls its modify callbacks with count changes.  Returns the CPU time
+# in us each change took on the calling thread.
+def fanout_cost(clients, count = 10000, port = 3672):
+	server, server_terminate = simulator_backend()
+	neatd_stop = None
+	conns = []
+	def drain(conn):
+		try:
+			while conn.recv(65536):
+				pass
+		except OSError:
+			pass
+	try:
+		neatd_stop = _start_neatd(server, port)
+		for i in range(clients):
+			conn = socket.create_connection(('localhost', port))
+			conn.sendall(bytes('watch '+SET_PROP+'\n', 'ascii'))
+			conns.append(conn)
+			Thread(target = drain, args = (conn,), daemon = True).start()
+		state = server._state_value(SET_PROP)
+		# Waits for neatd to add the watches
+		sleep(0.5)
+		callbacks = state._modify_callbacks.callbacks()
+		cpu = 0
+		for i in range(count):
+			start = thread_time()
+			for cb in callbacks:
+				cb(SET_VALUES[0] + 1 + i)
+			cpu += thread_time() - start
+			if i % 50 == 0:
+				# Let neatd keep up
+				sleep(0.005)
+		return cpu / count * 1000000
+	finally:
+		for conn in conns:
+			conn.close()
+		if neatd_stop is not None:
+			neatd_stop()
+		server_terminate()
+
+# Returns a dict of the result of each scenario against the named backend
+def run(name):
+	r, terminate = BACKENDS[name]()
+	try:
+		return {scenario: func(r) for scenario, func, unit in SCENARIOS}
+	finally:
+		terminate()
+
+# Prints a row per scenario and a column per backend.  If earlier is
+# passed, each result is followed by the change from it.
+def print_table(results, earlier = None):
+	print('{:19s}'.format('') + ''.join('{:>24s}'.format(name) for name in results))
+	for scenario, func, unit in SCENARIOS:
+		line = '{:10s} {:8s}'.format(scenario, unit)
+		for name, values in results.items():
+			cell = '{:,.2f}'.format(values[scenario])
+			try:
+				cell += ' ({:+.0%})'.format(values[scenario] / earlier[name][scenario] - 1)
+			except (KeyError, TypeError, ZeroDivisionError):
+				cell += ' ' * 7
+			line += '{:>24s}'.format(cell)
+		print(line)
+
+def main(args):
+	opts, names = getopt(args, 'j:c:lp', ['json=', 'compare=', 'load', 'protocol'])
+	save = None
+	earlier = None
+	load = False
+	protocol = False
+	for o, a in opts:
+		if o in ('-l', '--load'):
+			load = True
+		elif o in ('-p', '--protocol'):
+			protocol = True
+		elif o in ('-j', '--json'):
+			save = a
+		elif o in ('-c', '--compare'):
+			with open(a) as f:
+				earlier = json.load(f)
+	for name in names:
+		if not name in BACKENDS:
+			raise Exception('Unknown benchmark backend '+name)
+	results = {}
+	for name in names or BACKENDS:
+		results[name] = run(name)
+	print_table(results, earlier)
+	if load:
+		for cold in (False, True):
+			print('{:19s} {:7.2f} ms median {:7.2f} ms 99%'.format('  with a cold get' if cold else 'neatd 49 clients', *neatd_load(cold = cold)))
+	if protocol:
+		for binary in (False, True):
+			print('{:19s} {:7.2f} ms connect {:7.2f} bytes/update {:7.2f} us/update'.format('neatd binary' if binary else 'neatd text', *protocol_cost(binary)))
+		for name, options in (('every change', {}), ('latest-only', {'latest_only': True}), ('rate=10', {'watch_rate': 10})):
+			print('{:19s} {:10,.0f} bytes/s {:7.1f} updates/s'.format('watch '+name, *watch_flood(**options)))
+		for clients in (1, 30):
+			print('{:19s} {:7.2f} us/change'.format('neatd {} watchers'.format(clients), fanout_cost(clients)))
+	if save is not None:
+		with open(save, 'w') as f:
+			json.dump(results, f, indent = '\t')
+
+if __name__ == '__main__':
+	main(argv[1:])
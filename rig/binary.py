@@ -0,0 +1,244 @@
+# Copyright (c) 2022 Stephen Hurd
+# Copyright (c) 2022 Stephen Hurd
+# Developers:
+# Stephen Hurd (W8BSD/VE5BSD) <shurd@sasktel.net>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice, developer list, and this permission notice shall
+# be included in all copies or substantial portions of the Software. If you meet
+# us some day, and you think this stuff is worth it, you can buy us a beer in
+# return
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+The binary framing used between neatd and NeatC once a client sends the
+"binary" command.
+
+Every message is a frame: a two byte big-endian payload length
+followed by the payload.  A length of 0xffff is followed by a four byte
+length for larger payloads.  The first payload byte is the message
+type.  Values are referred to by ID, which is their position in the
+reply to "list", with a name[n] entry taking the IDs for name[0] to
+name[n-1].
+
+- TEXT: the rest of the payload is a text mode command or reply,
+  without the trailing newline.  Commands without a binary form
+  (list, history) are sent this way.
+- VALUE: two byte ID and a value, the reply to GET.
+- WATCHED: two byte ID and a value, a change to a watched value.
+- GET: two byte ID, optionally followed by an eight byte max age.
+- SET: two byte ID and a value.
+- WATCH / UNWATCH: two byte ID.
+- VALUES: any number of two byte IDs each followed by a value, the
+  reply to an mget text command.
+
+A value is a one byte tag followed by its data.  Ints (including enum
+values) take the smallest of one, four or eight bytes, lists of bools
+are packed eight to a byte, and strings are UTF-8 with a two byte
+length.
+'''
+
+from struct import Struct
+
+# Message types
+TEXT = 0
+VALUE = 1
+WATCHED = 2
+GET = 3
+SET = 4
+WATCH = 5
+UNWATCH = 6
+VALUES = 7
+
+# Value tags
+NONE = 0
+FALSE = 1
+TRUE = 2
+INT8 = 3
+INT32 = 4
+INT64 = 5
+FLOAT = 6
+STR = 7
+LIST = 8
+BITS = 9
+DICT = 10
+
+_length = Struct('>H')
+_long_length = Struct('>HI')
+_message = Struct('>BH')
+_id = Struct('>H')
+_max_age = Struct('>d')
+_int8 = Struct('>Bb')
+_int32 = Struct('>Bi')
+_int64 = Struct('>Bq')
+_float = Struct('>Bd')
+_counted = Struct('>BH')
+_int32_update = Struct('>HBHBi')
+
+def frame(payload):
+	if len(payload) < 0xffff:
+		return _length.pack(len(payload)) + payload
+	return _long_length.pack(0xffff, len(payload)) + payload
+
+# Returns a list of the complete frame payloads at the start of buf, and
+# the bytes following them
+def frames(buf):
+	ret = []
+	pos = 0
+	while len(buf) - pos >= 2:
+		length = _length.unpack_from(buf, pos)[0]
+		start = pos + 2
+		if length == 0xffff:
+			if len(buf) - pos < 6:
+				break
+			length = _long_length.unpack_from(buf, pos)[1]
+			start = pos + 6
+		if len(buf) - start < length:
+			break
+		ret.append(buf[start:start + length])
+		pos = start + length
+	return ret, buf[pos:]
+
+def encode_value(value):
+	if value is None:
+		return b'\x00'
+	if value is False:
+		return b'\x01'
+	if value is True:
+		return b'\x02'
+	if isinstance(value, int):
+		if -0x80 <= value < 0x80:
+			return _int8.pack(INT8, value)
+		if -0x80000000 <= value < 0x80000000:
+			return _int32.pack(INT32, value)
+		return _int64.pack(INT64, value)
+	if isinstance(value, float):
+		return _float.pack(FLOAT, value)
+	if isinstance(value, str):
+		encoded = value.encode('utf-8')
+		return _counted.pack(STR, len(encoded)) + encoded
+	if isinstance(value, (list, tuple)):
+		if len(value) > 0 and all(v is True or v is False for v in value):
+			packed = bytearray((len(value) + 7) // 8)
+			for i in range(len(value)):
+				if value[i]:
+					packed[i >> 3] |= 0x80 >> (i & 7)
+			return _counted.pack(BITS, len(value)) + packed
+		return _counted.pack(LIST, len(value)) + b''.join(map(encode_value, value))
+	if isinstance(value, dict):
+		return _counted.pack(DICT, len(value)) + b''.join(encode_value(str(k)) + encode_value(v) for k, v in value.items())
+	raise Exception('Unable to encode '+str(type(value)))
+
+# Returns the value starting at pos in buf, and the position after it
+def decode_value(buf, pos = 0):
+	tag = buf[pos]
+	if tag == NONE:
+		return None, pos + 1
+	if tag == FALSE:
+		return False, pos + 1
+	if tag == TRUE:
+		return True, pos + 1
+	if tag == INT8:
+		return _int8.unpack_from(buf, pos)[1], pos + _int8.size
+	if tag == INT32:
+		return _int32.unpack_from(buf, pos)[1], pos + _int32.size
+	if tag == INT64:
+		return _int64.unpack_from(buf, pos)[1], pos + _int64.size
+	if tag == FLOAT:
+		return _float.unpack_from(buf, pos)[1], pos + _float.size
+	count = _counted.unpack_from(buf, pos)[1]
+	pos += _counted.size
+	if tag == STR:
+		return str(buf[pos:pos + count], 'utf-8'), pos + count
+	if tag == BITS:
+		return [bool(buf[pos + (i >> 3)] & (0x80 >> (i & 7))) for i in range(count)], pos + (count + 7) // 8
+	if tag == LIST:
+		ret = []
+		for i in range(count):
+			value, pos = decode_value(buf, pos)
+			ret.append(value)
+		return ret, pos
+	if tag == DICT:
+		ret = {}
+		for i in range(count):
+			key, pos = decode_value(buf, pos)
+			ret[key], pos = decode_value(buf, pos)
+		return ret, pos
+	raise Exception('Unknown value tag '+str(tag))
+
+# Returns a framed message of type msg_type for the value with ID vid
+def message(msg_type, vid, value):
+	# Most updates are frequencies and other ints
+	if type(value) is int and -0x80000000 <= value < 0x80000000 and not -0x80 <= value < 0x80:
+		return _int32_update.pack(8, msg_type, vid, INT32, value)
+	return frame(_message.pack(msg_type, vid) + encode_value(value))
+
+# Returns a VALUES message for a list of (ID, value) pairs
+def values(pairs):
+	return frame(bytes((VALUES,)) + b''.join(_id.pack(vid) + encode_value(value) for vid, value in pairs))
+
+# Returns the (ID, value) pairs in the rest of a VALUES payload
+def decode_values(rest):
+	ret = []
+	pos = 0
+	while pos < len(rest):
+		vid = _id.unpack_from(rest, pos)[0]
+		value, pos = decode_value(rest, pos + _id.size)
+		ret.append((vid, value))
+	return ret
+
+def text(line):
+	return frame(bytes((TEXT,)) + line)
+
+def get(vid, max_age = None):
+	if max_age is None:
+		return frame(_message.pack(GET, vid))
+	return frame(_message.pack(GET, vid) + _max_age.pack(max_age))
+
+def command(msg_type, vid):
+	return frame(_message.pack(msg_type, vid))
+
+# Returns the message type, value ID and the rest of a payload.  The
+# value ID is None for TEXT and VALUES payloads.  Raises an Exception
+# for empty or short payloads and unknown message types.
+def parse(payload):
+	if len(payload) == 0:
+		raise Exception('Empty payload')
+	if payload[0] == TEXT or payload[0] == VALUES:
+		return payload[0], None, payload[1:]
+	if payload[0] > VALUES:
+		raise Exception('Unknown message type '+str(payload[0]))
+	if len(payload) < _message.size:
+		raise Exception('Payload too short for message type '+str(payload[0]))
+	msg_type, vid = _message.unpack_from(payload)
+	return msg_type, vid, payload[_message.size:]
+
+def parse_max_age(rest):
+	if len(rest) < _max_age.size:
+		return None
+	return _max_age.unpack_from(rest)[0]
+
+# Returns the list of names, in ID order, for the names in a list reply
+def expand_names(names):
+	ret = []
+	for name in names:
+		if name[-1:] == ']':
+			ob = name.find('[')
+			for i in range(int(name[ob+1:-1])):
+				ret.append(name[:ob] + '[' + str(i) + ']')
+		else:
+			ret.append(name)
+	return ret
@@ -0,0 +1,264 @@
+# Copyright (c) 2022 Stephen Hurd
+# Copyright (c) 2022 Stephen Hurd
+# Developers:
+# Stephen Hurd (W8BSD/VE5BSD) <shurd@sasktel.net>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice, developer list, and this permission notice shall
+# be included in all copies or substantial portions of the Software. If you meet
+# us some day, and you think this stuff is worth it, you can buy us a beer in
+# return
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Enumerations used by the rig backends and their front-ends.  This has
+no other dependencies, so front-ends can use the values without
+importing a backend.
+"""
+
+from enum import IntEnum
+
+class mode(IntEnum):
+	LSB = 1
+	USB = 2
+	CW  = 3
+	FM  = 4
+	AM  = 5
+	FSK = 6
+	CW_REVERSED = 7
+	FSK_REVERSED = 9
+
+class tunerState(IntEnum):
+	STOPPED = 0
+	ACTIVE = 1
+	FAILED = 2
+
+class AI(IntEnum):
+	OFF = 0
+	OLD = 1
+	EXTENDED = 2
+	BOTH = 3
+
+class BeatCanceller(IntEnum):
+	OFF = 0
+	AUTO = 1
+	MANUAL = 2
+
+class tuningMode(IntEnum):
+	VFOA = 0
+	VFOB = 1
+	MEMORY = 2
+	CALL = 3
+
+class scanMode(IntEnum):
+	OFF = 0
+	ON = 1
+	MHZ_SCAN = 2
+	VISUAL_SCAN = 3
+	TONE_SCAN = 4
+	CTCSS_SCAN = 5
+	DCS_SCAN = 6
+
+class offset(IntEnum):
+	NONE = 0
+	POSITIVE = 1
+	NEGATIVE = 2
+	# -7.6MHz for 430 or -6MHz for 1.2GHz
+	EURO_SPLIT = 3
+
+class meter(IntEnum):
+	UNSELECTED = 0
+	SWR = 1
+	COMPRESSION = 2
+	ALC = 3
+
+class firmwareType(IntEnum):
+	OVERSEAS = 0
+	JAP100W = 1
+	JAP20W = 2
+
+class toneType(IntEnum):
+	OFF = 0
+	TONE = 1
+	CTCSS = 2
+	DCS = 3
+
+class CTCSStone(IntEnum):
+	CTCSS_67_0 = 1
+	CTCSS_71_9 = 2
+	CTCSS_74_4 = 3
+	CTCSS_77_0 = 4
+	CTCSS_79_7 = 5
+	CTCSS_82_5 = 6
+	CTCSS_85_4 = 7
+	CTCSS_88_5 = 8
+	CTCSS_91_5 = 9
+	CTCSS_94_8 = 10
+	CTCSS_97_4 = 11
+	CTCSS_100_0 = 12
+	CTCSS_103_5 = 13
+	CTCSS_107_2 = 14
+	CTCSS_110_9 = 15
+	CTCSS_114_8 = 16
+	CTCSS_118_8 = 17
+	CTCSS_123_0 = 18
+	CTCSS_127_3 = 19
+	CTCSS_131_8 = 20
+	CTCSS_136_5 = 21
+	CTCSS_141_3 = 22
+	CTCSS_146_2 = 23
+	CTCSS_151_4 = 24
+	CTCSS_156_7 = 25
+	CTCSS_162_2 = 26
+	CTCSS_167_9 = 27
+	CTCSS_173_8 = 28
+	CTCSS_179_9 = 29
+	CTCSS_186_2 = 30
+	CTCSS_192_8 = 31
+	CTCSS_203_5 = 32
+	CTCSS_210_7 = 33
+	CTCSS_218_1 = 34
+	CTCSS_225_7 = 35
+	CTCSS_233_6 = 36
+	CTCSS_241_8 = 37
+	CTCSS_250_3 = 38
+	TONE_1750 = 39
+
+class rigLock(IntEnum):
+	OFF = 0
+	F_LOCK = 1
+	A_LOCK = 2
+
+class recordingChannel(IntEnum):
+	OFF = 0
+	CH1 = 1
+	CH2 = 2
+	CH3 = 3
+
+class noiseReduction(IntEnum):
+	OFF = 0
+	NR1 = 1
+	NR2 = 2
+
+class DCScode(IntEnum):
+	DCS_23 = 0
+	DCS_25 = 1
+	DCS_26 = 2
+	DCS_31 = 3
+	DCS_32 = 4
+	DCS_36 = 5
+	DCS_43 = 6
+	DCS_47 = 7
+	DCS_51 = 8
+	DCS_53 = 9
+	DCS_54 = 10
+	DCS_65 = 11
+	DCS_71 = 12
+	DCS_72 = 13
+	DCS_73 = 14
+	DCS_74 = 15
+	DCS_114 = 16
+	DCS_115 = 17
+	DCS_116 = 18
+	DCS_122 = 19
+	DCS_125 = 20
+	DCS_131 = 21
+	DCS_132 = 22
+	DCS_134 = 23
+	DCS_143 = 24
+	DCS_145 = 25
+	DCS_152 = 26
+	DCS_155 = 27
+	DCS_156 = 28
+	DCS_162 = 29
+	DCS_165 = 30
+	DCS_172 = 31
+	DCS_174 = 32
+	DCS_205 = 33
+	DCS_212 = 34
+	DCS_223 = 35
+	DCS_225 = 36
+	DCS_226 = 37
+	DCS_243 = 38
+	DCS_244 = 39
+	DCS_245 = 40
+	DCS_246 = 41
+	DCS_251 = 42
+	DCS_252 = 43
+	DCS_255 = 44
+	DCS_261 = 45
+	DCS_263 = 46
+	DCS_265 = 47
+	DCS_266 = 48
+	DCS_271 = 49
+	DCS_274 = 50
+	DCS_306 = 51
+	DCS_311 = 52
+	DCS_315 = 53
+	DCS_325 = 54
+	DCS_331 = 55
+	DCS_332 = 56
+	DCS_343 = 57
+	DCS_346 = 58
+	DCS_351 = 59
+	DCS_356 = 60
+	DCS_364 = 61
+	DCS_365 = 62
+	DCS_371 = 63
+	DCS_411 = 64
+	DCS_412 = 65
+	DCS_413 = 66
+	DCS_423 = 67
+	DCS_431 = 68
+	DCS_432 = 69
+	DCS_445 = 70
+	DCS_446 = 71
+	DCS_452 = 72
+	DCS_454 = 73
+	DCS_455 = 74
+	DCS_462 = 75
+	DCS_464 = 76
+	DCS_465 = 77
+	DCS_466 = 78
+	DCS_503 = 79
+	DCS_506 = 80
+	DCS_516 = 81
+	DCS_523 = 82
+	DCS_526 = 83
+	DCS_532 = 84
+	DCS_546 = 85
+	DCS_565 = 86
+	DCS_606 = 87
+	DCS_612 = 88
+	DCS_624 = 89
+	DCS_627 = 90
+	DCS_631 = 91
+	DCS_632 = 92
+	DCS_654 = 93
+	DCS_662 = 94
+	DCS_664 = 95
+	DCS_703 = 96
+	DCS_712 = 97
+	DCS_723 = 98
+	DCS_731 = 99
+	DCS_732 = 100
+	DCS_734 = 101
+	DCS_743 = 102
+	DCS_754 = 103
+
+class Direction(IntEnum):
+	UP = 0
+	DOWN = 1
@@ -35,12 +35,19 @@ it will get a suboptimal name.
 """
 
 from enum import IntEnum
-from rig import Rig, StateValue, mode
+from rig import RangeIndex, Rig, RingBuffer, StateValue, load_numpy
+from rig.enums import mode, tunerState, AI, BeatCanceller, tuningMode, scanMode, offset, meter, firmwareType, toneType, CTCSStone, rigLock, recordingChannel, noiseReduction, DCScode, Direction
 from bitarray.util import int2ba, base2ba
+from array import array
+from collections import deque
+from contextlib import contextmanager
 from copy import deepcopy
+from functools import partial
+from math import nan
 from re import match
 from sys import stderr
-from threading import Lock, Event, Thread, get_ident
+from threading import Lock, Event, Thread, get_ident, local
+from time import monotonic
 from queue import Queue
 from rig.kenwood_hf.serial import KenwoodHFProtocol
 
@@ -64,8 +71,9 @@ Each state property can also have callbacks installed which are called
 when the value of the state property changes.  This is how the front-end
 is expected to know when a change takes place, rather than assuming it
 took place as soon as the property was written.  Callbacks are called
-from a different thread and should not query properties from that thread.
-TODO: Fix this with a queue, it's not that hard and you're lazy.
+from the callback dispatcher threads, never the read thread, and if a
+property changes several times before its callback runs, only the most
+recent value is delivered.
 If a callback is given a None value as the new value, that may just mean
 that a state change invalidated the cached value and a new read of the
 property will retreive it.  If reading the property returns None, that
@@ -75,229 +83,12 @@ state, and is not applicable.
 This allows the front-end to be more responsive, at the expense of a
 consistent, known rig state.
 
-'''
+While transmitting, the SWR, compression, ALC, and power meters are
+polled continuously (see MeterSampler) and each reading is published
+to its meter property as it arrives.  Pass meter_sampling = False to
+the constructor to disable this.
 
-class tunerState(IntEnum):
-	STOPPED = 0
-	ACTIVE = 1
-	FAILED = 2
-
-class AI(IntEnum):
-	OFF = 0
-	OLD = 1
-	EXTENDED = 2
-	BOTH = 3
-
-class BeatCanceller(IntEnum):
-	OFF = 0
-	AUTO = 1
-	MANUAL = 2
-
-class tuningMode(IntEnum):
-	VFOA = 0
-	VFOB = 1
-	MEMORY = 2
-	CALL = 3
-
-class scanMode(IntEnum):
-	OFF = 0
-	ON = 1
-	MHZ_SCAN = 2
-	VISUAL_SCAN = 3
-	TONE_SCAN = 4
-	CTCSS_SCAN = 5
-	DCS_SCAN = 6
-
-class offset(IntEnum):
-	NONE = 0
-	POSITIVE = 1
-	NEGATIVE = 2
-	# -7.6MHz for 430 or -6MHz for 1.2GHz
-	EURO_SPLIT = 3
-
-class meter(IntEnum):
-	UNSELECTED = 0
-	SWR = 1
-	COMPRESSION = 2
-	ALC = 3
-
-class firmwareType(IntEnum):
-	OVERSEAS = 0
-	JAP100W = 1
-	JAP20W = 2
-
-class toneType(IntEnum):
-	OFF = 0
-	TONE = 1
-	CTCSS = 2
-	DCS = 3
-
-class CTCSStone(IntEnum):
-	CTCSS_67_0 = 1
-	CTCSS_71_9 = 2
-	CTCSS_74_4 = 3
-	CTCSS_77_0 = 4
-	CTCSS_79_7 = 5
-	CTCSS_82_5 = 6
-	CTCSS_85_4 = 7
-	CTCSS_88_5 = 8
-	CTCSS_91_5 = 9
-	CTCSS_94_8 = 10
-	CTCSS_97_4 = 11
-	CTCSS_100_0 = 12
-	CTCSS_103_5 = 13
-	CTCSS_107_2 = 14
-	CTCSS_110_9 = 15
-	CTCSS_114_8 = 16
-	CTCSS_118_8 = 17
-	CTCSS_123_0 = 18
-	CTCSS_127_3 = 19
-	CTCSS_131_8 = 20
-	CTCSS_136_5 = 21
-	CTCSS_141_3 = 22
-	CTCSS_146_2 = 23
-	CTCSS_151_4 = 24
-	CTCSS_156_7 = 25
-	CTCSS_162_2 = 26
-	CTCSS_167_9 = 27
-	CTCSS_173_8 = 28
-	CTCSS_179_9 = 29
-	CTCSS_186_2 = 30
-	CTCSS_192_8 = 31
-	CTCSS_203_5 = 32
-	CTCSS_210_7 = 33
-	CTCSS_218_1 = 34
-	CTCSS_225_7 = 35
-	CTCSS_233_6 = 36
-	CTCSS_241_8 = 37
-	CTCSS_250_3 = 38
-	TONE_1750 = 39
-
-class rigLock(IntEnum):
-	OFF = 0
-	F_LOCK = 1
-	A_LOCK = 2
-
-class recordingChannel(IntEnum):
-	OFF = 0
-	CH1 = 1
-	CH2 = 2
-	CH3 = 3
-
-class noiseReduction(IntEnum):
-	OFF = 0
-	NR1 = 1
-	NR2 = 2
-
-class DCScode(IntEnum):
-	DCS_23 = 0
-	DCS_25 = 1
-	DCS_26 = 2
-	DCS_31 = 3
-	DCS_32 = 4
-	DCS_36 = 5
-	DCS_43 = 6
-	DCS_47 = 7
-	DCS_51 = 8
-	DCS_53 = 9
-	DCS_54 = 10
-	DCS_65 = 11
-	DCS_71 = 12
-	DCS_72 = 13
-	DCS_73 = 14
-	DCS_74 = 15
-	DCS_114 = 16
-	DCS_115 = 17
-	DCS_116 = 18
-	DCS_122 = 19
-	DCS_125 = 20
-	DCS_131 = 21
-	DCS_132 = 22
-	DCS_134 = 23
-	DCS_143 = 24
-	DCS_145 = 25
-	DCS_152 = 26
-	DCS_155 = 27
-	DCS_156 = 28
-	DCS_162 = 29
-	DCS_165 = 30
-	DCS_172 = 31
-	DCS_174 = 32
-	DCS_205 = 33
-	DCS_212 = 34
-	DCS_223 = 35
-	DCS_225 = 36
-	DCS_226 = 37
-	DCS_243 = 38
-	DCS_244 = 39
-	DCS_245 = 40
-	DCS_246 = 41
-	DCS_251 = 42
-	DCS_252 = 43
-	DCS_255 = 44
-	DCS_261 = 45
-	DCS_263 = 46
-	DCS_265 = 47
-	DCS_266 = 48
-	DCS_271 = 49
-	DCS_274 = 50
-	DCS_306 = 51
-	DCS_311 = 52
-	DCS_315 = 53
-	DCS_325 = 54
-	DCS_331 = 55
-	DCS_332 = 56
-	DCS_343 = 57
-	DCS_346 = 58
-	DCS_351 = 59
-	DCS_356 = 60
-	DCS_364 = 61
-	DCS_365 = 62
-	DCS_371 = 63
-	DCS_411 = 64
-	DCS_412 = 65
-	DCS_413 = 66
-	DCS_423 = 67
-	DCS_431 = 68
-	DCS_432 = 69
-	DCS_445 = 70
-	DCS_446 = 71
-	DCS_452 = 72
-	DCS_454 = 73
-	DCS_455 = 74
-	DCS_462 = 75
-	DCS_464 = 76
-	DCS_465 = 77
-	DCS_466 = 78
-	DCS_503 = 79
-	DCS_506 = 80
-	DCS_516 = 81
-	DCS_523 = 82
-	DCS_526 = 83
-	DCS_532 = 84
-	DCS_546 = 85
-	DCS_565 = 86
-	DCS_606 = 87
-	DCS_612 = 88
-	DCS_624 = 89
-	DCS_627 = 90
-	DCS_631 = 91
-	DCS_632 = 92
-	DCS_654 = 93
-	DCS_662 = 94
-	DCS_664 = 95
-	DCS_703 = 96
-	DCS_712 = 97
-	DCS_723 = 98
-	DCS_731 = 99
-	DCS_732 = 100
-	DCS_734 = 101
-	DCS_743 = 102
-	DCS_754 = 103
-
-class Direction(IntEnum):
-	UP = 0
-	DOWN = 1
+'''
 
 # Indicates which sub-rigs this property should be included in
 class InRig(IntEnum):
@@ -323,6 +114,41 @@ class QueryState(IntEnum):
 	NOT_TS = 3  # Must be the current TX receiver and TS mode must not be enabled
 	NONE = 4    # Can't be queried
 
+# Adds the memories[n] names used by neatd to a state name dict
+def memory_names(names, memories):
+	if len(names) > 0 and not memories.memories[0] in names:
+		for i in range(len(memories.memories)):
+			names[memories.memories[i]] = 'memories[' + str(i) + ']'
+	return names
+
+# Number of samples kept for meter histories
+METER_HISTORY = 1024
+
+# Returns a progress dict with the number of items done, the total,
+# and the estimated number of seconds until completion
+def progress(done, total, start):
+	eta = None
+	if done >= total:
+		eta = 0
+	elif done > 0 and start is not None:
+		eta = (monotonic() - start) * (total - done) / done
+	return {
+		'done': done,
+		'total': total,
+		'eta': eta,
+	}
+
+# Indicates how early in _fill_cache() the state is queried.  Lower
+# values are queried first, within a priority, states which currently
+# have watchers are queried before those that don't.
+class FillPriority(IntEnum):
+	BEEP = 0      # Silences the rig for the rest of the fill
+	CONTROL = 1   # Needed to build query prefixes
+	TUNING = 2    # Needed by validity checks and synthetic states
+	HIGH = 3      # Commonly displayed
+	NORMAL = 4
+	VALIDATED = 5 # Has a validity check depending on earlier states
+
 class KenwoodStateValue(StateValue):
 	def __init__(self, rig, **kwargs):
 		super().__init__(rig, **kwargs)
@@ -338,13 +164,15 @@ class KenwoodStateValue(StateValue):
 		self._in_rig = kwargs.get('in_rig', InRig.BOTH)
 		self._set_state = kwargs.get('set_state', SetState.ANY)
 		self._query_state = kwargs.get('query_state', QueryState.ANY)
+		self._fill_priority = kwargs.get('fill_priority', FillPriority.NORMAL if self._validity_check is None else FillPriority.VALIDATED)
 		if self._set_format is not None and self._set_method is not None:
 			raise Exception('Only one of set_method or set_format may be specified')
 		if self._query_command is not None and self._query_method is not None:
 			raise Exception('Only one of query_command or query_method may be specified')
 
-	def _get_query_prefix_suffix(self):
-		# First, ensure control is set correctly
+	# Returns the commands needed before and after a command to switch
+	# to the receiver and TS state it requires, and back again
+	def _context_prefix_suffix(self, need_receiver, need_tx, want_ts):
 		prefix = ''
 		suffix = ''
 		if not 'control_main' in self._rig._state:
@@ -357,26 +185,26 @@ class KenwoodStateValue(StateValue):
 			return (prefix, suffix)
 		need_ts = False
 		need_control = False
-		need_tx = False
-		if self._query_state != QueryState.ANY:
+		need_tx_switch = False
+		if need_receiver:
 			if (self._in_rig == InRig.MAIN) != self._rig._state['control_main']._cached:
 				need_control = True
-			if self._query_state in (QueryState.TS, QueryState.NOT_TS):
+			if need_tx:
 				if (self._in_rig == InRig.MAIN) != self._rig._state['tx_main']._cached:
-					need_tx = True
+					need_tx_switch = True
 				if self._rig._state['transmit_set']._cached is not None:
 					if self._rig._transmit_set_valid():
-						if self._rig._state['transmit_set']._cached != (self._query_state == QueryState.TS):
+						if self._rig._state['transmit_set']._cached != want_ts:
 							need_ts = True
 			otxm = self._rig._state['tx_main']._cached
 			ocm = self._rig._state['control_main']._cached
-			if need_control or need_tx:
+			if need_control or need_tx_switch:
 				prefix += 'DC{:1d}{:1d};'.format(
-					self._in_rig == InRig.SUB if need_tx else otxm,
+					self._in_rig == InRig.SUB if need_tx_switch else otxm,
 					self._in_rig == InRig.SUB
 				)
 				suffix = ';DC{:1d}{:1d}'.format(not otxm, not ocm) + suffix
-				if need_tx and (not need_control):
+				if need_tx_switch and (not need_control):
 					suffix = ';DC{:1d}{:1d}'.format(not otxm, not ocm) + suffix
 			# Next, set TS if needed
 			if need_ts:
@@ -384,48 +212,20 @@ class KenwoodStateValue(StateValue):
 				suffix = ';TS0' + suffix
 		return (prefix, suffix)
 
-	# TODO: This is just a copy of above with Query changed to Set
+	def _get_query_prefix_suffix(self):
+		return self._context_prefix_suffix(self._query_state != QueryState.ANY,
+		    self._query_state in (QueryState.TS, QueryState.NOT_TS),
+		    self._query_state == QueryState.TS)
+
+	def _get_set_context(self):
+		return self._context_prefix_suffix(self._set_state != SetState.ANY,
+		    self._set_state in (SetState.TS, SetState.NOT_TS),
+		    self._set_state == SetState.TS)
+
 	def _get_set_prefix_suffix(self):
-		# First, ensure control is set correctly
-		prefix = ''
-		suffix = ''
+		prefix, suffix = self._get_set_context()
 		if not self._echoed:
-			prefix = prefix + '\x00'
-		if not 'control_main' in self._rig._state:
-			return (prefix, suffix)
-		if not 'tx_main' in self._rig._state:
-			return (prefix, suffix)
-		if self._rig._state['control_main']._cached is None:
-			return (prefix, suffix)
-		if self._rig._state['tx_main']._cached is None:
-			return (prefix, suffix)
-		need_ts = False
-		need_control = False
-		need_tx = False
-		if self._set_state != SetState.ANY:
-			if (self._in_rig == InRig.MAIN) != self._rig._state['control_main']._cached:
-				need_control = True
-			if self._set_state in (SetState.TS, SetState.NOT_TS):
-				if (self._in_rig == InRig.MAIN) != self._rig._state['tx_main']._cached:
-					need_tx = True
-				if self._rig._state['transmit_set']._cached is not None:
-					if self._rig._transmit_set_valid():
-						if self._rig._state['transmit_set']._cached != (self._set_state == SetState.TS):
-							need_ts = True
-			otxm = self._rig._state['tx_main']._cached
-			ocm = self._rig._state['control_main']._cached
-			if need_control or need_tx:
-				prefix += 'DC{:1d}{:1d};'.format(
-					self._in_rig == InRig.SUB if need_tx else otxm,
-					self._in_rig == InRig.SUB
-				)
-				suffix = ';DC{:1d}{:1d}'.format(not otxm, not ocm) + suffix
-				if need_tx and (not need_control):
-					suffix = ';DC{:1d}{:1d}'.format(not otxm, not ocm) + suffix
-			# Next, set TS if needed
-			if need_ts:
-				prefix += 'TS1;'
-				suffix = ';TS0' + suffix
+			prefix = '\x00' + prefix
 		return (prefix, suffix)
 
 	def _query_string(self):
@@ -465,6 +265,14 @@ class KenwoodStateValue(StateValue):
 		return True
 
 	def _set_string(self, value):
+		cmd = self._set_command(value)
+		if cmd is None or cmd == '':
+			return cmd
+		prefix, suffix = self._get_set_prefix_suffix()
+		return prefix + cmd + suffix
+
+	# Returns the set command without any context switching
+	def _set_command(self, value):
 		if not self._do_range_check(value):
 			return ''
 		if value is None:
@@ -472,21 +280,15 @@ class KenwoodStateValue(StateValue):
 		if isinstance(value, list) and None in value:
 			raise Exception('Setting a list with None in '+self.name+', '+str(value))
 			return ''
-		prefix, suffix = self._get_set_prefix_suffix()
 		if self._set_format is not None:
-			return prefix + self._set_format.format(value) + suffix
+			return self._set_format.format(value)
 		elif self._set_method is not None:
-			ss = self._set_method(value)
-			if ss is None:
-				return ss
-			return prefix + self._set_method(value) + suffix
+			return self._set_method(value)
 		print('Attempt to set value "'+self.name+'" without a set command or method', file=stderr)
 
 	def _valid(self, can_query):
 		if self._query_state == QueryState.NONE:
 			return False
-		if hasattr(self, '_readThread') and get_ident() == self._readThread.ident:
-			can_query = False
 		if not self._works_powered_off:
 			if not self._rig.power_on:
 				return False
@@ -503,10 +305,15 @@ class KenwoodStateValue(StateValue):
 		if not self._valid(True):
 			self._cached = None
 			return None
-		if self._cached is None and not self._rig._killing_cache:
+		ret = self._cached
+		if ret is None and not self._rig._killing_cache:
 			self._rig._query(self)
-		# We just deepcopy it as an easy hack
-		return deepcopy(self._cached)
+			ret = self._cached
+		# Immutable values can be returned as-is, the rest we just
+		# deepcopy as an easy hack
+		if ret is None or isinstance(ret, (int, float, str, bytes)):
+			return ret
+		return deepcopy(ret)
 
 	@value.setter
 	def value(self, value):
@@ -516,30 +323,121 @@ class KenwoodStateValue(StateValue):
 			raise Exception('Attempt to set read-only property '+self.name+'!')
 		self._rig._set(self, value)
 
-class KenwoodDerivedBoolValue(KenwoodStateValue):
-	def __init__(self, rig, derived_from, true_value, **kwargs):
+	def _refresh(self):
+		if get_ident() == self._rig._readThread.ident:
+			return
+		if self._valid(True):
+			self._rig._query(self)
+
+	def _peek(self):
+		if not self._valid(False):
+			return None
+		return super()._peek()
+
+# A state computed by derive() from the states in depends_on.  When any
+# of those are set, the state is marked dirty and recomputed once after
+# the whole response has been applied rather than once per input.
+# Refreshing it refreshes the states it was derived from, and it's only
+# as fresh as the oldest of those.
+class KenwoodDerivedValue(KenwoodStateValue):
+	def __init__(self, rig, **kwargs):
 		super().__init__(rig, **kwargs)
+		self._derive = kwargs.get('derive')
+		self._depends_on = ()
+		# The memory the last derive() read, see read_memory()
+		self._memory = None
+		# The states the last derive() read, see read_inputs()
+		self._inputs = None
+		for d in kwargs.get('depends_on', ()):
+			self.add_dependency(d)
+		if self._query_command is None and self._query_method is None:
+			self._query_method = self._derive_query
+
+	def add_dependency(self, state):
+		self._depends_on += (state,)
+		state.add_dependent(self)
+
+	def remove_dependency(self, state):
+		self._depends_on = tuple(d for d in self._depends_on if d is not state)
+		state.remove_dependent(self)
+
+	# Called by derive() with the memory it reads (or None), so only
+	# that memory is a dependency
+	def read_memory(self, mem):
+		if mem is self._memory:
+			return
+		if self._memory is not None:
+			self.remove_dependency(self._memory)
+		self._memory = mem
+		if mem is not None:
+			self.add_dependency(mem)
+
+	# Called by derive() with the states it read, if it doesn't read all
+	# of depends_on
+	def read_inputs(self, states):
+		self._inputs = tuple(states)
+
+	# The states the value was last derived from, with derived ones
+	# replaced by the states they're derived from
+	def _query_inputs(self):
+		ret = []
+		for state in (self._depends_on if self._inputs is None else self._inputs):
+			if isinstance(state, KenwoodDerivedValue):
+				ret.extend(state._query_inputs())
+			else:
+				ret.append(state)
+		return ret
+
+	def _dependency_set(self, prop):
+		self._rig._mark_dirty(self)
+
+	def _recompute(self):
+		self._cached = self._derive()
+
+	# The value is as old as the oldest state it was derived from
+	def _touch(self, value, modified):
+		super()._touch(value, modified)
+		if value is not None:
+			oldest = self._timestamp
+			for state in self._query_inputs():
+				ts = state._timestamp
+				if ts is None:
+					oldest = None
+					break
+				oldest = min(oldest, ts)
+			self._timestamp = oldest
+
+	def _refresh(self):
+		self._rig._refresh_many((self,))
+
+	def _derive_query(self):
+		self._recompute()
+		return ''
+
+class KenwoodDerivedBoolValue(KenwoodDerivedValue):
+	def __init__(self, rig, derived_from, true_value, **kwargs):
 		self._true_value = true_value
 		self._false_value = kwargs.get('false_value')
 		self._derived_from = derived_from
-		self._derived_from.add_set_callback(self._set_callback)
-		self._cached_value = self._derived_from._cached
-		self._echoed = self._derived_from._echoed
-		self._query_command = self._derived_from._query_command
-		self._query_method = self._derived_from._query_method
-		self._works_powered_off = self._derived_from._works_powered_off
-		self._works_sub_off = self._derived_from._works_sub_off
-		self._in_rig = self._derived_from._in_rig
-		self._set_state = self._derived_from._set_state
-		self._query_state = self._derived_from._query_state
-
-	def _set_callback(self, prop, value):
+		kwargs['echoed'] = derived_from._echoed
+		kwargs['query_command'] = derived_from._query_command
+		kwargs['query_method'] = derived_from._query_method
+		kwargs['works_powered_off'] = derived_from._works_powered_off
+		kwargs['works_sub_off'] = derived_from._works_sub_off
+		kwargs['in_rig'] = derived_from._in_rig
+		kwargs['set_state'] = derived_from._set_state
+		kwargs['query_state'] = derived_from._query_state
+		kwargs['fill_priority'] = derived_from._fill_priority
+		kwargs['depends_on'] = (derived_from,)
+		kwargs['derive'] = self._derive_bool
+		super().__init__(rig, **kwargs)
+		self._cached_value = self._derive_bool()
+
+	def _derive_bool(self):
+		value = self._derived_from._cached
 		if value is None:
-			self._cached = None
-		elif value == self._true_value:
-			self._cached = True
-		else:
-			self._cached = False
+			return None
+		return value == self._true_value
 
 	@property
 	def value(self):
@@ -570,6 +468,8 @@ class KenwoodNagleStateValue(KenwoodStateValue):
 			raise Exception('Forgot to add ._cached!')
 		if self._read_only:
 			raise Exception('Attempt to set read-only property '+self.name+'!')
+		if self._rig._batch_add(self, value):
+			return
 		self.lock.acquire()
 		if self._pending is not None:
 			self._pending['value'] = value
@@ -587,7 +487,7 @@ class KenwoodNagleStateValue(KenwoodStateValue):
 		self._rig._serial.writeQueue.put(self._queued)
 		self.lock.release()
 
-	def _set_string(self, value):
+	def _set_command(self, value):
 		self.lock.acquire()
 		self._pending = self._queued
 		self._queued = None
@@ -596,16 +496,139 @@ class KenwoodNagleStateValue(KenwoodStateValue):
 			self.lock.release()
 			return None
 		self.lock.release()
-		prefix, suffix = self._get_set_prefix_suffix()
 		if self._set_format is not None:
-			return prefix + self._set_format.format(value) + suffix
+			return self._set_format.format(value)
 		elif self._set_method is not None:
-			ss = self._set_method(value)
-			if ss is None:
-				return ss
-			return prefix + self._set_method(value) + suffix
+			return self._set_method(value)
 		print('Attempt to set value "'+self.name+'" without a set command or method', file=stderr)
 
+# A VFO frequency, which may be tuned faster than the rig can follow
+# (ie: from a mouse wheel).  While a set is queued or waiting for its
+# echo, further sets only update the target, and when the echo of the
+# value sent arrives the latest target is sent if it's different.
+# Other updates (ie: from the front panel knob) while waiting are
+# ignored, and if no echo arrives within ECHO_TIMEOUT seconds the next
+# set is sent regardless.  tune() adds to the latest target.  Until the
+# rig catches up, value and the derived frequencies return the target
+# and the modify callbacks are called with it, so the display follows
+# the tuning immediately.  If the rig rejects the target, the callbacks
+# get the cached value again.
+class KenwoodTuningStateValue(KenwoodStateValue):
+	ECHO_TIMEOUT = 1
+
+	def __init__(self, rig, **kwargs):
+		super().__init__(rig, **kwargs)
+		self._target = None
+		self._sending = False
+		self._sent = None
+		self._sent_at = None
+		self._tune_lock = Lock()
+		self.add_set_callback(self._tune_echo)
+
+	@property
+	def value(self):
+		if self._waiting():
+			return self._target
+		return super().value
+
+	@value.setter
+	def value(self, value):
+		if isinstance(value, StateValue):
+			raise Exception('Forgot to add ._cached!')
+		if self._read_only:
+			raise Exception('Attempt to set read-only property '+self.name+'!')
+		if self._rig._batch_add(self, value):
+			return
+		with self._tune_lock:
+			send = self._retarget(value)
+		self._send(value, send)
+
+	def tune(self, delta):
+		with self._tune_lock:
+			base = self._predicted()
+			if base is None:
+				return
+			send = self._retarget(base + delta)
+		self._send(base + delta, send)
+
+	# The target if tuning is under way, otherwise the cached value
+	def _predicted(self):
+		if self._waiting():
+			return self._target
+		return self._cached
+
+	# True while a set is outstanding and hasn't timed out
+	def _waiting(self):
+		return self._sending and self._target is not None and monotonic() - self._sent_at < self.ECHO_TIMEOUT
+
+	# Must be called with _tune_lock held, returns True if a set needs
+	# to be queued
+	def _retarget(self, value):
+		self._target = value
+		if self._waiting():
+			return False
+		self._sending = True
+		self._sent = None
+		self._sent_at = monotonic()
+		return True
+
+	def _send(self, value, send):
+		self._target_changed(value)
+		if send:
+			self._rig._set(self, value)
+
+	# While tuning, the rig's frequencies on the way to the target aren't
+	# reported, the callbacks have already had the target
+	def _call_modify_callbacks(self, value):
+		if not self._waiting():
+			super()._call_modify_callbacks(value)
+
+	# Shows value as the frequency until the rig reports one
+	def _target_changed(self, value):
+		super()._call_modify_callbacks(value)
+		for d in self._dependents:
+			d._dependency_set(self)
+
+	# Must be called with _tune_lock held
+	def _done(self, value):
+		target = self._target
+		self._target = None
+		self._sending = False
+		self._sent = None
+		if value != target:
+			self._target_changed(value)
+
+	def _set_command(self, value):
+		with self._tune_lock:
+			if self._target is not None:
+				value = self._target
+			self._sent = value
+			self._sent_at = monotonic()
+		ret = super()._set_command(value)
+		if ret is None or ret == '':
+			# Rejected, or the rig is already there
+			with self._tune_lock:
+				self._done(self._cached)
+		return ret
+
+	def _tune_echo(self, prop, value):
+		with self._tune_lock:
+			if not self._sending:
+				return
+			if value != self._sent:
+				if self._waiting():
+					return
+				# The echo was lost, the rig has the last word
+				self._done(value)
+				return
+			if self._target is None or self._target == value:
+				self._done(value)
+				return
+			target = self._target
+			self._sent = None
+			self._sent_at = monotonic()
+		self._rig._set(self, target)
+
 class KenwoodListStateValue(KenwoodStateValue):
 	def __init__(self, rig, length, **kwargs):
 		super().__init__(rig, **kwargs)
@@ -653,19 +676,24 @@ class KenwoodListStateValue(KenwoodStateValue):
 				self._cached_value[i] = nv
 				if self.children[i] is not None:
 					self.children[i]._cached_value = nv
+			if self.children[i] is not None:
+				self.children[i]._touch(nv, cmod[i])
+		self._touch(list(self._cached_value), modified)
 		self._lock.release()
 		for i in range(self.length):
 			if self.children[i] is not None:
 				if cmod[i]:
-					for cb in self.children[i]._modify_callbacks:
-						cb(self._cached_value[i])
+					self.children[i]._call_modify_callbacks(self._cached_value[i])
 				for cb in self.children[i]._set_callbacks:
 					cb(self.children[i], self._cached_value[i])
+				for d in self.children[i]._dependents:
+					d._dependency_set(self.children[i])
 		if modified:
-			for cb in self._modify_callbacks:
-				cb(self._cached_value)
+			self._call_modify_callbacks(list(self._cached_value))
 		for cb in self._set_callbacks:
 			cb(self, self._cached_value)
+		for d in self._dependents:
+			d._dependency_set(self)
 
 	@property
 	def value(self):
@@ -679,6 +707,8 @@ class KenwoodListStateValue(KenwoodStateValue):
 			raise Exception('Attempt to set read-only property '+self.name+'!')
 		if self.length != len(value):
 			raise Exception('Incorrect length for '+self.name+', got '+str(len(value))+', expected '+str(self.length))
+		if self._rig._batch_add(self, value):
+			return
 		self.lock.acquire()
 		if self._queued is not None:
 			lst = self._queued['value']
@@ -702,24 +732,20 @@ class KenwoodListStateValue(KenwoodStateValue):
 		self._rig._serial.writeQueue.put(self._queued)
 		self.lock.release()
 
-	def _set_string(self, value):
+	def _set_command(self, value):
 		self.lock.acquire()
 		self._queued = None
 		if not self._do_range_check(value):
 			self.lock.release()
 			return None
 		self.lock.release()
-		prefix, suffix = self._get_set_prefix_suffix()
 		if self._set_format is not None:
 			for i in range(self.length):
 				if value[i] is None and self._cached is not None:
 					value[i] = self._cached[i]
-			return prefix + self._set_format.format(value) + suffix
+			return self._set_format.format(value)
 		elif self._set_method is not None:
-			ss = self._set_method(value)
-			if ss is None:
-				return ss
-			return prefix + self._set_method(value) + suffix
+			return self._set_method(value)
 		print('Attempt to set value "'+self.name+'" without a set command or method', file=stderr)
 
 class KenwoodSingleStateValue(KenwoodStateValue):
@@ -729,6 +755,9 @@ class KenwoodSingleStateValue(KenwoodStateValue):
 		self._offset = offset
 		self._parent.children[self._offset] = self
 
+	def _refresh(self):
+		self._parent._refresh()
+
 	@property
 	def value(self):
 		plist = self._parent.value
@@ -776,14 +805,521 @@ class MemoryArray(list):
 		for x in range(len(self.memories)):
 			yield self.memories[x].value
 
+# Reads every memory channel in the background, one channel at a time,
+# using the idle queue so interactive commands are always sent first.
+# The load pauses while the rig is off and continues where it stopped
+# when it is turned back on.  A channel that can't be read is retried
+# RETRIES times and then skipped.  Channels whose contents differ from
+# the previous load are collected in changed.
+class MemoryLoader:
+	RETRIES = 2
+
+	def __init__(self, rig, memories):
+		self._rig = rig
+		self._memories = memories.memories
+		self._lock = Lock()
+		self._next = 0
+		self._outstanding = None
+		self._responses = 0
+		self._retries = 0
+		self._start = None
+		self._loaded = [None] * len(self._memories)
+		self.running = False
+		self.changed = set()
+		for i in range(len(self._memories)):
+			self._memories[i].add_set_callback(partial(self._memory_set, i))
+
+	def start(self):
+		with self._lock:
+			if self.running:
+				return
+			if self._next >= len(self._memories):
+				self._next = 0
+			self.running = True
+			self._start = monotonic()
+			self._load_next()
+
+	def restart(self):
+		with self._lock:
+			self._next = 0
+			self._retries = 0
+		self.stop()
+		self.start()
+
+	def stop(self):
+		with self._lock:
+			self.running = False
+
+	def take_changed(self):
+		with self._lock:
+			ret = self.changed
+			self.changed = set()
+		return ret
+
+	def update_progress(self):
+		self._rig._state['memory_load_progress']._cached = progress(self._next, len(self._memories), self._start)
+
+	# Must be called with _lock held
+	def _load_next(self):
+		self._outstanding = None
+		if self.running and self._next < len(self._memories):
+			if self._rig._state['power_on']._cached == False:
+				self.running = False
+			else:
+				self._outstanding = self._next
+				self._responses = 0
+				self._rig._serial.idleQueue.put({'msgType': 'query', 'stateValue': self._memories[self._next]})
+		else:
+			self.running = False
+		self.update_progress()
+
+	def _memory_set(self, idx, prop, value):
+		with self._lock:
+			if value is not None and self._loaded[idx] is not None and value != self._loaded[idx]:
+				self.changed.add(idx)
+			if idx != self._outstanding:
+				return
+			if value is None:
+				if not self._memories[idx]._valid(False):
+					# Not valid right now (ie: powered off), try again later
+					self._outstanding = None
+					self.running = False
+					return
+				# The query wasn't answered, so try again, and skip
+				# the channel if it still isn't
+				self._retries += 1
+				if self._retries > self.RETRIES:
+					print('Memory '+str(idx)+' could not be read, skipping it', file=stderr)
+					self._next += 1
+					self._retries = 0
+				self._load_next()
+				return
+			# Both the MR0 and MR1 responses update the value
+			self._responses += 1
+			if self._responses < 2:
+				return
+			self._loaded[idx] = value
+			self._next += 1
+			self._retries = 0
+			self._load_next()
+
+# Samples the transmit meters as fast as the link allows while the rig
+# is transmitting.  Each cycle selects each usable meter type with RM and
+# reads it back, then reads the power meter (SM for the transmitting
+# receiver), using the idle queue so interactive commands still go first.
+# Each reading updates the meter state (and its history) as it arrives.
+# Sampling starts when either receiver starts transmitting, stops as soon
+# as the rig goes back to receive, and the previously selected meter is
+# restored.
+class MeterSampler:
+	def __init__(self, rig):
+		self._rig = rig
+		self._lock = Lock()
+		self._meters = ()
+		self._step = 0
+		self._waiting = None
+		self._queued = None
+		self._original = None
+		self._cycle_start = None
+		self._intervals = RingBuffer(METER_HISTORY)
+		self.running = False
+		self.enabled = True
+		self.cycles = 0
+		for name in ('main_tx', 'sub_tx'):
+			rig._state[name].add_set_callback(self._tx_set)
+		rig._state['meter_type'].add_set_callback(self._meter_type_set)
+		rig._state['meter_value'].add_set_callback(self._reading_set)
+		for name in ('main_s_meter', 'sub_s_meter'):
+			rig._state[name].add_set_callback(self._reading_set)
+
+	def start(self):
+		with self._lock:
+			if self.running:
+				return
+			self.running = True
+			self._original = self._rig._state['meter_type']._cached
+			self._cycle_start = None
+			self._start_cycle()
+
+	def stop(self):
+		with self._lock:
+			if not self.running:
+				return
+			self.running = False
+			self._waiting = None
+			idle = self._rig._serial.idleQueue
+			idle.remove(self._queued)
+			self._queued = None
+			meter_type = self._rig._state['meter_type']
+			if self._original is not None and meter_type._do_range_check(self._original):
+				idle.put({'msgType': 'set', 'stateValue': meter_type, 'value': self._original})
+
+	# Returns the sampling rate in cycles per second, the rate of
+	# individual meter readings, and the standard deviation of the time
+	# between cycles (in seconds) over the recent cycles
+	def stats(self):
+		intervals = list(self._intervals.view()[1])
+		if len(intervals) == 0:
+			return {'cycles': self.cycles, 'rate': None, 'sample_rate': None, 'jitter': None}
+		mean = sum(intervals) / len(intervals)
+		jitter = (sum((i - mean) ** 2 for i in intervals) / len(intervals)) ** 0.5
+		return {
+			'cycles': self.cycles,
+			'rate': float(1 / mean),
+			'sample_rate': float((len(self._meters) + 1) / mean),
+			'jitter': float(jitter),
+		}
+
+	def _tx_set(self, prop, value):
+		if value:
+			if self.enabled:
+				self.start()
+		elif not self._rig._state['main_tx']._cached and not self._rig._state['sub_tx']._cached:
+			self.stop()
+
+	# Must be called with _lock held
+	def _start_cycle(self):
+		now = monotonic()
+		if self._cycle_start is not None:
+			self._intervals.append(now, now - self._cycle_start)
+			self.cycles += 1
+		self._cycle_start = now
+		self._meters = tuple(m for m in (meter.SWR, meter.COMPRESSION, meter.ALC) if self._rig._meter_value_range_check(m))
+		self._step = 0
+		self._send_next()
+
+	# Must be called with _lock held
+	def _queue(self, msg, waiting):
+		self._waiting = waiting
+		self._queued = msg
+		self._rig._serial.idleQueue.put(msg)
+
+	# Must be called with _lock held
+	def _send_next(self):
+		if self._step > len(self._meters):
+			self._start_cycle()
+			return
+		if self._step == len(self._meters):
+			name = 'main_s_meter' if self._rig._state['tx_main']._cached else 'sub_s_meter'
+			self._queue({'msgType': 'query', 'stateValue': self._rig._state[name]}, ('reading', self._rig._state[name]))
+			return
+		meter_type = self._rig._state['meter_type']
+		want = self._meters[self._step]
+		if meter_type._cached == want:
+			self._queue({'msgType': 'query', 'stateValue': self._rig._state['meter_value']}, ('reading', self._rig._state['meter_value']))
+		elif meter_type._do_range_check(want):
+			self._queue({'msgType': 'set', 'stateValue': meter_type, 'value': want}, ('type', want))
+		else:
+			self._step += 1
+			self._send_next()
+
+	def _meter_type_set(self, prop, value):
+		with self._lock:
+			if self.running and self._waiting == ('type', value):
+				self._queue({'msgType': 'query', 'stateValue': self._rig._state['meter_value']}, ('reading', self._rig._state['meter_value']))
+
+	def _reading_set(self, prop, value):
+		with self._lock:
+			if self.running and self._waiting == ('reading', prop):
+				self._step += 1
+				self._send_next()
+
+# Steps VFO A of the main receiver from start to stop and reads the main
+# S meter at each step, building an array of signal level against
+# frequency.  Each step is one message of an FA set followed by an SM0
+# query.  The FA echo is waited for before SM0 is sent, since over a
+# real link it arrives after the write and would otherwise be taken as
+# the SM0 reply.  The next step is queued before the current one is
+# answered so it goes out as soon as the SM0 reply is read.  Only the
+# reply to a step's own SM0 is taken as its reading.
+# Steps go through the idle queue so interactive commands still go
+# first.  A sweep can be aborted and resumed, and the VFO A frequency,
+# tuning modes, and operating mode are put back whenever it stops.
+# Levels not yet measured are NaN.
+class BandSweep:
+	# Number of steps kept queued.  The serial layer still waits for each
+	# SM0 reply before writing the next step, so this only keeps the next
+	# step ready to write as soon as the previous reading arrives.
+	DEPTH = 2
+
+	def __init__(self, rig, start, stop, step, **kwargs):
+		if step <= 0:
+			raise Exception('Sweep step must be positive')
+		if stop < start:
+			raise Exception('Sweep stop is below start')
+		for freq in (start, stop):
+			if rig._check_frequency(freq, 'rx_k_main') is None:
+				raise Exception('Sweep frequency '+str(freq)+' out of range')
+		self._rig = rig
+		self._mode = kwargs.get('mode')
+		self._lock = Lock()
+		self._in_flight = deque()
+		self._next = 0
+		self._start = None
+		self._original = None
+		self.start_frequency = start
+		self.step = step
+		self.count = (stop - start) // step + 1
+		self.levels = array('d', [nan]) * self.count
+		self.running = False
+		self.done = Event()
+
+	def frequency(self, index):
+		return self.start_frequency + index * self.step
+
+	def start(self):
+		with self._lock:
+			if self.running or self._next >= self.count:
+				return
+			self.running = True
+			self.done.clear()
+			self._start = monotonic()
+			self._setup()
+			while len(self._in_flight) < self.DEPTH and self._next < self.count:
+				self._queue_step()
+
+	def resume(self):
+		self.start()
+
+	def abort(self):
+		with self._lock:
+			if not self.running:
+				return
+			self.running = False
+			idle = self._rig._serial.idleQueue
+			# The write thread takes from the front, so once one can't be
+			# removed the ones before it have been sent
+			while len(self._in_flight) > 0 and idle.remove(self._in_flight[-1][1]):
+				idx, msg = self._in_flight.pop()
+				self._next = idx
+			if len(self._in_flight) == 0:
+				self._finish()
+
+	def wait(self, timeout = None):
+		return self.done.wait(timeout)
+
+	def progress(self):
+		return progress(self._next - len(self._in_flight), self.count, self._start)
+
+	# Returns the frequencies and levels as numpy arrays if available
+	def result(self):
+		freqs = array('d', (self.frequency(i) for i in range(self.count)))
+		numpy = load_numpy()
+		if numpy is not None:
+			return (numpy.array(freqs), numpy.array(self.levels))
+		return (freqs, array('d', self.levels))
+
+	# Must be called with _lock held
+	def _put(self, state, value):
+		if value is not None:
+			self._rig._serial.idleQueue.put({'msgType': 'set', 'stateValue': state, 'value': value})
+
+	# The original settings are kept from the first start, since after an
+	# abort the restoring sets may not have been echoed yet.
+	# Must be called with _lock held
+	def _setup(self):
+		st = self._rig._state
+		if self._original is None:
+			self._original = {name: st[name]._cached for name in ('main_rx_tuning_mode', 'main_tx_tuning_mode', 'main_rx_mode', 'vfoa_frequency')}
+		if self._original['main_rx_tuning_mode'] != tuningMode.VFOA:
+			self._put(st['main_rx_tuning_mode'], tuningMode.VFOA)
+		if self._mode is not None:
+			self._put(st['main_rx_mode'], self._mode)
+
+	# Must be called with _lock held
+	def _finish(self):
+		for name, value in self._original.items():
+			self._put(self._rig._state[name], value)
+		self.running = False
+		self.done.set()
+
+	# Must be called with _lock held
+	def _queue_step(self):
+		idx = self._next
+		self._next += 1
+		cmd = self._rig._state['vfoa_frequency']._set_format.format(self.frequency(idx)) + ';SM0'
+		msg = {'msgType': 'raw', 'command': cmd, 'reply': b'SM', 'on_reply': self._reading}
+		self._in_flight.append((idx, msg))
+		self._rig._serial.idleQueue.put(msg)
+
+	# Called from the read thread once the SM0 reply to one of our steps
+	# has been applied.  Replies come back in the order the steps were
+	# queued.
+	def _reading(self, msg):
+		with self._lock:
+			if len(self._in_flight) == 0 or self._in_flight[0][1] is not msg:
+				return
+			idx, msg = self._in_flight.popleft()
+			value = self._rig._state['main_s_meter']._cached
+			self.levels[idx] = nan if value is None else value
+			if self.running and self._next < self.count:
+				self._queue_step()
+			elif len(self._in_flight) == 0:
+				self._finish()
+
+# Scans memory channels on the main receiver from the host, stopping on
+# the first busy (squelch open) channel.  The channels to visit are worked
+# out up front from the loaded memories, skipping empty and locked out
+# channels and those outside the scanned groups, so the next switch is
+# always ready to send.  Each visit is one message of the MC recall
+# with the SM0 and BY queries behind it.  Each reply is waited for before
+# the next command is sent, since the MC echo and SM0 reply would
+# otherwise be read while BY is outstanding and taken as its reply.
+# SM0 and BY are then polled until dwell (at least MIN_DWELL) seconds
+# have passed since the first reply, so the squelch has time to open.
+# Only replies to the scanner's own queries are used.  The scan loops
+# until it finds activity (and stays on that channel) or is aborted (and
+# the original tuning is restored).
+class MemoryScanner:
+	# Seconds the squelch is given to open after a channel change
+	MIN_DWELL = 0.1
+
+	def __init__(self, rig, **kwargs):
+		self._rig = rig
+		self._dwell = max(kwargs.get('dwell', 0), self.MIN_DWELL)
+		self._loop = kwargs.get('loop', True)
+		self._lock = Lock()
+		self._channels = self._candidates(kwargs.get('channels'), kwargs.get('groups'))
+		if len(self._channels) == 0:
+			raise Exception('No memory channels to scan')
+		self._pos = 0
+		self._switched = None
+		self._outstanding = None
+		self._original = None
+		self._start = None
+		self.levels = {}
+		self.scanned = 0
+		self.active = None
+		self.running = False
+		self.done = Event()
+
+	# Returns the channels which will be scanned, in order
+	def _candidates(self, channels, groups):
+		if channels is None:
+			channels = range(290)
+		if groups is None:
+			groups = self._rig._state['memory_groups']._cached
+			if groups is not None and any(groups):
+				groups = [g for g in range(len(groups)) if groups[g]]
+			else:
+				groups = range(10)
+		groups = set(groups)
+		ret = []
+		for ch in channels:
+			mem = self._rig.memories.memories[ch]._cached
+			if mem is None or mem.get('Frequency') is None:
+				continue
+			if mem.get('LockedOut') or mem.get('MemoryGroup') not in groups:
+				continue
+			ret.append(ch)
+		return tuple(ret)
+
+	def start(self):
+		with self._lock:
+			if self.running:
+				return
+			self.running = True
+			self.active = None
+			self.done.clear()
+			self._start = monotonic()
+			st = self._rig._state
+			if self._original is None:
+				self._original = {name: st[name]._cached for name in ('main_rx_tuning_mode', 'main_tx_tuning_mode', 'main_memory_channel')}
+			if st['main_rx_tuning_mode']._cached != tuningMode.MEMORY:
+				self._rig._serial.idleQueue.put({'msgType': 'set', 'stateValue': st['main_rx_tuning_mode'], 'value': tuningMode.MEMORY})
+			self._switch()
+
+	def resume(self):
+		self.start()
+
+	def abort(self):
+		with self._lock:
+			if not self.running:
+				return
+			idle = self._rig._serial.idleQueue
+			idle.remove(self._outstanding)
+			for name, value in self._original.items():
+				if value is not None:
+					idle.put({'msgType': 'set', 'stateValue': self._rig._state[name], 'value': value})
+			# The original is kept in case the scan is resumed before
+			# the restoring sets are echoed
+			self._stop()
+
+	def wait(self, timeout = None):
+		return self.done.wait(timeout)
+
+	# Channels scanned per second since the scan was last started
+	def rate(self):
+		if self._start is None:
+			return None
+		return self.scanned / (monotonic() - self._start)
+
+	# Must be called with _lock held
+	def _stop(self):
+		self._outstanding = None
+		self.running = False
+		self.done.set()
+
+	# Must be called with _lock held
+	def _queue(self, cmd):
+		prefix, suffix = self._rig._state['main_memory_channel']._get_set_context()
+		self._outstanding = {'msgType': 'raw', 'command': prefix + cmd + suffix, 'reply': b'BY', 'on_reply': self._busy}
+		self._rig._serial.idleQueue.put(self._outstanding)
+
+	# Must be called with _lock held
+	def _switch(self):
+		self._switched = None
+		self._queue('MC{:03d};SM0;BY'.format(self._channels[self._pos]))
+
+	# Called from the read thread once the BY reply to our query has been
+	# applied.  The SM0 reply came just before it.
+	def _busy(self, msg):
+		with self._lock:
+			if not self.running or msg is not self._outstanding:
+				return
+			st = self._rig._state
+			self.levels[self._channels[self._pos]] = st['main_s_meter']._cached
+			value = st['busy_list']._cached
+			now = monotonic()
+			if self._switched is None:
+				self._switched = now
+				self.scanned += 1
+			if value is not None and value[0]:
+				self.active = self._channels[self._pos]
+				self._pos = (self._pos + 1) % len(self._channels)
+				self._original = None
+				self._stop()
+				return
+			if now - self._switched < self._dwell:
+				self._queue('SM0;BY')
+				return
+			self._pos += 1
+			if self._pos >= len(self._channels):
+				self._pos = 0
+				if not self._loop:
+					self._stop()
+					return
+			self._switch()
+
 class KenwoodHFSubRig(Rig):
 	def __init__(self, **kwargs):
 		self._state = {}
 		self._terminate = False
+		self._parent = kwargs.get('parent')
+		# The states belong to the parent, so its dispatcher and change
+		# feed are shared rather than starting new ones with
+		# Rig.__init__()
+		self._verbose = self._parent._verbose
+		self._dispatcher = self._parent._dispatcher
+		self._change_feed = self._parent._change_feed
+		self._state_name_map = None
 
 	def add_property(self, name, state_value):
 		self._state[name] = state_value
 
+	def add_terminate_callback(self, cb):
+		self._parent.add_terminate_callback(cb)
+
 	def __getattr__(self, name):
 		if name in self._state:
 			if hasattr(self, '_readThread') and get_ident() == self._readThread.ident:
@@ -798,6 +1334,15 @@ class KenwoodHFSubRig(Rig):
 				return
 		super().__setattr__(name ,value)
 
+	def batch(self):
+		return self._parent.batch()
+
+	def _refresh_many(self, states):
+		self._parent._refresh_many(states)
+
+	def _state_names(self):
+		return memory_names(super()._state_names(), self.memories)
+
 	def terminate(self):
 		self._terminate = True
 
@@ -878,6 +1423,12 @@ class KenwoodHF(Rig):
 		'2m':   [144000000, 145995000],
 		'70cm': [430000000, 439995000],
 	}
+	# All of the above in one index for range checks
+	frequency_ranges = RangeIndex(
+		tx_k = tx_ranges_k, tx_e = tx_ranges_e, tx_e2 = tx_ranges_e2,
+		rx_k_main = rx_ranges_k_main, rx_e_main = rx_ranges_e_main, rx_e2_main = rx_ranges_e2_main,
+		rx_k_sub = rx_ranges_k_sub, rx_e_sub = rx_ranges_e_sub, rx_e2_sub = rx_ranges_e2_sub,
+	)
 
 	def __init__(self, **kwargs):
 		super().__init__(**kwargs)
@@ -888,6 +1439,13 @@ class KenwoodHF(Rig):
 		self._last_hack = 0
 		self._last_power_state = None
 		self._fill_cache_state = {}
+		self.memory_loader = None
+		self.meter_sampler = None
+		self._meter_sampling = kwargs.get('meter_sampling', True)
+		self._dirty = {}
+		self._dirty_lock = Lock()
+		self._applying = False
+		self._batch_local = local()
 		self._serial = KenwoodHFProtocol(**kwargs)
 		# All supported rigs must support the ID command
 		self._state = {
@@ -935,6 +1493,56 @@ class KenwoodHF(Rig):
 	def __del__(self):
 		self.terminate()
 
+	# Starts sweeping the main receiver from start to stop (in Hz) and
+	# returns the BandSweep.  If mode is passed, the sweep is done in
+	# that mode.
+	def sweep(self, start, stop, step = 1000, **kwargs):
+		ret = BandSweep(self, start, stop, step, **kwargs)
+		ret.start()
+		return ret
+
+	# Starts a host side scan of the memory channels and returns the
+	# MemoryScanner.  channels and groups limit what is scanned, dwell
+	# is the minimum time in seconds spent on each channel (never less
+	# than MemoryScanner.MIN_DWELL), and with loop = False the scan stops
+	# after one pass.
+	def scan_memories(self, **kwargs):
+		ret = MemoryScanner(self, **kwargs)
+		ret.start()
+		return ret
+
+	# Switches obj to a generated subclass with a property for each of
+	# its states so reads don't need to go through __getattr__(), and
+	# with the read thread check resolved up front.  Writes to states
+	# skip the _state lookup in __setattr__() too.
+	def _add_accessors(self, obj):
+		cls = type(obj)
+		states = {}
+		ns = {}
+		read_thread = self._readThread.ident
+		for name, state in obj._state.items():
+			if isinstance(state, StateValue) and not hasattr(cls, name):
+				states[name] = state
+				ns[name] = self._accessor(state, read_thread)
+		base_setattr = cls.__setattr__
+		def __setattr__(obj, name, value):
+			state = states.get(name)
+			if state is None:
+				base_setattr(obj, name, value)
+			else:
+				state.value = value
+		ns['__setattr__'] = __setattr__
+		ns['__module__'] = cls.__module__
+		obj.__class__ = type(cls.__name__, (cls,), ns)
+
+	@staticmethod
+	def _accessor(state, read_thread):
+		def fget(obj):
+			if get_ident() == read_thread:
+				return state._cached
+			return state.value
+		return property(fget, doc = state.name)
+
 	# Init methods for specific rig IDs go here
 	def _init_19(self):
 		# A list of all handlers for commands send by the rig
@@ -1334,6 +1942,7 @@ class KenwoodHF(Rig):
 				in_rig = InRig.BOTH,
 				query_state = QueryState.ANY,
 				set_state = SetState.ANY,
+				fill_priority = FillPriority.CONTROL,
 			),
 			'main_down': KenwoodStateValue(self,
 				name = 'down',
@@ -1369,7 +1978,7 @@ class KenwoodHF(Rig):
 				query_state = QueryState.CONTROL,
 				set_state = SetState.CONTROL,
 			),
-			'vfoa_frequency': KenwoodStateValue(self,
+			'vfoa_frequency': KenwoodTuningStateValue(self,
 				echoed = True,
 				query_command = 'FA',
 				set_format = 'FA{:011d}',
@@ -1377,8 +1986,9 @@ class KenwoodHF(Rig):
 				in_rig = InRig.MAIN,
 				query_state = QueryState.ANY,
 				set_state = SetState.ANY,
+				fill_priority = FillPriority.HIGH,
 			),
-			'vfob_frequency': KenwoodStateValue(self,
+			'vfob_frequency': KenwoodTuningStateValue(self,
 				echoed = True,
 				query_command = 'FB',
 				set_format = 'FB{:011d}',
@@ -1386,8 +1996,9 @@ class KenwoodHF(Rig):
 				in_rig = InRig.MAIN,
 				query_state = QueryState.ANY,
 				set_state = SetState.ANY,
+				fill_priority = FillPriority.HIGH,
 			),
-			'sub_vfo_frequency': KenwoodStateValue(self,
+			'sub_vfo_frequency': KenwoodTuningStateValue(self,
 				name = 'vfo_frequency',
 				echoed = True,
 				query_command = 'FC',
@@ -1396,6 +2007,7 @@ class KenwoodHF(Rig):
 				in_rig = InRig.SUB,
 				query_state = QueryState.ANY,
 				set_state = SetState.ANY,
+				fill_priority = FillPriority.HIGH,
 			),
 			'filter_display_pattern': KenwoodStateValue(self,
 				query_command = 'FD',
@@ -1413,7 +2025,8 @@ class KenwoodHF(Rig):
 				in_rig = InRig.MAIN,
 				query_state = QueryState.NOT_TS,
 				set_state = SetState.NOT_TS,
-				range_check = self._main_rx_tuning_mode_range_check
+				range_check = self._main_rx_tuning_mode_range_check,
+				fill_priority = FillPriority.TUNING,
 			),
 			'sub_tuning_mode': KenwoodStateValue(self,
 				name = 'rx_tuning_mode',
@@ -1452,7 +2065,8 @@ class KenwoodHF(Rig):
 				in_rig = InRig.MAIN,
 				query_state = QueryState.CONTROL,
 				set_state = SetState.CONTROL,
-				range_check = self._main_tx_tuning_mode_range_check
+				range_check = self._main_tx_tuning_mode_range_check,
+				fill_priority = FillPriority.TUNING,
 			),
 			'filter_width': KenwoodStateValue(self,
 				echoed = True,
@@ -1601,6 +2215,7 @@ class KenwoodHF(Rig):
 				in_rig = InRig.MAIN,
 				query_state = QueryState.NOT_TS,
 				set_state = SetState.NOT_TS,
+				fill_priority = FillPriority.HIGH,
 			),
 			'main_tx_mode': KenwoodStateValue(self,
 				name = 'tx_mode',
@@ -1950,24 +2565,36 @@ class KenwoodHF(Rig):
 			),
 			'meter_value': KenwoodStateValue(self,
 				query_command = 'RM',
+				history = METER_HISTORY,
 				in_rig = InRig.BOTH,
 				query_state = QueryState.ANY,
 				set_state = SetState.NONE,
 			),
 			'swr_meter': KenwoodStateValue(self,
 				query_command = 'RM',
+				history = METER_HISTORY,
 				in_rig = InRig.BOTH,
 				query_state = QueryState.ANY,
 				set_state = SetState.NONE,
 			),
 			'compression_meter': KenwoodStateValue(self,
 				query_command = 'RM',
+				history = METER_HISTORY,
 				in_rig = InRig.BOTH,
 				query_state = QueryState.ANY,
 				set_state = SetState.NONE,
 			),
 			'alc_meter': KenwoodStateValue(self,
 				query_command = 'RM',
+				history = METER_HISTORY,
+				in_rig = InRig.BOTH,
+				query_state = QueryState.ANY,
+				set_state = SetState.NONE,
+			),
+			'power_meter': KenwoodStateValue(self,
+				query_method = self._power_meter_query,
+				history = METER_HISTORY,
+				validity_check = self._power_meter_valid,
 				in_rig = InRig.BOTH,
 				query_state = QueryState.ANY,
 				set_state = SetState.NONE,
@@ -2064,6 +2691,7 @@ class KenwoodHF(Rig):
 			'main_s_meter': KenwoodStateValue(self,
 				name = 's_meter',
 				query_command = 'SM0',
+				history = METER_HISTORY,
 				in_rig = InRig.MAIN,
 				set_state = SetState.NONE,
 				query_state = QueryState.ANY,
@@ -2071,6 +2699,7 @@ class KenwoodHF(Rig):
 			'sub_s_meter': KenwoodStateValue(self,
 				name = 's_meter',
 				query_command = 'SM1',
+				history = METER_HISTORY,
 				in_rig = InRig.SUB,
 				set_state = SetState.NONE,
 				query_state = QueryState.ANY,
@@ -2231,6 +2860,7 @@ class KenwoodHF(Rig):
 				in_rig = InRig.MAIN,
 				set_state = SetState.NOT_TS,
 				query_state = QueryState.CONTROL,
+				fill_priority = FillPriority.TUNING,
 			),
 			'firmware_type': KenwoodStateValue(self,
 				query_command = 'TY',
@@ -2308,6 +2938,7 @@ class KenwoodHF(Rig):
 				in_rig = InRig.BOTH,
 				query_state = QueryState.ANY,
 				set_state = SetState.ANY,
+				fill_priority = FillPriority.BEEP,
 			),
 			'memory_vfo_split_enabled': KenwoodStateValue(self,
 				echoed = False,
@@ -2334,28 +2965,48 @@ class KenwoodHF(Rig):
 				set_state = SetState.ANY,
 			),
 			# Synthetic states
-			'main_rx_frequency': KenwoodStateValue(self,
+			# A dict with the number of fill queries done, the total, and
+			# the estimated number of seconds until the fill completes
+			'cache_fill_progress': KenwoodStateValue(self,
+				query_method = self._cache_fill_progress_query,
+				works_powered_off = True,
+				in_rig = InRig.BOTH,
+				query_state = QueryState.ANY,
+				set_state = SetState.NONE,
+				read_only = True,
+			),
+			# Same as cache_fill_progress, but for the background
+			# memory channel load
+			'memory_load_progress': KenwoodStateValue(self,
+				query_method = self._memory_load_progress_query,
+				works_powered_off = True,
+				in_rig = InRig.BOTH,
+				query_state = QueryState.ANY,
+				set_state = SetState.NONE,
+				read_only = True,
+			),
+			'main_rx_frequency': KenwoodDerivedValue(self,
+				derive = self._main_rx_frequency_derive,
 				name = 'rx_frequency',
 				echoed = True,
-				query_method = self._main_rx_frequency_query,
 				set_method = self._set_main_rx_frequency,
 				in_rig = InRig.MAIN,
 				query_state = QueryState.ANY,
 				set_state = SetState.ANY,
 			),
-			'main_tx_frequency': KenwoodStateValue(self,
+			'main_tx_frequency': KenwoodDerivedValue(self,
+				derive = self._main_tx_frequency_derive,
 				name = 'tx_frequency',
 				echoed = True,
-				query_method = self._main_tx_frequency_query,
 				set_method = self._set_main_tx_frequency,
 				in_rig = InRig.MAIN,
 				query_state = QueryState.ANY,
 				set_state = SetState.ANY,
 			),
-			'sub_frequency': KenwoodStateValue(self,
+			'sub_frequency': KenwoodDerivedValue(self,
+				derive = self._sub_frequency_derive,
 				name = 'frequency',
 				echoed = True,
-				query_method = self._sub_frequency_query,
 				set_method = self._set_sub_frequency,
 				in_rig = InRig.SUB,
 				query_state = QueryState.ANY,
@@ -2585,8 +3236,8 @@ class KenwoodHF(Rig):
 					p.name = a
 
 		# Now build the two sub-receivers as Rig instances
-		main = KenwoodHFSubRig()
-		sub = KenwoodHFSubRig()
+		main = KenwoodHFSubRig(parent = self)
+		sub = KenwoodHFSubRig(parent = self)
 		for a, p in self._state.items():
 			if isinstance(p, StateValue):
 				if p.name[0:5] == 'main_':
@@ -2630,33 +3281,83 @@ class KenwoodHF(Rig):
 		self.memories = MemoryArray(self)
 		main.memories = self.memories
 		sub.memories = self.memories
+		self.memory_loader = MemoryLoader(self, self.memories)
+		self.meter_sampler = MeterSampler(self)
+		self.meter_sampler.enabled = self._meter_sampling
+		# The tuned frequencies depend on the VFOs, the tuning modes,
+		# the memory channels, and the memory they're tuned to, which
+		# is added by read_memory() when they're derived
+		for a in ('main_rx_frequency', 'main_tx_frequency'):
+			for d in (a.replace('frequency', 'tuning_mode'), 'vfoa_frequency', 'vfob_frequency', 'main_memory_channel'):
+				self._state[a].add_dependency(self._state[d])
+		for d in ('sub_tuning_mode', 'sub_vfo_frequency', 'sub_memory_channel'):
+			self._state['sub_frequency'].add_dependency(self._state[d])
+		main.memory_loader = self.memory_loader
+		sub.memory_loader = self.memory_loader
+		main.meter_sampler = self.meter_sampler
+		sub.meter_sampler = self.meter_sampler
 		self.rigs = (main, sub)
+		for r in (self,) + self.rigs:
+			self._add_accessors(r)
 
 		if self.power_on:
 			if self.auto_information != 2:
 				self.auto_information = 2
 		self._fill_cache()
+		self.memory_loader.start()
 
 	def _readThread(self):
-		while not self._terminate:
-			cmdline = self._serial.read()
-			if cmdline is not None:
-				m = match(b"^.*?([\?A-Z]{1,2})([\x20-\x3a\x3c-\x7f\xff]*?);$", cmdline)
-				if m:
-					if self._aliveWait is not None:
-						self._aliveWait.set()
-					cmd = m.group(1)
-					# \xff is in PK command...
-					args = m.group(2).replace(b'\xff', b' ').decode('ascii')
-					if cmd in self._command:
-						self._command[cmd](args)
-					else:
-						if cmd == b'PS':
-							self._serial.PS_works = True
+		try:
+			while not self._terminate:
+				cmdline = self._serial.read()
+				if cmdline is not None:
+					m = match(b"^.*?([\?A-Z]{1,2})([\x20-\x3a\x3c-\x7f\xff]*?);$", cmdline)
+					if m:
+						if self._aliveWait is not None:
+							self._aliveWait.set()
+						cmd = m.group(1)
+						# \xff is in PK command...
+						args = m.group(2).replace(b'\xff', b' ').decode('ascii')
+						if cmd in self._command:
+							self._applying = True
+							try:
+								self._command[cmd](args)
+							finally:
+								self._applying = False
+							self._recompute_dirty()
+							msg = self._serial.reply_to
+							if msg is not None and msg.get('reply') == cmd and msg.get('on_reply') is not None:
+								msg['on_reply'](msg)
 						else:
-							print('Unhandled command "%s" (args: "%s")' % (cmd, args), file=stderr)
-				else:
-					print('Bad command line: "'+str(cmdline)+'"', file=stderr)
+							if cmd == b'PS':
+								self._serial.PS_works = True
+							else:
+								print('Unhandled command "%s" (args: "%s")' % (cmd, args), file=stderr)
+					else:
+						print('Bad command line: "'+str(cmdline)+'"', file=stderr)
+		finally:
+			self._terminated()
+
+	# Derived states are recomputed immediately, unless the read thread
+	# is in the middle of applying a response, in which case they are
+	# recomputed once after the response is applied.
+	def _mark_dirty(self, state):
+		self._dirty_lock.acquire()
+		self._dirty[state] = None
+		self._dirty_lock.release()
+		if not self._applying or get_ident() != self._readThread.ident:
+			self._recompute_dirty()
+
+	def _recompute_dirty(self):
+		while True:
+			self._dirty_lock.acquire()
+			if len(self._dirty) == 0:
+				self._dirty_lock.release()
+				return
+			state = next(iter(self._dirty))
+			del self._dirty[state]
+			self._dirty_lock.release()
+			state._recompute()
 
 	def _send_query(self, state):
 		self._serial.writeQueue.put({
@@ -2681,9 +3382,170 @@ class KenwoodHF(Rig):
 			raise Exception("I've been here all day waiting for "+str(state.name))
 		state.remove_set_callback(cb)
 
+	# Refreshes states in as few batches as possible.  Derived states are
+	# refreshed by refreshing the states they're derived from and then
+	# recomputing them.  Refreshing a tuning mode can change which states
+	# are read, so any new ones are refreshed in a further batch.
+	def _refresh_many(self, states):
+		if get_ident() == self._readThread.ident:
+			return
+		derived = []
+		batch = []
+		for state in states:
+			if not isinstance(state, KenwoodDerivedValue):
+				batch.append(state)
+			elif state._valid(True):
+				derived.append(state)
+		refreshed = set()
+		for attempt in range(3):
+			for state in derived:
+				batch.extend(state._query_inputs())
+			batch = [state for state in batch if state not in refreshed]
+			if len(batch) == 0:
+				break
+			self._refresh_batch(batch)
+			refreshed.update(batch)
+			batch = []
+			for state in derived:
+				state._recompute()
+
+	# Sends the queries for states as a single batch, and waits for them
+	# all to be answered.  States without a query command are queried
+	# one at a time afterward.
+	def _refresh_batch(self, states):
+		if self._filling_cache:
+			self._fill_cache_wait()
+		queries = []
+		others = []
+		for state in states:
+			if isinstance(state, KenwoodSingleStateValue):
+				state = state._parent
+			if state in queries or state in others or not state._valid(True):
+				continue
+			if state._query_command is None:
+				others.append(state)
+			else:
+				queries.append(state)
+		waits = []
+		for state in queries:
+			ev = Event()
+			cb = partial(lambda ev, x, y: ev.set(), ev)
+			state.add_set_callback(cb)
+			waits.append((state, ev, cb))
+		if len(queries) > 0:
+			self._error_count = 0
+			self._serial.writeQueue.put({
+				'msgType': 'batch',
+				'rig': self,
+				'messages': [{'msgType': 'query', 'stateValue': state} for state in queries],
+			})
+		deadline = monotonic() + 1
+		for state, ev, cb in waits:
+			ev.wait(max(deadline - monotonic(), 0))
+			state.remove_set_callback(cb)
+		for state in others:
+			self._query(state)
+
+	@contextmanager
+	def batch(self):
+		outer = getattr(self._batch_local, 'items', None)
+		if outer is not None:
+			yield self
+			return
+		self._batch_local.items = {}
+		try:
+			yield self
+			items = self._batch_local.items
+		finally:
+			self._batch_local.items = None
+		if len(items) > 0:
+			self._serial.writeQueue.put({
+				'msgType': 'batch',
+				'rig': self,
+				'messages': [{
+					'msgType': 'set',
+					'stateValue': state,
+					'value': value,
+				} for state, value in items.items()],
+			})
+
+	def _state_names(self):
+		return memory_names(super()._state_names(), self.memories)
+
+	# Returns True if the set was added to the current thread's batch
+	def _batch_add(self, state, value):
+		items = getattr(self._batch_local, 'items', None)
+		if items is None:
+			return False
+		if isinstance(state, KenwoodListStateValue):
+			old = items.get(state)
+			if old is None:
+				old = state._cached
+			value = [old[i] if value[i] is None else value[i] for i in range(state.length)]
+		# Setting it again moves it to where it was last set
+		items.pop(state, None)
+		items[state] = value
+		return True
+
+	# Builds the command string for a batch of set and query messages.
+	# Messages are sent in the order they were submitted, and adjacent
+	# ones needing the same receiver/TS context are sent together inside
+	# a single switch.  A set that changes the context ends the switch
+	# it's in.  All range checks and contexts are evaluated against the
+	# cached state when the batch is sent.
+	def _batch_string(self, messages):
+		context_states = [self._state[name] for name in ('control_list', 'transmit_set') if name in self._state]
+		# (context, command, ends the switch) in submission order
+		cmds = []
+		queries = []
+		for msg in messages:
+			state = msg['stateValue']
+			if msg['msgType'] == 'query':
+				if not state._valid(True):
+					state._cached = None
+					continue
+				cmds.append((state._get_query_prefix_suffix(), state._query_command, False))
+				continue
+			cmd = state._set_command(msg['value'])
+			if cmd is None:
+				continue
+			if cmd == '':
+				state._cached = state._cached
+				continue
+			context = state._get_set_context()
+			ends = state in context_states
+			if state._echoed:
+				cmds.append((context, cmd, ends))
+				continue
+			# Re-read non-echoed values, inside the same switch if possible
+			if state._query_command is not None and state._get_query_prefix_suffix() == context and state._valid(False):
+				cmds.append((context, '\x00' + cmd, False))
+				cmds.append((context, state._query_command, ends))
+			else:
+				cmds.append((context, '\x00' + cmd, ends))
+				queries.append(state)
+		groups = []
+		ended = True
+		for context, cmd, ends in cmds:
+			if ended or groups[-1][0] != context:
+				groups.append((context, []))
+			groups[-1][1].append(cmd)
+			ended = ends
+		ret = []
+		for context, group in groups:
+			ret.append(context[0] + ';'.join(group) + context[1])
+			self._serial.context_bytes_saved += (len(group) - 1) * (len(context[0]) + len(context[1]))
+		for state in queries:
+			qs = state._query_string()
+			if qs is not None and qs != '':
+				ret.append(qs)
+		return ';'.join(ret)
+
 	def _set(self, state, value):
 		if value is None:
 			raise Exception('Attempt to set '+state.name+' to None')
+		if self._batch_add(state, value):
+			return
 		self._serial.writeQueue.put({
 			'msgType': 'set',
 			'stateValue': state,
@@ -2701,8 +3563,10 @@ class KenwoodHF(Rig):
 			if hasattr(self.rigs[1], '_terminate'):
 				self.rigs[1]._terminate = True
 		self._serial.terminate()
+		self._dispatcher.terminate()
 		if hasattr(self, 'readThread'):
 			self._readThread.join()
+		self._terminated()
 
 	def _fill_cache_wait(self):
 		self._fill_cache_state['event'].wait()
@@ -2744,6 +3608,16 @@ class KenwoodHF(Rig):
 					self._set(self._state['beep_output_level'], self._fill_cache_state['beep'])
 				else:
 					self._fill_cache_state['event'].set()
+		self._cache_fill_progress_query()
+
+	def _fill_cache_watched(self, state):
+		if len(state._modify_callbacks) > 0:
+			return True
+		if isinstance(state, KenwoodListStateValue):
+			for c in state.children:
+				if c is not None and len(c._modify_callbacks) > 0:
+					return True
+		return False
 
 	def _fill_cache(self):
 		if self._state['power_on']._cached == False:
@@ -2751,38 +3625,30 @@ class KenwoodHF(Rig):
 		if self._filling_cache:
 			return
 		self._filling_cache = True
-		done = {}
-		self._fill_cache_state['todo'] = []
+		queries = {}
 		self._fill_cache_state['call_after'] = ()
-		self._fill_cache_state['target_count'] = 0
 		self._fill_cache_state['matched_count'] = 0
+		self._fill_cache_state['start'] = monotonic()
 		self._fill_cache_state['event'] = Event()
 		self._fill_cache_state['beep'] = None
-		# Perform queries in this order:
-		# 0) FA, FB, FC
-		# 1) Simple string queries without validators
-		# 2) Simple string queries with validators
-		# 3) Method queries
+		# Each query command is sent once, ordered by the lowest
+		# fill_priority of all the states it fills, then by whether
+		# any of those states currently have watchers.  Method queries
+		# are performed after all the commands have been answered.
 		for a, p in self._state.items():
 			if isinstance(p, StateValue):
 				if p._query_command is None:
 					if p._query_method is not None:
 						self._fill_cache_state['call_after'] += ((p._query_method,a),)
 				else:
-					if not p._query_command in done:
-						done[p._query_command] = True
-						self._fill_cache_state['target_count'] += 1
-						if p._validity_check is not None:
-							self._fill_cache_state['todo'].append((p, self._fill_cache_cb,a))
-						else:
-							self._fill_cache_state['todo'].insert(0, (p, self._fill_cache_cb,a))
-		# We need control_main, main_rx_tuning_mode, and main_tx_tuning_mode first
-		self._fill_cache_state['target_count'] += 5
-		self._fill_cache_state['todo'].insert(0, (self._state['main_tx_tuning_mode'], self._fill_cache_cb,'main_tx_tuning_mode'))
-		self._fill_cache_state['todo'].insert(0, (self._state['main_rx_tuning_mode'], self._fill_cache_cb,'main_rx_tuning_mode'))
-		self._fill_cache_state['todo'].insert(0, (self._state['transmit_set'], self._fill_cache_cb,'transmit_set'))
-		self._fill_cache_state['todo'].insert(0, (self._state['control_list'], self._fill_cache_cb,'control_list'))
-		self._fill_cache_state['todo'].insert(0, (self._state['beep_output_level'], self._fill_cache_cb,'beep_output_level'))
+					key = (p._fill_priority, not self._fill_cache_watched(p))
+					if not p._query_command in queries:
+						queries[p._query_command] = [key, len(queries), p, a]
+					elif key < queries[p._query_command][0]:
+						queries[p._query_command][0] = key
+		todo = sorted(queries.values(), key = lambda x: (x[0], x[1]))
+		self._fill_cache_state['todo'] = [(q[2], self._fill_cache_cb, q[3]) for q in todo]
+		self._fill_cache_state['target_count'] = len(todo)
 		self._fill_cache_cb(None, None)
 		if get_ident() != self._readThread.ident:
 			self._fill_cache_wait()
@@ -2790,6 +3656,7 @@ class KenwoodHF(Rig):
 
 	def _kill_cache(self):
 		self._killing_cache = True
+		self._fill_cache_state['matched_count'] = 0
 		for a, p in self._state.items():
 			if isinstance(p, StateValue):
 				if p._query_command in ('PS', 'ID'):
@@ -2798,53 +3665,55 @@ class KenwoodHF(Rig):
 		self._killing_cache = False
 
 	# Query methods return a string to send to the rig
-	def _main_rx_frequency_query(self):
-		if self._state['main_rx_tuning_mode']._cached == tuningMode.VFOA:
-			self._state['main_rx_frequency']._cached = self._state['vfoa_frequency']._cached
-		elif self._state['main_rx_tuning_mode']._cached == tuningMode.VFOB:
-			self._state['main_rx_frequency']._cached = self._state['vfob_frequency']._cached
-		elif self._state['main_rx_tuning_mode']._cached == tuningMode.MEMORY:
-			if self._state['main_memory_channel']._cached is not None:
-				if self.memories.memories[self._state['main_memory_channel']._cached]._cached is not None:
-					self._state['main_rx_frequency']._cached = self.memories.memories[self._state['main_memory_channel']._cached]._cached['Frequency']
-		elif self._state['main_rx_tuning_mode']._cached == tuningMode.CALL:
-			if self.memories.memories[300]._cached is not None:
-				self._state['main_rx_frequency']._cached = self.memories.memories[300]._cached['Frequency']
+	def _power_meter_query(self):
+		return 'SM0' if self._state['tx_main']._cached else 'SM1'
+
+	def _cache_fill_progress_query(self):
+		self._state['cache_fill_progress']._cached = progress(
+			self._fill_cache_state.get('matched_count', 0),
+			self._fill_cache_state.get('target_count', 0),
+			self._fill_cache_state.get('start'))
 		return ''
 
-	def _main_tx_frequency_query(self):
-		if self._state['main_tx_tuning_mode']._cached == tuningMode.VFOA:
-			self._state['main_tx_frequency']._cached = self._state['vfoa_frequency']._cached
-		elif self._state['main_tx_tuning_mode']._cached == tuningMode.VFOB:
-			self._state['main_tx_frequency']._cached = self._state['vfob_frequency']._cached
-		elif self._state['main_tx_tuning_mode']._cached == tuningMode.MEMORY:
-			if self._state['main_memory_channel']._cached is not None:
-				if self.memories.memories[self._state['main_memory_channel']._cached]._cached is not None:
-					self._state['main_tx_frequency']._cached = self.memories.memories[self._state['main_memory_channel']._cached]._cached['Frequency']
-		elif self._state['main_tx_tuning_mode']._cached == tuningMode.CALL:
-			if self.memories.memories[300]._cached is not None:
-				self._state['main_tx_frequency']._cached = self.memories.memories[300]._cached['Frequency']
+	def _memory_load_progress_query(self):
+		self.memory_loader.update_progress()
 		return ''
 
-	def _sub_frequency_query(self):
-		if self._state['sub_tuning_mode']._cached == tuningMode.VFOA:
-			self._state['sub_frequency']._cached = self._state['sub_vfo_frequency']._cached
-		elif self._state['sub_tuning_mode']._cached == tuningMode.VFOB:
-			self._state['sub_frequency']._cached = self._state['sub_vfo_frequency']._cached
-		elif self._state['sub_tuning_mode']._cached == tuningMode.MEMORY:
-			if self._state['sub_memory_channel']._cached is not None:
-				if self.memories.memories[self._state['sub_memory_channel']._cached]._cached is not None:
-					self._state['sub_frequency']._cached = self.memories.memories[self._state['sub_memory_channel']._cached]._cached['Frequency']
-				else:
-					self._send_query(self.memories.memories[self._state['sub_memory_channel']._cached])
-					self._state['sub_frequency']._cached = None
-		elif self._state['sub_tuning_mode']._cached == tuningMode.CALL:
-			if self.memories.memories[300]._cached is not None:
-				self._state['sub_frequency']._cached = self.memories.memories[300]._cached['Frequency']
-			else:
-				self._send_query(self.memories.memories[self._state['sub_memory_channel']._cached])
-				self._state['sub_frequency']._cached = None
-		return ''
+	# Derive methods return the new value of a KenwoodDerivedValue
+	def _tuned_frequency(self, state, tuning_mode_state, vfoa, vfob, channel):
+		tuning_mode = tuning_mode_state._cached
+		mem = None
+		if tuning_mode == tuningMode.MEMORY and channel._cached is not None:
+			mem = self.memories.memories[channel._cached]
+		elif tuning_mode == tuningMode.CALL:
+			mem = self.memories.memories[300]
+		state.read_memory(mem)
+		if tuning_mode == tuningMode.VFOA:
+			state.read_inputs((tuning_mode_state, vfoa))
+			return vfoa._predicted()
+		elif tuning_mode == tuningMode.VFOB:
+			state.read_inputs((tuning_mode_state, vfob))
+			return vfob._predicted()
+		elif tuning_mode == tuningMode.MEMORY:
+			state.read_inputs((tuning_mode_state, channel) + (() if mem is None else (mem,)))
+		else:
+			state.read_inputs((tuning_mode_state,) + (() if mem is None else (mem,)))
+		if mem is None:
+			return None
+		if mem._cached is None:
+			if mem._valid(False):
+				self._send_query(mem)
+			return None
+		return mem._cached.get('Frequency')
+
+	def _main_rx_frequency_derive(self):
+		return self._tuned_frequency(self._state['main_rx_frequency'], self._state['main_rx_tuning_mode'], self._state['vfoa_frequency'], self._state['vfob_frequency'], self._state['main_memory_channel'])
+
+	def _main_tx_frequency_derive(self):
+		return self._tuned_frequency(self._state['main_tx_frequency'], self._state['main_tx_tuning_mode'], self._state['vfoa_frequency'], self._state['vfob_frequency'], self._state['main_memory_channel'])
+
+	def _sub_frequency_derive(self):
+		return self._tuned_frequency(self._state['sub_frequency'], self._state['sub_tuning_mode'], self._state['sub_vfo_frequency'], self._state['sub_vfo_frequency'], self._state['sub_memory_channel'])
 
 	# Range check methods return True or False
 	def _tuner_list_range_check(self, value):
@@ -2868,7 +3737,7 @@ class KenwoodHF(Rig):
 		if self._state['main_tx_frequency']._cached > 60000000:
 			return False
 		# Tuner will not respond to commands with TX outside of band
-		if self._check_frequency(self._state['main_tx_frequency']._cached, self.tx_ranges_k) is None:
+		if self._check_frequency(self._state['main_tx_frequency']._cached, 'tx_k') is None:
 			return False
 		return True
 
@@ -2986,6 +3855,9 @@ class KenwoodHF(Rig):
 	def _clear_rit_range_check(self, value):
 		return self._state['rit']._cached or self._state['xit']._cached
 
+	def _power_meter_valid(self):
+		return self._state['main_tx']._cached == True or self._state['sub_tx']._cached == True
+
 	def _meter_value_range_check(self, value):
 		if meter(value) == meter.COMPRESSION and not self._state['speech_processor']._cached:
 			return False
@@ -3218,21 +4090,20 @@ class KenwoodHF(Rig):
 			return False
 		return True
 
-	def _check_frequency(self, value, band_list):
-		for b in band_list:
-			if value >= band_list[b][0] and value <= band_list[b][1]:
-				return b
-		return None
+	# Returns the name of the band value is in from a frequency_ranges
+	# column, or None
+	def _check_frequency(self, value, ranges):
+		return self.frequency_ranges.band(value, ranges)
 
 	def _checkMainFrequencyValid(self, value):
 		# Always invalid while transmitting
 		if self._state['tx']._cached:
 			print('Transmitting, cannot set frequency', file=stderr)
 			return False
-		return self._check_frequency(value, self.rx_ranges_k_main) is not None
+		return self._check_frequency(value, 'rx_k_main') is not None
 
 	def _checkSubFrequencyValid(self, value):
-		return self._check_frequency(value, self.rx_ranges_k_sub) is not None
+		return self._check_frequency(value, 'rx_k_sub') is not None
 
 	def _check_transmitSet(self, value):
 		if not value:
@@ -3357,19 +4228,14 @@ class KenwoodHF(Rig):
 	def _update_FA(self, args):
 		split = self.parse('11d', args)
 		self._state['vfoa_frequency']._cached = split[0]
-		self._main_rx_frequency_query()
-		self._main_tx_frequency_query()
 
 	def _update_FB(self, args):
 		split = self.parse('11d', args)
 		self._state['vfob_frequency']._cached = split[0]
-		self._main_rx_frequency_query()
-		self._main_tx_frequency_query()
 
 	def _update_FC(self, args):
 		split = self.parse('11d', args)
 		self._state['sub_vfo_frequency']._cached = split[0]
-		self._sub_frequency_query()
 
 	def _update_FD(self, args):
 		split = self.parse('8x', args)
@@ -3384,12 +4250,9 @@ class KenwoodHF(Rig):
 		if self._state['control_main']._cached:
 			self._state['main_rx_tuning_mode']._cached = tuning_mode
 			self._state['main_tx_tuning_mode']._cached = tuning_mode
-			self._main_rx_frequency_query()
-			self._main_tx_frequency_query()
 			self._state['split']._cached = False
 		else:
 			self._state['sub_tuning_mode']._cached = tuning_mode
-			self._sub_frequency_query()
 
 	def _update_FS(self, args):
 		split = self.parse('1d', args)
@@ -3407,10 +4270,8 @@ class KenwoodHF(Rig):
 				self._state['split']._cached = True
 			else:
 				self._state['split']._cached = False
-			self._main_tx_frequency_query()
 		else:
 			self._state['sub_tuning_mode']._cached = tuning_mode
-			self._sub_frequency_query()
 
 	def _update_FW(self, args):
 		split = self.parse('4d', args)
@@ -3541,11 +4402,8 @@ class KenwoodHF(Rig):
 		split = self.parse('3d', args)
 		if self._state['control_main']._cached:
 			self._state['main_memory_channel']._cached = split[0]
-			self._main_rx_frequency_query()
-			self._main_tx_frequency_query()
 		else:
 			self._state['sub_memory_channel']._cached = split[0]
-			self._sub_frequency_query()
 		# Any time we get an MC300; it means we entered CALL mode
 		# The calling frequency *may* be different than last time!
 		if split[0] == 300:
@@ -3620,10 +4478,6 @@ class KenwoodHF(Rig):
 			newVal['MemoryGroup'] = split[13]
 			newVal['MemoryName'] = split[14]
 		self.memories.memories[split[1]]._cached = newVal
-		if split[1] == 300:
-			self._main_rx_frequency_query()
-			self._main_tx_frequency_query()
-			self._sub_frequency_query()
 
 	def _update_MU(self, args):
 		self._state['memory_groups']._cached = base2ba(2, args)
@@ -3711,6 +4565,8 @@ class KenwoodHF(Rig):
 		if split[0] and old == False:
 			self._set(self._state['auto_information'], 2)
 			self._fill_cache()
+			if self.memory_loader is not None:
+				self.memory_loader.start()
 		elif (not split[0]) and old == True:
 			self._kill_cache()
 
@@ -3747,11 +4603,15 @@ class KenwoodHF(Rig):
 
 	def _update_RM(self, args):
 		split = self.parse('1d4d', args)
+		# While sampling, the other meters keep their last reading
+		sampling = self.meter_sampler is not None and self.meter_sampler.running
 		self._state['meter_type']._cached = meter(split[0])
+		for t, name in ((1, 'swr_meter'), (2, 'compression_meter'), (3, 'alc_meter')):
+			if split[0] == t:
+				self._state[name]._cached = split[1]
+			elif not sampling:
+				self._state[name]._cached = 0
 		self._state['meter_value']._cached = split[1]
-		self._state['swr_meter']._cached = split[1] if split[0] == 1 else 0
-		self._state['compression_meter']._cached = split[1] if split[0] == 2 else 0
-		self._state['alc_meter']._cached = split[1] if split[0] == 3 else 0
 
 	# Note: Can only set RM2 when COMP is on
 
@@ -3807,6 +4667,9 @@ class KenwoodHF(Rig):
 	def _update_SM(self, args):
 		split = self.parse('1d4d', args)
 		# TODO: Figure out what 2 and 3 actually are...
+		# While transmitting, SM reads the power meter
+		if split[0] in (0, 1) and self._state[('main_tx', 'sub_tx')[split[0]]]._cached:
+			self._state['power_meter']._cached = split[1]
 		if split[0] == 0:
 			self._state['main_s_meter']._cached = split[1]
 		if split[0] == 1:
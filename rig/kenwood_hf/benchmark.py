@@ -0,0 +1,140 @@
+'''
+Microbenchmarks for the KenwoodHF backend, run against the simulated
+TS-2000 so no rig is needed:
+
+    python -m rig.kenwood_hf.benchmark
+'''
+
+from rig.benchmark import rate
+from rig.kenwood_hf import KenwoodHF, MemoryScanner
+from rig.kenwood_hf.simulator import SimulatedTS2000
+from time import monotonic, sleep
+
+def attribute_reads():
+	rig = KenwoodHF(serial = SimulatedTS2000())
+	rig.memory_loader.stop()
+	try:
+		main = rig.rigs[0]
+		sub = rig.rigs[1]
+		results = (
+			('rig.rx_frequency', rate('rig.rx_frequency', rig = rig)),
+			('rig.rigs[0].rx_frequency', rate('main.rx_frequency', main = main)),
+			('rig.rigs[1].mode', rate('sub.mode', sub = sub)),
+			('rig.main_rx_mode', rate('rig.main_rx_mode', rig = rig)),
+			('rig.get(\'rx_frequency\')', rate('rig.get(\'rx_frequency\')', rig = rig)),
+		)
+		for name, per_second in results:
+			print('{:32s} {:12,.0f} reads/s'.format(name, per_second))
+	finally:
+		rig.terminate()
+
+# Transmits for a few seconds on a simulated 4800 baud link and reports
+# how fast the meters were sampled
+def meter_sampling(seconds = 3, speed = 4800):
+	rig = KenwoodHF(serial = SimulatedTS2000(speed = speed))
+	rig.memory_loader.stop()
+	try:
+		rig.tx = True
+		sleep(seconds)
+		rig.tx = False
+		stats = rig.meter_sampler.stats()
+		print('{:32s} {:12.1f} cycles/s'.format('TX meter sampling', stats['rate']))
+		print('{:32s} {:12.1f} readings/s'.format('', stats['sample_rate']))
+		print('{:32s} {:12.2f} ms jitter'.format('', stats['jitter'] * 1000))
+	finally:
+		rig.terminate()
+
+# Sweeps 20m in 1kHz steps on a simulated 4800 baud link and compares
+# the step rate with what the link could carry.  Each step writes
+# FAnnnnnnnnnnn;SM0; and reads back the FA echo and the SM0 reply, and
+# the next step isn't written until the reply is read, so the limit is
+# the time to carry both directions.
+def band_sweep(speed = 4800):
+	rig = KenwoodHF(serial = SimulatedTS2000(speed = speed))
+	rig.memory_loader.stop()
+	try:
+		start = monotonic()
+		sweep = rig.sweep(14000000, 14350000, 1000)
+		sweep.wait()
+		elapsed = monotonic() - start
+		written = len('FA00014000000;SM0;')
+		read = len('FA00014000000;SM00000;')
+		limit = speed / 10 / (written + read)
+		print('{:32s} {:12.1f} steps/s ({} steps in {:.1f}s)'.format('20m band sweep', sweep.count / elapsed, sweep.count, elapsed))
+		print('{:32s} {:12.1f} steps/s'.format('  link limit', limit))
+	finally:
+		rig.terminate()
+
+# Scans memories 100 on up on a simulated 4800 baud link until the scan
+# stops on the busy channel at 14.228MHz.  The memories are loaded with
+# the link at full speed first.  The limit is one MC;SM0;BY; exchange
+# plus the minimum dwell per channel.
+def memory_scan(speed = 4800):
+	sim = SimulatedTS2000()
+	rig = KenwoodHF(serial = sim)
+	try:
+		while rig.memory_load_progress['done'] < rig.memory_load_progress['total']:
+			sleep(0.1)
+		sim.speed = speed
+		scan = rig.scan_memories(channels = range(100, 290))
+		scan.wait()
+		written = len('MC100;SM0;BY;')
+		read = len('MC100;SM00000;BY00;')
+		limit = 1 / ((written + read) * 10 / speed + MemoryScanner.MIN_DWELL)
+		print('{:32s} {:12.1f} channels/s ({} channels, stopped on {})'.format('Memory scan', scan.rate(), scan.scanned, scan.active))
+		print('{:32s} {:12.1f} channels/s'.format('  link and dwell limit', limit))
+	finally:
+		rig.terminate()
+
+# Compares frequency_ranges lookups with walking the bandplan the way
+# the frequency display used to
+def range_lookups():
+	from bandplan import bandplan
+	index = KenwoodHF.frequency_ranges.extend(segment = bandplan)
+	def linear(freq):
+		ret = None
+		for bc in bandplan.values():
+			if bc['low'] <= freq and bc['high'] >= freq:
+				ret = bc
+		return ret
+	results = (
+		('bandplan walk', rate('linear(28400000)', linear = linear)),
+		('frequency_ranges.band()', rate('index.band(28400000, \'segment\')', index = index)),
+		('frequency_ranges.lookup()', rate('index.lookup(28400000)', index = index)),
+	)
+	for name, per_second in results:
+		print('{:32s} {:12,.0f} lookups/s'.format(name, per_second))
+
+# Spins VFO A by 10Hz every 2ms for 200 steps on a simulated 4800 baud
+# link, and reports how many FA commands were sent and how long after
+# the last step the rig reached the target
+def vfo_tuning(steps = 200, speed = 4800):
+	sim = SimulatedTS2000(speed = speed)
+	rig = KenwoodHF(serial = sim)
+	rig.memory_loader.stop()
+	try:
+		target = rig.vfoa_frequency + steps * 10
+		written = sim.commands_written
+		for i in range(steps):
+			rig.tune('vfoa_frequency', 10)
+			sleep(0.002)
+		start = monotonic()
+		while rig._state['vfoa_frequency']._cached != target:
+			sleep(0.001)
+		settle = monotonic() - start
+		print('{:32s} {:12d} steps'.format('VFO tuning', steps))
+		print('{:32s} {:12d} commands sent'.format('', sim.commands_written - written))
+		print('{:32s} {:12.1f} ms to settle'.format('', settle * 1000))
+	finally:
+		rig.terminate()
+
+def main():
+	range_lookups()
+	attribute_reads()
+	meter_sampling()
+	vfo_tuning()
+	band_sweep()
+	memory_scan()
+
+if __name__ == '__main__':
+	main()
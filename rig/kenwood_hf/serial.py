@@ -1,23 +1,89 @@
 import rig.kenwood_hf
 from serial import Serial
 from time import time
-from queue import Queue
+from collections import deque
+from queue import Empty
 from sys import stderr
-from threading import Event
+from threading import Condition, Event
 
 # TODO: Do we need our own handler/callback here?
 
+# A FIFO of messages for the write thread.  Unlike queue.Queue, queued
+# messages can be removed or pulled forward without going through its
+# internals.
+class MessageQueue:
+	def __init__(self):
+		self._deque = deque()
+		self._cond = Condition()
+
+	def put(self, msg):
+		with self._cond:
+			self._deque.append(msg)
+			self._cond.notify()
+
+	def get(self, block = True, timeout = None):
+		with self._cond:
+			if block and not self._cond.wait_for(lambda: len(self._deque) > 0, timeout):
+				raise Empty
+			if len(self._deque) == 0:
+				raise Empty
+			return self._deque.popleft()
+
+	def empty(self):
+		return len(self._deque) == 0
+
+	def qsize(self):
+		return len(self._deque)
+
+	# Removes msg if it's still queued, returns True if it was
+	def remove(self, msg):
+		with self._cond:
+			for i in range(len(self._deque)):
+				if self._deque[i] is msg:
+					del self._deque[i]
+					return True
+			return False
+
+	# Removes and returns the messages from the front of the queue that
+	# take(msg) returns True for, up to the first one stop(msg) returns
+	# True for.  The others keep their places.
+	def take_front(self, take, stop):
+		ret = []
+		kept = []
+		with self._cond:
+			while len(self._deque) > 0 and not stop(self._deque[0]):
+				msg = self._deque.popleft()
+				if take(msg):
+					ret.append(msg)
+				else:
+					kept.append(msg)
+			self._deque.extendleft(reversed(kept))
+		return ret
+
 class KenwoodHFProtocol:
 	def __init__(self, port = "/dev/ttyU0", speed = 4800, stopbits = 2, **kwargs):
 		kwargs = {'verbose': False, **kwargs}
 		self._verbose = kwargs.get('verbose')
 		self._terminate = False
-		self.writeQueue = Queue(maxsize = 0)
+		self.writeQueue = MessageQueue()
+		# Only sent from when there is nothing in writeQueue
+		self.idleQueue = MessageQueue()
+		# Number of bytes of DC/TS switching avoided by grouping commands
+		self.context_bytes_saved = 0
 		self._last_hack = 0
 		self.PS_works = None
 		self.power_on = False
 		self._last_command = None
-		self._serial = Serial(baudrate = speed, stopbits = stopbits, rtscts = False, timeout = 0.01, inter_byte_timeout = 0.5)
+		# The message whose reply was last returned by read(), if any.
+		# Raw messages may carry 'reply' (the command of the reply which
+		# completes them) and 'on_reply' (called with the message once
+		# that reply is applied).
+		self.reply_to = None
+		# An already created port-like object (ie: a simulator) may be passed
+		self._serial = kwargs.get('serial')
+		if self._serial is None:
+			self._serial = Serial(baudrate = speed, stopbits = stopbits, rtscts = False, timeout = 0.01, inter_byte_timeout = 0.5)
+			self._serial.port = port
 		# Kenwood mostly uses RTR/CTS flow control, but with a
 		# special exception for when the radio is powered off.
 		# In this case, the radio does not wake when RTR is
@@ -26,7 +92,6 @@ class KenwoodHFProtocol:
 		# CTS is low, we can't use hardware RTS/CTS flow
 		# control.
 		self._serial.rts = True
-		self._serial.port = port
 		self._serial.open()
 		self._serial.reset_output_buffer()
 		self._serial.reset_input_buffer()
@@ -36,40 +101,95 @@ class KenwoodHFProtocol:
 	def terminate(self):
 		self._terminate = True
 
+	def _have_write(self):
+		return self._write_buffer != b'' or not self.writeQueue.empty() or not self.idleQueue.empty()
+
+	# Returns the receiver/TS context prefix and suffix a message needs,
+	# or None if it can't be grouped with other messages
+	def _context(self, msg):
+		if msg['msgType'] == 'set':
+			return msg['stateValue']._get_set_context()
+		if msg['msgType'] == 'query' and msg['stateValue']._query_command is not None:
+			return msg['stateValue']._get_query_prefix_suffix()
+		return None
+
+	# If msg needs a context switch, pulls later queued queries needing
+	# the same context forward so they can share the switch.  A query is
+	# only moved ahead of queries for other states, never ahead of a set,
+	# a batch, or anything for the same state.  Sets are not moved since
+	# their range checks may depend on the sets before them.
+	def _context_group(self, msg):
+		context = self._context(msg)
+		if context is None or context[0] == '':
+			return msg
+		skipped = set()
+		def take(m):
+			if m['stateValue'] not in skipped and self._context(m) == context:
+				return True
+			skipped.add(m['stateValue'])
+			return False
+		group = [msg] + self.writeQueue.take_front(take, lambda m: m['msgType'] != 'query')
+		if len(group) == 1:
+			return msg
+		return {
+			'msgType': 'batch',
+			'rig': msg['stateValue']._rig,
+			'messages': group,
+		}
+
 	def _set_event(self):
 		if self._event is not None:
 			self._event.set()
 
+	# True if the last command has been answered and the next one can be
+	# sent right away
+	def _write_ready(self):
+		return (self._event is None or self._event.is_set()) and self._serial.cts and self._have_write()
+
 	def read(self):
 		ret = b'';
+		self.reply_to = None
 		while not self._terminate:
-			# Always read first if possible.
+			# Always read first if possible, but don't wait for input
+			# that isn't there yet when a write is ready to go.
 			if self._serial.rts:
-				ret += self._serial.read_until(b';')
+				if self._serial.in_waiting > 0 or not self._write_ready():
+					ret += self._serial.read_until(b';')
 				if ret[-1:] == b';':
 					if self._verbose:
 						print("Read: "+str(ret), file=stderr)
 					ret = ret.replace(b'^[^A-Z]*', b'')
+					if self._event is not None and not self._event.is_set():
+						self.reply_to = self._last_command
 					self._set_event()
 					return ret
 				else:
 					if self._event is None or self._event.is_set():
-						if self._write_buffer != b'' or not self.writeQueue.empty():
+						if self._have_write():
 							self._serial.rts = False
 			if self._event is None or self._event.is_set():
 				self._event = None
-				if self._write_buffer != b'' or not self.writeQueue.empty():
+				if self._have_write():
 					if self._serial.cts:
 						self._serial.rts = False
 				if self._serial.cts:
-					if self._write_buffer != b'' or not self.writeQueue.empty():
+					if self._have_write():
 						if self._write_buffer == b'':
-							wr = self.writeQueue.get()
+							if not self.writeQueue.empty():
+								wr = self._context_group(self.writeQueue.get())
+							else:
+								wr = self.idleQueue.get()
 							self._last_command = wr
 							if wr['msgType'] == 'set':
 								newcmd = wr['stateValue']._set_string(wr['value'])
 							elif wr['msgType'] == 'query':
 								newcmd = wr['stateValue']._query_string()
+							elif wr['msgType'] == 'batch':
+								self._write_buffer = bytes(wr['rig']._batch_string(wr['messages']) + ';', 'ascii')
+								newcmd = None
+							elif wr['msgType'] == 'raw':
+								self._write_buffer = bytes(wr['command'] + ';', 'ascii')
+								newcmd = None
 							else:
 								raise Exception('Unhandled message type: '+str(wr['msgType']))
 							if newcmd is None:
@@ -0,0 +1,229 @@
+'''
+A simulated TS-2000 serial port, for benchmarking and for exercising
+the backend without a rig attached.  Pass an instance as the serial
+argument to KenwoodHF:
+
+    rig.kenwood_hf.KenwoodHF(serial = SimulatedTS2000())
+
+It answers every query the backend makes during its cache fill, echoes
+sets back the way the rig does in AI2 mode, and follows DC so that
+per-receiver commands affect the selected receiver.  It doesn't model
+anything beyond that (no scanning, tuning, etc).  Transmitting only
+changes what SM reports, and the meters report fixed values.  The main
+S meter shows a few fixed carriers (SIGNALS), and the main receiver is
+busy when one of them is at 10 or more.
+
+If speed is set, writes and reads are delayed by the time the bytes
+would take at that baud rate.
+
+Replies are normally ready to read as soon as write() returns.  If
+latency is set, each reply is only readable that many seconds after the
+command was written, in the order they were sent, the way replies come
+back over a real serial link.  A latency of 0 still makes replies
+arrive after write() has returned.
+'''
+
+from collections import deque
+from threading import Condition
+from time import monotonic, sleep
+import rig.kenwood_hf
+
+# Number of argument characters that are part of the command when querying
+QUERY_ARGS = {'AG': 1, 'AR': 1, 'SM': 1, 'SQ': 1, 'MR': 4, 'EX': 7}
+
+# Commands which are per-receiver and follow the DC setting
+PER_RECEIVER = ('AN', 'CN', 'CT', 'DQ', 'FD', 'FR', 'FS', 'FT', 'FW', 'MC', 'MD', 'NR', 'OF', 'OS', 'PC', 'QC', 'RA', 'SC', 'ST', 'TN', 'TO')
+
+# Commands which cause a change reported by an IF response
+IF_COMMANDS = ('UP', 'DN', 'BU', 'BD', 'CH', 'RC', 'SV', 'VR', 'CI', 'QI', 'PI')
+
+# Readings for each RM meter type, and the SM reading while transmitting
+METERS = {'0': '0000', '1': '0003', '2': '0008', '3': '0012'}
+POWER = '0020'
+
+# Carriers seen by the main S meter, each is 15 at the centre and falls
+# off by one every 500Hz
+SIGNALS = (3573000, 7074000, 14074000, 14230000, 21074000)
+
+def _default_state():
+	ret = {
+		'AC': '000', 'AG0': '0100', 'AG1': '1100', 'AI': '2', 'AL': '000', 'AM': '0', 'AN': '1',
+		'AR0': '000', 'AR1': '100', 'BC': '0', 'BP': '000', 'BY': '00', 'CA': '0', 'CG': '000',
+		'CM': '0', 'CN': '01', 'CT': '0', 'DC': '00', 'DQ': '0', 'FA': '00014074000',
+		'FB': '00007074000', 'FC': '00145000000', 'FD': '00000000', 'FR': '0', 'FS': '0', 'FT': '0',
+		'FW': '0000', 'GT': '002', 'ID': '019', 'IS': '+0000', 'KS': '020', 'KY': '0',
+		'LK': '00', 'LM': '0', 'LT': '0', 'MC': '000', 'MD': '2', 'MF': '0', 'MG': '050', 'ML': '000',
+		'MU': '0000000000', 'NB': '0', 'NL': '000', 'NR': '0', 'NT': '0', 'OF': '000000000', 'OS': '0',
+		'PA': '00', 'PB': '0', 'PC': '100', 'PK': '00014074000' + ' ' * 37, 'PL': '050050',
+		'PM': '0', 'PR': '0', 'PS': '1', 'QC': '000', 'QR': '00', 'RA': '00', 'RD': '0', 'RG': '255',
+		'RL': '00', 'RM': '1', 'RT': '0', 'SA': '0000000SATNAME ', 'SB': '1', 'SC': '0',
+		'SD': '1000', 'SH': '11', 'SL': '00', 'SM0': '00005', 'SM1': '10000', 'SM2': '20000',
+		'SM3': '30000', 'SQ0': '0000', 'SQ1': '1000', 'ST': '00', 'TC': '01', 'TI': '000',
+		'TN': '01', 'TO': '0', 'TS': '0', 'TY': '000', 'VD': '0100', 'VG': '004', 'VX': '0',
+		'XT': '0', 'EX0120000': '01200001', 'EX0060100': '00601000', 'EX0270000': '02700000',
+		'EX0500100': '05001000',
+	}
+	for i in range(301):
+		for s in (0, 1):
+			ret['MR{:1d}{:03d}'.format(s, i)] = '{:1d}{:03d}{:011d}200010100000000000000000MEM{:03d}'.format(s, i, 14000000 + i * 1000, i)
+	return ret
+
+class SimulatedTS2000:
+	def __init__(self, speed = None, latency = None):
+		self.port = 'simulated'
+		self.rts = True
+		self.cts = True
+		self.speed = speed
+		self.latency = latency
+		# (time readable, bytes) for replies not yet readable
+		self._delayed = deque()
+		# One set of per-receiver state for main and sub
+		self.state = (_default_state(), _default_state())
+		self.state[1]['MD'] = '4'
+		self._control = 0
+		self._transmitting = None
+		self._output = b''
+		self._cond = Condition()
+		self.bytes_written = 0
+		self.commands_written = 0
+
+	def open(self):
+		pass
+
+	def reset_output_buffer(self):
+		pass
+
+	def reset_input_buffer(self):
+		pass
+
+	def _get(self, key):
+		if key[:2] in PER_RECEIVER:
+			return self.state[self._control][key]
+		return self.state[0][key]
+
+	def _put(self, key, value):
+		if key[:2] in PER_RECEIVER:
+			self.state[self._control][key] = value
+		else:
+			self.state[0][key] = value
+
+	def _respond(self, response):
+		with self._cond:
+			if self.latency is None:
+				self._output += bytes(response, 'ascii') + b';'
+			else:
+				self._delayed.append((monotonic() + self.latency, bytes(response, 'ascii') + b';'))
+			self._cond.notify_all()
+
+	# Moves the delayed replies which are now readable to the output.
+	# Must be called with _cond held.
+	def _deliver(self):
+		now = monotonic()
+		while len(self._delayed) > 0 and self._delayed[0][0] <= now:
+			self._output += self._delayed.popleft()[1]
+
+	def _main_frequency(self):
+		st = self.state[0]
+		if st['FR'] == '1':
+			return st['FB']
+		if st['FR'] == '2':
+			return st['MR0' + st['MC']][4:15]
+		return st['FA']
+
+	def _if_response(self):
+		st = self.state[self._control]
+		if self._control == 1:
+			freq = st['FC']
+		else:
+			freq = self._main_frequency()
+		return 'IF' + freq + '0000+0000000' + st['MC'] + '0' + st['MD'] + st['FR'] + st['SC'] + '0001' + st['OS']
+
+	def _level(self, freq):
+		return max([0] + [15 - abs(freq - s) // 500 for s in SIGNALS])
+
+	def _command(self, cmd):
+		name = cmd[:2]
+		args = cmd[2:]
+		qlen = QUERY_ARGS.get(name, 0)
+		if name == 'IF':
+			self._respond(self._if_response())
+			return
+		if name in ('TX', 'RX'):
+			self._transmitting = int(args or '0') if name == 'TX' else None
+			self._respond(name + (args or '0'))
+			return
+		if name == 'RM':
+			if args != '':
+				self.state[0]['RM'] = args
+			self._respond('RM' + self.state[0]['RM'] + METERS[self.state[0]['RM']])
+			return
+		if name == 'SM' and self._transmitting is not None and int(args) == self._transmitting:
+			self._respond('SM' + args + POWER)
+			return
+		if name == 'SM' and args == '0':
+			self._respond('SM0{:04d}'.format(self._level(int(self._main_frequency()))))
+			return
+		if name == 'BY':
+			self._respond('BY{:1d}0'.format(self._level(int(self._main_frequency())) >= 10))
+			return
+		if name in IF_COMMANDS or (name in ('KY', 'RU', 'RD', 'TD') and len(args) > 1):
+			self._respond(self._if_response())
+			return
+		key = name + args[:qlen]
+		if len(args) > qlen:
+			if name == 'DC':
+				self.state[0]['DC'] = args
+				self._control = int(args[1])
+			elif name == 'FR':
+				self._put('FR', args)
+				self._put('FT', args)
+			else:
+				self._put(key, args)
+			self._respond(name + args)
+			return
+		try:
+			self._respond(name + self._get(key))
+		except KeyError:
+			self._respond('?')
+
+	def write(self, data):
+		self.bytes_written += len(data)
+		if self.speed:
+			sleep(len(data) * 10 / self.speed)
+		for cmd in data.split(b';'):
+			if cmd != b'':
+				self.commands_written += 1
+				self._command(cmd.decode('ascii'))
+		return len(data)
+
+	@property
+	def in_waiting(self):
+		with self._cond:
+			self._deliver()
+			return len(self._output)
+
+	def read_until(self, terminator):
+		with self._cond:
+			self._deliver()
+			if self._output == b'':
+				timeout = 0.01
+				if len(self._delayed) > 0:
+					timeout = min(timeout, max(self._delayed[0][0] - monotonic(), 0))
+				self._cond.wait(timeout)
+				self._deliver()
+			end = self._output.find(terminator)
+			if end == -1:
+				ret = self._output
+				self._output = b''
+			else:
+				ret = self._output[:end + 1]
+				self._output = self._output[end + 1:]
+		if self.speed:
+			sleep(len(ret) * 10 / self.speed)
+		return ret
+
+# Creates a KenwoodHF attached to a new simulator, for the 'simulator'
+# rig backend.  Reads and writes are delayed to match speed, and replies
+# by latency, if they're passed.
+def simulated_rig(**kwargs):
+	return rig.kenwood_hf.KenwoodHF(serial = SimulatedTS2000(speed = kwargs.get('speed'), latency = kwargs.get('latency')), **kwargs)
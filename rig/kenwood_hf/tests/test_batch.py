@@ -0,0 +1,53 @@
+import unittest
+from rig.kenwood_hf import KenwoodHF, mode
+from rig.kenwood_hf.simulator import SimulatedTS2000
+
+class BatchOrderTest(unittest.TestCase):
+	def setUp(self):
+		self.rig = KenwoodHF(serial = SimulatedTS2000())
+		self.rig.memory_loader.stop()
+		# The main receiver has control, so sub sets need a DC switch
+		self.assertEqual(self.rig.control_list, [True, True])
+
+	def tearDown(self):
+		self.rig.terminate()
+
+	def _set(self, name, value):
+		return {'msgType': 'set', 'stateValue': self.rig._state[name], 'value': value}
+
+	def test_sets_stay_in_order(self):
+		cmds = self.rig._batch_string([
+			self._set('sub_mode', mode.FM),
+			self._set('vfoa_frequency', 14075000),
+			self._set('sub_vfo_frequency', 145100000),
+			self._set('sub_mode', mode.AM),
+		])
+		self.assertEqual(cmds, 'DC11;MD4;DC00;FA00014075000;FC00145100000;DC11;MD5;DC00')
+
+	def test_adjacent_sets_share_a_switch(self):
+		cmds = self.rig._batch_string([
+			self._set('sub_mode', mode.FM),
+			self._set('sub_mode', mode.AM),
+			self._set('vfoa_frequency', 14075000),
+		])
+		self.assertEqual(cmds, 'DC11;MD4;MD5;DC00;FA00014075000')
+
+	def test_control_change_ends_the_switch(self):
+		cmds = self.rig._batch_string([
+			self._set('sub_mode', mode.FM),
+			self._set('control_list', [False, False]),
+			self._set('sub_mode', mode.AM),
+		])
+		self.assertEqual(cmds, 'DC11;MD4;DC00;DC00;DC11;MD5;DC00')
+
+	def test_setting_again_moves_to_the_end(self):
+		with self.rig.batch():
+			self.rig.vfoa_frequency = 14075000
+			self.rig.vfob_frequency = 7075000
+			self.rig.vfoa_frequency = 14076000
+			items = self.rig._batch_local.items
+			self.assertEqual([state.name for state in items], ['vfob_frequency', 'vfoa_frequency'])
+			self.assertEqual(list(items.values()), [7075000, 14076000])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from time import sleep
+from rig.kenwood_hf import KenwoodHF, tuningMode
+from rig.kenwood_hf.simulator import SimulatedTS2000
+
+LATENCY = 0.002
+
+class DerivedValueTest(unittest.TestCase):
+	def setUp(self):
+		self.sim = SimulatedTS2000(latency = LATENCY)
+		self.rig = KenwoodHF(serial = self.sim)
+		self.rig.memory_loader.stop()
+		self.assertEqual(self.rig.rx_frequency, 14074000)
+
+	def tearDown(self):
+		self.rig.terminate()
+
+	def test_age_is_the_oldest_inputs(self):
+		sleep(0.3)
+		rx = self.rig._state['main_rx_frequency']
+		self.assertGreaterEqual(rx.age, 0.3)
+		inputs = ('main_rx_tuning_mode', 'vfoa_frequency')
+		self.assertEqual(rx._timestamp, min(self.rig._state[name]._timestamp for name in inputs))
+
+	def test_max_age_refreshes_the_vfo(self):
+		sleep(0.1)
+		# Tuned from the front panel without auto information
+		self.sim.state[0]['FA'] = '00007000000'
+		self.assertEqual(self.rig.get('rx_frequency'), 14074000)
+		self.assertEqual(self.rig.get('rx_frequency', 0), 7000000)
+		self.assertLess(self.rig._state['main_rx_frequency'].age, 0.1)
+
+	def test_max_age_refreshes_the_tuning_mode(self):
+		sleep(0.1)
+		self.sim.state[0]['FR'] = '2'
+		self.sim.state[0]['MC'] = '005'
+		self.assertEqual(self.rig.get('rx_frequency', 0), 14005000)
+		self.assertEqual(self.rig.main_rx_tuning_mode, tuningMode.MEMORY)
+
+	def test_get_many_refreshes_the_vfo(self):
+		sleep(0.1)
+		self.sim.state[0]['FA'] = '00007000000'
+		self.sim.state[0]['FB'] = '00003573000'
+		values = self.rig.get_many(['rx_frequency', 'vfob_frequency'], 0)
+		self.assertEqual(values, {'rx_frequency': 7000000, 'vfob_frequency': 3573000})
+
+	def test_get_many_refreshes_the_tuning_mode(self):
+		sleep(0.1)
+		self.sim.state[0]['FR'] = '2'
+		self.sim.state[0]['MC'] = '005'
+		values = self.rig.get_many(['rx_frequency', 'main_rx_tuning_mode'], 0)
+		self.assertEqual(values, {'rx_frequency': 14005000, 'main_rx_tuning_mode': tuningMode.MEMORY})
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from time import monotonic, sleep
+from rig.kenwood_hf import KenwoodHF, tuningMode
+from rig.kenwood_hf.simulator import SimulatedTS2000
+
+EMPTY = 10
+
+class EmptyMemoryTest(unittest.TestCase):
+	def setUp(self):
+		self.sim = SimulatedTS2000()
+		# A mode of zero is an empty channel
+		for s in (0, 1):
+			self.sim.state[0]['MR{:1d}{:03d}'.format(s, EMPTY)] = '{:1d}{:03d}{:011d}000010100000000000000000'.format(s, EMPTY, 0)
+		self.rig = KenwoodHF(serial = self.sim)
+		self.rig.memory_loader.stop()
+		self.assertEqual(self.rig.rx_frequency, 14074000)
+
+	def tearDown(self):
+		self.rig.terminate()
+
+	def test_tune_to_empty_memory(self):
+		self.rig.main_memory_channel = EMPTY
+		self.rig.main_rx_tuning_mode = tuningMode.MEMORY
+		sleep(0.2)
+		self.assertEqual(self.rig.memories.memories[EMPTY]._cached, {})
+		self.assertIsNone(self.rig.rx_frequency)
+		# The rig is still there
+		self.assertTrue(self.rig._readThread.is_alive())
+		self.sim.state[0]['FA'] = '00007000000'
+		self.rig.main_rx_tuning_mode = tuningMode.VFOA
+		sleep(0.2)
+		self.assertEqual(self.rig.get('rx_frequency', 0), 7000000)
+
+class MemoryLoaderTest(unittest.TestCase):
+	def setUp(self):
+		self.rig = KenwoodHF(serial = SimulatedTS2000())
+		self.rig.memory_loader.stop()
+
+	def tearDown(self):
+		self.rig.terminate()
+
+	def test_unreadable_channel_is_skipped(self):
+		mem = self.rig.memories.memories[EMPTY]
+		queries = []
+		# No query is sent, so the channel reads as None
+		def unreadable():
+			queries.append(monotonic())
+			return None
+		mem._query_string = unreadable
+		self.rig.memory_loader.restart()
+		deadline = monotonic() + 30
+		while self.rig.memory_loader.running and monotonic() < deadline:
+			sleep(0.1)
+		self.assertEqual(self.rig.memory_load_progress['done'], self.rig.memory_load_progress['total'])
+		self.assertEqual(len(queries), self.rig.memory_loader.RETRIES + 1)
+		self.assertIsNone(mem._cached)
+		self.assertEqual(self.rig.memories.memories[EMPTY + 1]._cached['Frequency'], 14000000 + (EMPTY + 1) * 1000)
+		self.assertEqual(self.rig.memories.memories[300]._cached['Channel'], 300)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from time import monotonic, sleep
+from rig.kenwood_hf import KenwoodHF, MemoryScanner, tuningMode
+from rig.kenwood_hf.simulator import SimulatedTS2000
+
+LATENCY = 0.005
+
+class MemoryScannerTest(unittest.TestCase):
+	def setUp(self):
+		self.rig = KenwoodHF(serial = SimulatedTS2000(latency = LATENCY))
+		deadline = monotonic() + 30
+		while self.rig.memory_load_progress['done'] < self.rig.memory_load_progress['total'] and monotonic() < deadline:
+			sleep(0.1)
+
+	def tearDown(self):
+		self.rig.terminate()
+
+	# Memory n is at 14000000 + n * 1000, and the carrier at 14230000
+	# makes 228 the first busy channel
+	def test_stops_on_busy_channel_with_delayed_replies(self):
+		scan = self.rig.scan_memories(channels = range(220, 240))
+		self.assertTrue(scan.wait(20))
+		self.assertEqual(scan.active, 228)
+		self.assertEqual(self.rig.main_memory_channel, 228)
+		self.assertEqual(scan.scanned, 9)
+
+	def test_dwells_at_least_min_dwell(self):
+		scan = self.rig.scan_memories(channels = range(0, 5), loop = False)
+		start = monotonic()
+		self.assertTrue(scan.wait(20))
+		self.assertIsNone(scan.active)
+		self.assertEqual(scan.scanned, 5)
+		self.assertGreaterEqual(monotonic() - start, 5 * MemoryScanner.MIN_DWELL)
+
+	def test_other_busy_reads_are_not_replies(self):
+		scan = self.rig.scan_memories(channels = range(220, 240))
+		busy = self.rig._state['busy_list']
+		for i in range(5):
+			busy._cached = None
+			self.rig._serial.idleQueue.put({'msgType': 'query', 'stateValue': busy})
+		self.assertTrue(scan.wait(20))
+		self.assertEqual(scan.active, 228)
+
+	def test_abort_restores_tuning(self):
+		self.rig.main_rx_tuning_mode = tuningMode.VFOA
+		sleep(0.2)
+		scan = self.rig.scan_memories(channels = range(0, 100))
+		sleep(0.3)
+		scan.abort()
+		scan.resume()
+		sleep(0.3)
+		scan.abort()
+		self.assertTrue(scan.wait(5))
+		sleep(0.3)
+		self.assertEqual(self.rig.main_rx_tuning_mode, tuningMode.VFOA)
+
+if __name__ == '__main__':
+	unittest.main()
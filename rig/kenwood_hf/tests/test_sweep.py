@@ -0,0 +1,48 @@
+import unittest
+from math import isnan
+from time import sleep
+from rig.kenwood_hf import KenwoodHF, tuningMode
+from rig.kenwood_hf.simulator import SimulatedTS2000
+
+# Replies arrive after the write returns, the way they do over a real
+# serial link
+LATENCY = 0.005
+
+class BandSweepTest(unittest.TestCase):
+	def setUp(self):
+		self.rig = KenwoodHF(serial = SimulatedTS2000(latency = LATENCY))
+		self.rig.memory_loader.stop()
+
+	def tearDown(self):
+		self.rig.terminate()
+
+	def test_completes_with_delayed_replies(self):
+		sweep = self.rig.sweep(14070000, 14078000, 1000)
+		self.assertTrue(sweep.wait(10))
+		freqs, levels = sweep.result()
+		self.assertEqual(list(levels), [7, 9, 11, 13, 15, 13, 11, 9, 7])
+		self.assertEqual(freqs[levels.argmax()], 14074000)
+
+	def test_other_s_meter_reads_are_not_readings(self):
+		sweep = self.rig.sweep(14070000, 14078000, 1000)
+		meter = self.rig._state['main_s_meter']
+		for i in range(5):
+			meter._cached = None
+			self.rig._serial.idleQueue.put({'msgType': 'query', 'stateValue': meter})
+		self.assertTrue(sweep.wait(10))
+		self.assertFalse(any(isnan(level) for level in sweep.levels))
+
+	def test_resume_after_abort_restores_tuning(self):
+		self.rig.main_rx_tuning_mode = tuningMode.MEMORY
+		sleep(0.2)
+		sweep = self.rig.sweep(14000000, 14100000, 1000)
+		sleep(0.2)
+		sweep.abort()
+		sweep.resume()
+		self.assertTrue(sweep.wait(20))
+		sleep(0.3)
+		self.assertEqual(self.rig.main_rx_tuning_mode, tuningMode.MEMORY)
+		self.assertEqual(self.rig.vfoa_frequency, 14074000)
+
+if __name__ == '__main__':
+	unittest.main()
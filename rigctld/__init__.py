@@ -626,6 +626,8 @@ class rigctld_connection:
 		self.append(bytes("CHKVFO {:1d}\n".format(self._vfo_mode), 'ascii'))
 
 	def _dump_state(self, command):
+		# Clients poll these next, so fetch them all in one go
+		self._rigctld.rig.get_many(('rx_frequency', 'tx_frequency', 'rx_mode', 'tx_mode', 'split', 'tx'), self._rigctld.max_age)
 		# TODO: Flesh this out
 		self.append(b"1\n")                   # Protocol version
 		self.append(b"2\n")                   # Rig model (dummy)
@@ -675,7 +677,7 @@ class rigctld_connection:
 			self.append(bytes('RPRT {:d}\n'.format(error.RIG_EINVAL), 'ascii'))
 			return
 		self.currVFO = vfo
-		if not self._rigctld.rig.split:
+		if not self._rigctld.rig.get('split', self._rigctld.max_age):
 			self.rxVFO = vfo
 		self.append(bytes('RPRT 0\n', 'ascii'))
 
@@ -689,15 +691,15 @@ class rigctld_connection:
 
 	def _get_freq(self, command):
 		if command['vfo'] == self.rxVFO:
-			self.append(bytes(str(self._rigctld.rig.rx_frequency)+'\n', 'ascii'))
+			self.append(bytes(str(self._rigctld.rig.get('rx_frequency', self._rigctld.max_age))+'\n', 'ascii'))
 		else:
-			self.append(bytes(str(self._rigctld.rig.tx_frequency)+'\n', 'ascii'))
+			self.append(bytes(str(self._rigctld.rig.get('tx_frequency', self._rigctld.max_age))+'\n', 'ascii'))
 
 	def _get_mode(self, command):
 		if command['vfo'] == self.rxVFO:
-			mode = self._rigctld.rig.rx_mode
+			mode = self._rigctld.rig.get('rx_mode', self._rigctld.max_age)
 		else:
-			mode = self._rigctld.rig.tx_mode
+			mode = self._rigctld.rig.get('tx_mode', self._rigctld.max_age)
 		self.send_mode(mode)
 		self.append(bytes(str(2800) + '\n', 'ascii'))
 
@@ -777,7 +779,7 @@ class rigctld_connection:
 		self.append(bytes('RPRT 0\n', 'ascii'))
 
 	def _get_split_vfo(self, command):
-		self.append(bytes('{:d}\n'.format(self._rigctld.rig.split), 'ascii'))
+		self.append(bytes('{:d}\n'.format(self._rigctld.rig.get('split', self._rigctld.max_age)), 'ascii'))
 		if self.rxVFO == vfo.VFOA:
 			self.append(b"VFOA\n")
 		else:
@@ -793,7 +795,7 @@ class rigctld_connection:
 		self.append(bytes('RPRT 0\n', 'ascii'))
 
 	def _get_ptt(self, command):
-		self.append(bytes('{:d}\n'.format(self._rigctld.rig.tx), 'ascii'))
+		self.append(bytes('{:d}\n'.format(self._rigctld.rig.get('tx', self._rigctld.max_age)), 'ascii'))
 
 	def _set_freq(self, command):
 		vfo = command['vfo']
@@ -808,7 +810,7 @@ class rigctld_connection:
 
 	def _set_split_mode(self, command):
 		# We ignore the VFO passed in and set the mode for both
-		if not self._rigctld.rig.split:
+		if not self._rigctld.rig.get('split', self._rigctld.max_age):
 			self.append(bytes('RPRT {:d}\n'.format(error.RIG_EINVAL), 'ascii'))
 			return
 		mode = self.get_rig_mode(command['argv'][0])
@@ -1014,9 +1016,11 @@ class rigctld_connection:
 			self._rigctld.sel.modify(self._conn, self.mask, data = self)
 
 class rigctld:
-	def __init__(self, rigobj, address = 'localhost', port = 4532, verbose = False):
+	def __init__(self, rigobj, address = 'localhost', port = 4532, verbose = False, max_age = None):
 		self.rig = rigobj
 		self.verbose = verbose
+		# Cached values older than this many seconds are queried again
+		self.max_age = max_age
 		self.sel = selectors.DefaultSelector()
 		self._address = address
 		self._port = port
@@ -0,0 +1,145 @@
+import json
+import socket
+import threading
+import unittest
+from time import sleep
+import rig
+import neatc
+import neatd
+from rig import binary
+from rig.kenwood_hf import KenwoodHF
+from rig.kenwood_hf.simulator import SimulatedTS2000
+
+PORT = 35320
+
+class NeatDTest(unittest.TestCase):
+	def setUp(self):
+		self.sim = SimulatedTS2000()
+		self.rig = KenwoodHF(serial = self.sim)
+		self.rig.memory_loader.stop()
+		self.neatd = neatd.NeatD(rig = self.rig, config = {'Neat': {'rigctld': 0, 'neatd_port': PORT}})
+		self.thread = threading.Thread(target = self.neatd.serve, name = 'neatd')
+		self.thread.start()
+		self.socks = []
+
+	def tearDown(self):
+		for sock in self.socks:
+			sock.close()
+		self.neatd.terminate()
+		self.thread.join()
+		self.rig.terminate()
+
+	def connect(self):
+		for attempt in range(50):
+			try:
+				sock = socket.create_connection(('localhost', PORT))
+				break
+			except ConnectionRefusedError:
+				sleep(0.1)
+		sock.settimeout(5)
+		self.socks.append(sock)
+		return sock, sock.makefile('rb')
+
+	def closed(self, fp):
+		try:
+			return fp.read() == b''
+		except ConnectionResetError:
+			return True
+
+	# Switches to binary mode, and returns the value IDs by name
+	def binary(self, sock, fp):
+		sock.sendall(b'list\n')
+		names = binary.expand_names(fp.readline().split()[1:])
+		sock.sendall(b'binary\n')
+		self.assertEqual(fp.readline(), b'binary\n')
+		return {names[i].decode('ascii'): i for i in range(len(names))}
+
+	# Returns the next frame's payload
+	def frame(self, fp):
+		length = int.from_bytes(fp.read(2), 'big')
+		if length == 0xffff:
+			length = int.from_bytes(fp.read(4), 'big')
+		return fp.read(length)
+
+	def test_long_line_closes_the_connection(self):
+		sock, fp = self.connect()
+		sock.sendall(b'x' * 200000)
+		self.assertTrue(self.closed(fp))
+		sock, fp = self.connect()
+		sock.sendall(b'get rx_frequency\n')
+		self.assertEqual(fp.readline(), b'rx_frequency=14074000\n')
+
+	def test_client_terminates_when_the_server_stops(self):
+		self.connect()
+		client = neatc.NeatC(port = PORT)
+		stopped = threading.Event()
+		client.add_terminate_callback(stopped.set)
+		self.assertEqual(client.rx_frequency, 14074000)
+		self.neatd.terminate()
+		self.assertTrue(stopped.wait(5))
+
+	def test_malformed_frames_are_ignored(self):
+		sock, fp = self.connect()
+		ids = self.binary(sock, fp)
+		vid = ids['rx_frequency']
+		sock.sendall(b''.join([
+			binary.frame(b''),
+			binary.frame(bytes((binary.GET,))),
+			binary.frame(bytes((binary.GET, 0))),
+			binary.frame(bytes((binary.VALUES,)) + binary.encode_value(1)),
+			binary.frame(bytes((binary.VALUE, 0, vid)) + binary.encode_value(1)),
+			binary.frame(bytes((binary.VALUES + 1, 0, vid))),
+			binary.command(binary.WATCH, len(ids)),
+			binary.frame(bytes((binary.SET, 0, vid, 0xff))),
+			binary.get(vid),
+		]))
+		msg_type, rvid, rest = binary.parse(self.frame(fp))
+		self.assertEqual((msg_type, rvid), (binary.VALUE, vid))
+		self.assertEqual(binary.decode_value(rest)[0], 14074000)
+
+	# Sends an mget and returns the reply
+	def mget(self, sock, fp, args):
+		sock.sendall(b'mget ' + args + b'\n')
+		line = fp.readline()
+		self.assertEqual(line[:5], b'mget ')
+		return json.loads(line[5:])
+
+	def test_mget(self):
+		sock, fp = self.connect()
+		self.assertEqual(self.mget(sock, fp, b'vfoa_frequency vfob_frequency'), {'vfoa_frequency': 14074000, 'vfob_frequency': 7074000})
+		self.assertEqual(self.mget(sock, fp, b'vfo*_frequency'), {'vfoa_frequency': 14074000, 'vfob_frequency': 7074000})
+		self.assertEqual(self.mget(sock, fp, b'no_such_value rx_frequency'), {'no_such_value': None, 'rx_frequency': 14074000})
+
+	def test_mget_max_age(self):
+		sock, fp = self.connect()
+		sleep(0.1)
+		# Tuned from the front panel without auto information
+		self.sim.state[0]['FA'] = '00007000000'
+		self.assertEqual(self.mget(sock, fp, b'rx_frequency'), {'rx_frequency': 14074000})
+		self.assertEqual(self.mget(sock, fp, b'rx_frequency 0'), {'rx_frequency': 7000000})
+
+	def test_binary_mget(self):
+		sock, fp = self.connect()
+		ids = self.binary(sock, fp)
+		sock.sendall(binary.text(b'mget vfoa_frequency vfob_frequency'))
+		msg_type, vid, rest = binary.parse(self.frame(fp))
+		self.assertEqual(msg_type, binary.VALUES)
+		self.assertEqual(binary.decode_values(rest), [(ids['vfoa_frequency'], 14074000), (ids['vfob_frequency'], 7074000)])
+
+	def test_mset(self):
+		sock, fp = self.connect()
+		sock.sendall(b'mset {"vfoa_frequency": 14075000, "vfob_frequency": 7075000}\n')
+		sleep(0.2)
+		self.assertEqual(self.mget(sock, fp, b'vfoa_frequency vfob_frequency 0'), {'vfoa_frequency': 14075000, 'vfob_frequency': 7075000})
+		self.assertEqual((self.sim.state[0]['FA'], self.sim.state[0]['FB']), ('00014075000', '00007075000'))
+
+	def test_malformed_mset_is_ignored(self):
+		sock, fp = self.connect()
+		sock.sendall(b'mset [14075000]\n')
+		sock.sendall(b'mset {"vfoa_frequency": \n')
+		sock.sendall(b'mset {"vfob_frequency\\u00e9": 1, "vfob_frequency": 7075000}\n')
+		sleep(0.2)
+		self.assertEqual(self.mget(sock, fp, b'vfoa_frequency vfob_frequency 0'), {'vfoa_frequency': 14074000, 'vfob_frequency': 7075000})
+
+if __name__ == '__main__':
+	unittest.main()